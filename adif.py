@@ -19,11 +19,14 @@ It is responsible for:
 """
 
 import logging
+import mmap
 import os.path
-import pickle
 import re
-from datetime import datetime, timedelta, timezone
-from qso import QSO
+from array import array
+from collections import namedtuple
+from collections.abc import Mapping
+from qso import QSO, _ESSENTIAL_KEYS, freq_to_band
+from selection import compile_selection
 
 
 class AdifError(Exception):
@@ -243,13 +246,741 @@ def adif_to_qso_list(_adif_fields: list):
     return _qso_list
 
 
-def qso_list_from_file(filename: str):
-    """Convenience function to convert an ADIF file into a QSO list"""
-    field_list = parse_adif_file(filename)
-    qso_list: list[QSO] = adif_to_qso_list(field_list)
+class AdifReader:
+    """Incremental ADIF record reader
+
+    Text can be fed in arbitrary chunks with feed(), which returns the QSO
+    field dicts (uppercase keys) completed so far. Incomplete records are kept
+    in an internal buffer until the next chunk arrives. Header data is
+    discarded as soon as EOH is found, as remove_header() does.
+
+    select is a selection expression (string or selection.Selection): records
+    not matching it are not returned. A record is discarded as soon as the
+    fields read so far decide the outcome, the rest of its values are skipped
+    without being copied.
+
+    fields is an optional collection of field names: only these fields (and
+    the ones needed by select) are copied into the records."""
+
+    def __init__(self, select=None, fields=None):
+        self.select = compile_selection(select)
+        self.fields = None
+        if fields is not None:
+            self.fields = frozenset(f.upper() for f in fields)
+            if self.select is not None:
+                self.fields |= self.select.fields
+        # Unparsed text, always starting at a record boundary
+        self._buffer = ''
+        # Fields of the trailing incomplete record, set by close()
+        self._record = {}
+        # Number of records completed so far (header excluded)
+        self.record_count = 0
+        # Number of records discarded by the selection
+        self.rejected_count = 0
+
+    def feed(self, data: str):
+        """Parse a chunk of ADIF text and return the list of completed records"""
+        self._buffer += data
+        return self._scan(final=False)
+
+    def close(self):
+        """Parse the remaining buffered text, raising AdifError on incomplete records"""
+        records = self._scan(final=True)
+        if self._record:
+            raise AdifError("End of list found before EOR")
+        return records
+
+    def _scan(self, final: bool):
+        """Scan the buffer and return the completed records"""
+        _adif = self._buffer
+        select = self.select
+        projection = self.fields
+        records = []
+        record = {}
+        # The current record has been discarded by the selection
+        rejected = False
+        # Start of the record being parsed, the buffer is trimmed here
+        record_start = 0
+        cursor = 0
+        while True:
+            match = _FIELD_GENERIC_RE_NO_VALUE.search(_adif, cursor)
+            if match is None:
+                break
+
+            field = match.group('field').upper()
+            length = match.group('len')
+
+            if field == 'EOR':
+                cursor = match.end()
+                record_start = cursor
+                self.record_count += 1
+                if not rejected and (select is None or select(record)):
+                    records.append(record)
+                else:
+                    self.rejected_count += 1
+                record = {}
+                rejected = False
+                continue
+            if field == 'EOH':
+                # Everything found so far was header data
+                cursor = match.end()
+                record_start = cursor
+                record = {}
+                rejected = False
+                continue
+
+            length = int(length or 0)
+            if length <= 0:
+                raise AdifError(
+                    f"Invalid length ({length}) for field {field}, must be positive")
+
+            value_end = match.end() + length
+            if value_end > len(_adif):
+                if final:
+                    raise AdifError(
+                        f"Impossible to fetch {length} bytes from log, found {len(_adif) - match.end()}")
+                # Value not fully received yet
+                break
+
+            cursor = value_end
+            if rejected or (projection is not None and field not in projection):
+                continue
+            if field in record:
+                raise AdifError(f"Duplicate field {field} ({record[field]})")
+            record[field] = _adif[match.end():value_end]
+            if select is not None and field in select.fields and select.decide(record) is False:
+                rejected = True
+
+        # Keep the incomplete record for the next chunk
+        self._buffer = _adif[record_start:]
+        self._record = record if final else {}
+        return records
+
+
+def iter_qso_string(_adif: str, select=None, fields=None):
+    """Generator of the QSO objects contained in an ADIF string
+
+    See AdifReader for select and fields"""
+    reader = AdifReader(select=select, fields=fields)
+    for record in reader.feed(_adif) + reader.close():
+        yield QSO(record)
+
+
+def iter_qso_file(filename: str, select=None, fields=None, blocksize: int = 1 << 20, lazy: bool = False):
+    """Generator of the QSO objects contained in an ADIF file
+
+    The file is read in blocks of blocksize characters, so memory usage does
+    not depend on the file size. See AdifReader for select and fields.
+
+    With lazy the file is memory mapped instead and the QSOs hold LazyRecord
+    objects, see iter_lazy_records(). The map stays open while QSOs use it."""
+    assert isinstance(filename, str)
+    if lazy:
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for record in iter_lazy_records(buf, select=select, fields=fields):
+            yield QSO.from_record(record)
+        return
+    reader = AdifReader(select=select, fields=fields)
+    with open(filename, 'rt') as f:
+        while True:
+            data = f.read(blocksize)
+            if not data:
+                break
+            for record in reader.feed(data):
+                yield QSO(record)
+    for record in reader.close():
+        yield QSO(record)
+
+
+# End of record tag, on raw bytes
+_EOR_RE_BYTES = re.compile(rb"<eor>", re.IGNORECASE)
+
+
+def _feed_each_record(data: bytes, offset: int, filename: str, select=None, fields=None):
+    """Records of the complete records in data, parsed one at a time
+
+    Invalid records are skipped, logging their byte offset (data starts at
+    offset in the file)"""
+    records = []
+    start = 0
+    for match in _EOR_RE_BYTES.finditer(data):
+        try:
+            records += AdifReader(select=select, fields=fields).feed(
+                data[start:match.end()].decode('utf-8'))
+        except (AdifError, UnicodeDecodeError) as e:
+            logging.warning(
+                f"{filename}: invalid record at byte {offset + start} skipped ({e})")
+        start = match.end()
+    return records
+
+
+def iter_appended_batches(filename: str, offset: int = 0, select=None, fields=None, blocksize: int = 1 << 20,
+                          skip_invalid: bool = False):
+    """Generator of the complete records written in an ADIF file after a byte offset
+
+    The file is read in blocks of blocksize bytes, for each block a tuple
+    (QSO list, offset after the last complete record) is yielded, the QSO list
+    may be empty. See read_appended_qsos() for offset.
+
+    Invalid records raise AdifError, unless skip_invalid is True: they are
+    then skipped, logging their byte offset."""
+    reader = AdifReader(select=select, fields=fields)
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < offset:
+            logging.warning(
+                f"{filename} is shorter than before, reading it again")
+            offset = 0
+        f.seek(offset)
+        pending = b''
+        while True:
+            data = f.read(blocksize)
+            pending += data
+            end = _last_record_end(pending)
+            try:
+                records = reader.feed(
+                    pending[:end].decode('utf-8')) if end else []
+            except (AdifError, UnicodeDecodeError):
+                if not skip_invalid:
+                    raise
+                # The reader state is lost, parse the records of the block
+                # one at a time
+                records = _feed_each_record(pending[:end], offset, filename,
+                                            reader.select, fields)
+                reader = AdifReader(select=select, fields=fields)
+            pending = pending[end:]
+            offset += end
+            yield [QSO(record) for record in records], offset
+            if not data:
+                break
+
+
+def read_appended_qsos(filename: str, offset: int = 0, select=None, fields=None, skip_invalid: bool = False):
+    """Reads the complete records written in an ADIF file after a byte offset
+
+    offset must be a record boundary, as returned by a previous call (0 for
+    the beginning of the file). A trailing record not terminated by EOR yet
+    is left for the next call. If the file is now shorter than offset it is
+    read again from the beginning. The file is decoded as UTF-8. See
+    iter_appended_batches() for skip_invalid.
+
+    Returns the QSO list and the offset to use for the next call."""
+    qso_list: list[QSO] = []
+    for batch, offset in iter_appended_batches(filename, offset, select=select, fields=fields,
+                                               skip_invalid=skip_invalid):
+        qso_list += batch
+    return qso_list, offset
+
+
+def _last_record_end(data: bytes):
+    """Offset after the last EOR tag of a buffer, 0 if there is none"""
+    end = 0
+    for match in _EOR_RE_BYTES.finditer(data):
+        end = match.end()
+    return end
+
+
+def last_record_end(filename: str, blocksize: int = 1 << 20):
+    """Byte offset after the last complete record of an ADIF file
+
+    The file is read backwards in blocks of blocksize bytes, up to the last
+    EOR tag. Use it as offset for read_appended_qsos() to skip the existing
+    records"""
+    assert blocksize >= len(b'<eor>')
+    with open(filename, 'rb') as f:
+        stop = os.fstat(f.fileno()).st_size
+        while stop > 0:
+            start = max(0, stop - blocksize)
+            f.seek(start)
+            position = f.read(stop - start).lower().rfind(b'<eor>')
+            if position >= 0:
+                return start + position + len(b'<eor>')
+            if start == 0:
+                break
+            # Blocks overlap, so that tags across two blocks are found
+            stop = start + len(b'<eor>') - 1
+    return 0
+
+
+def qso_list_from_file(filename: str, select=None, fields=None, lazy: bool = False):
+    """Convenience function to convert an ADIF file into a QSO list
+
+    Only the QSOs matching the select expression are returned, if given, and
+    only the given fields are kept. See iter_qso_file() for lazy."""
+    qso_list: list[QSO] = list(iter_qso_file(
+        filename, select=select, fields=fields, lazy=lazy))
     return qso_list
 
 
+# Same as _FIELD_GENERIC_RE_NO_VALUE, working on raw bytes
+_FIELD_GENERIC_RE_BYTES = re.compile(
+    _FIELD_GENERIC_RE_NO_VALUE.pattern.encode(), re.IGNORECASE)
+_EOH_RE_BYTES = re.compile(rb"<eoh>", re.IGNORECASE)
+_NON_ASCII_RE_BYTES = re.compile(rb"[\x80-\xff]")
+# UTF-8 continuation bytes, deleted to count characters
+_UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+
+# Single problem found by the validator
+#   record  : record number (1 is the first QSO, 0 is the header)
+#   offset  : byte offset in the file
+#   message : problem description
+AdifIssue = namedtuple('AdifIssue', ['record', 'offset', 'message'])
+
+
+def _value_end(buf, start: int, length: int):
+    """Byte offset of the end of a value of length characters in a UTF-8 buffer
+
+    The result may exceed the buffer size if the value is truncated"""
+    end = start + length
+    if _NON_ASCII_RE_BYTES.search(buf, start, end) is None:
+        return end
+    # Multibyte characters, the value takes more bytes than its length
+    while True:
+        chars = len(buf[start:end].translate(None, _UTF8_CONTINUATION))
+        if chars >= length or end >= len(buf):
+            break
+        end += length - chars
+    if chars < length:
+        # Truncated value
+        return len(buf) + 1
+    # Include the continuation bytes of the last character
+    while end < len(buf) and 0x80 <= buf[end] < 0xC0:
+        end += 1
+    return end
+
+
+def validate_adif_bytes(buf):
+    """Validate an UTF-8 encoded ADIF buffer (bytes, mmap, ...) without building QSOs
+
+    The buffer is scanned once and no per-field objects are created apart from
+    the field names. Every problem is reported, the scan does not stop at the
+    first one. Returns the list of AdifIssue found."""
+    issues = []
+    # Essential keys as tuples of alternatives
+    essential = [tuple(k.encode() for k in key) if isinstance(key, list) else (key.encode(),)
+                 for key in _ESSENTIAL_KEYS]
+    # Fields before the first EOR belong to record 1 unless an EOH tag shows
+    # they were the header (record 0)
+    record = 1
+    record_start = 0
+    names = set()
+    cursor = 0
+    size = len(buf)
+    while True:
+        match = _FIELD_GENERIC_RE_BYTES.search(buf, cursor)
+        if match is None:
+            break
+        name = match.group(1).upper()
+        cursor = match.end()
+
+        if name == b'EOH':
+            if record == 1:
+                issues = [i._replace(record=0) for i in issues]
+                record_start = cursor
+                names.clear()
+            continue
+        if name == b'EOR':
+            if record > 0:
+                for key in essential:
+                    if names.isdisjoint(key):
+                        issues.append(AdifIssue(record, record_start,
+                                                f"Essential field {'/'.join(k.decode() for k in key)} not found"))
+            record += 1
+            record_start = cursor
+            names.clear()
+            continue
+
+        try:
+            length = int(match.group(2) or 0)
+        except ValueError:
+            issues.append(AdifIssue(record, match.start(),
+                                    f"Invalid length value for field {name.decode()}"))
+            continue
+        if length <= 0:
+            issues.append(AdifIssue(record, match.start(),
+                                    f"Invalid length ({length}) for field {name.decode()}, must be positive"))
+            continue
+        if name in names:
+            issues.append(AdifIssue(record, match.start(),
+                                    f"Duplicate field {name.decode()}"))
+        names.add(name)
+
+        end = _value_end(buf, cursor, length)
+        if end > size:
+            issues.append(AdifIssue(record, match.start(),
+                                    f"Field {name.decode()} value too short, expected {length} characters"))
+            cursor = size
+            break
+        cursor = end
+
+    if names:
+        issues.append(AdifIssue(record, record_start,
+                                "End of file found before EOR"))
+    return issues
+
+
+def validate_adif_file(filename: str):
+    """Validate an ADIF file in a single pass, see validate_adif_bytes()"""
+    assert isinstance(filename, str)
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return validate_adif_bytes(buf)
+
+
+# Summary of a log file, see inspect_adif_file()
+#   filename         : log file
+#   size             : file size in bytes
+#   records          : number of EOR tags after the header
+#   declared_records : record count declared in the header (Records: N), None if missing
+#   adif_ver         : ADIF_VER header field, None if missing
+#   programid        : PROGRAMID header field, None if missing
+#   first_date       : earliest QSO_DATE (YYYYMMDD), None if there is none
+#   last_date        : latest QSO_DATE (YYYYMMDD), None if there is none
+LogSummary = namedtuple('LogSummary', ['filename', 'size', 'records', 'declared_records',
+                                       'adif_ver', 'programid', 'first_date', 'last_date'])
+
+# Record count declared in the header text, e.g. by QRZ.com
+_DECLARED_RECORDS_RE_BYTES = re.compile(
+    rb"^\s*records:\s*(\d+)\s*$", re.IGNORECASE | re.MULTILINE)
+# QSO_DATE values, on lowercase text
+_QSO_DATE_RE_BYTES = re.compile(rb"<qso_date:8(?::d)?>(\d{8})")
+# Size of the blocks scanned by inspect_adif_bytes()
+_INSPECT_BLOCK = 1 << 26
+
+
+def inspect_adif_bytes(buf, filename: str = None):
+    """Summary of an ADIF buffer (bytes, mmap, ...) from a raw scan of its tags
+
+    Records are not parsed: EOR tags are counted and QSO_DATE values collected
+    block by block, so memory usage doesn't depend on the size of the log.
+    Returns a LogSummary."""
+    size = len(buf)
+    # The header, if any, ends before the first record
+    first_eor = _EOR_RE_BYTES.search(buf)
+    eoh = _EOH_RE_BYTES.search(buf, 0, first_eor.start() if first_eor else size)
+    header = {}
+    declared_records = None
+    start = 0
+    if eoh is not None:
+        start = eoh.end()
+        for match in _FIELD_GENERIC_RE_BYTES.finditer(buf, 0, eoh.start()):
+            length = int(match.group('len') or 0)
+            if length > 0:
+                value_end = _value_end(buf, match.end(), length)
+                header[match.group('field').decode('ascii').upper()] = bytes(
+                    buf[match.end():value_end]).decode('utf-8', errors='replace')
+        # Header text outside of the fields
+        declared = _DECLARED_RECORDS_RE_BYTES.search(buf[:eoh.start()])
+        if declared is not None:
+            declared_records = int(declared.group(1))
+
+    records = 0
+    first_date = last_date = None
+    pending = b''
+    position = start
+    while position < size:
+        block = pending + buf[position:position + _INSPECT_BLOCK].lower()
+        position += _INSPECT_BLOCK
+        # Blocks end after an EOR tag, so that no tag is split
+        end = block.rfind(b'<eor>') + len(b'<eor>') if position < size else len(block)
+        if end < len(b'<eor>'):
+            pending = block
+            continue
+        block, pending = block[:end], block[end:]
+        records += block.count(b'<eor>')
+        dates = _QSO_DATE_RE_BYTES.findall(block)
+        if dates:
+            first_date = min(dates + ([first_date] if first_date else []))
+            last_date = max(dates + ([last_date] if last_date else []))
+
+    return LogSummary(filename, size, records, declared_records, header.get('ADIF_VER'),
+                      header.get('PROGRAMID'), first_date and first_date.decode('ascii'),
+                      last_date and last_date.decode('ascii'))
+
+
+def inspect_adif_file(filename: str):
+    """Summary of an ADIF file without parsing it, see inspect_adif_bytes()"""
+    assert isinstance(filename, str)
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return LogSummary(filename, 0, 0, None, None, None, None, None)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return inspect_adif_bytes(buf, filename)
+
+
+class LazyRecord(Mapping):
+    """Read-only record whose values stay in the source buffer
+
+    Holds the byte offsets of the values in a shared UTF-8 buffer (bytes,
+    mmap, memoryview); a value is decoded on first access and cached. Pickled
+    records become plain dicts."""
+
+    __slots__ = ('_buf', '_fields', '_offsets', '_values')
+
+    def __init__(self, buf, fields, offsets: array):
+        self._buf = buf
+        # Field names (uppercase), value i starts at offsets[2*i] and ends at
+        # offsets[2*i+1]
+        self._fields = fields
+        self._offsets = offsets
+        # Values decoded so far, created on first access
+        self._values = None
+
+    def __getitem__(self, field: str):
+        if self._values is None:
+            self._values = {}
+        elif field in self._values:
+            return self._values[field]
+        try:
+            i = 2 * self._fields.index(field)
+        except ValueError:
+            raise KeyError(field) from None
+        value = self._values[field] = str(
+            self._buf[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+        return value
+
+    def __contains__(self, field):
+        return field in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return f"LazyRecord({dict(self)!r})"
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+def iter_lazy_records(buf, select=None, fields=None):
+    """Generator of the records of an UTF-8 ADIF buffer as LazyRecord objects
+
+    Only the tags are scanned, values are neither copied nor decoded unless
+    select needs them or they are accessed. See AdifReader for select and
+    fields. Header data is discarded."""
+    select = compile_selection(select)
+    projection = None
+    if fields is not None:
+        projection = frozenset(f.upper() for f in fields)
+        if select is not None:
+            projection |= select.fields
+    size = len(buf)
+    # Fields and value offsets of the current record
+    names, offsets = [], array('q')
+    record = LazyRecord(buf, names, offsets)
+    # The current record has been discarded by the selection
+    rejected = False
+    cursor = 0
+    # Offset of the next non-ASCII byte, values before it need no decoding to
+    # find their end
+    non_ascii = -1
+    # Tag name as found -> field name
+    tag_names = {}
+    # Field name tuples, shared by the records with the same fields
+    layouts = {}
+    while True:
+        match = _FIELD_GENERIC_RE_BYTES.search(buf, cursor)
+        if match is None:
+            break
+        tag, length = match.group('field', 'len')
+        field = tag_names.get(tag)
+        if field is None:
+            field = tag_names[tag] = tag.decode('ascii').upper()
+        cursor = match.end()
+
+        if field == 'EOR' or field == 'EOH':
+            if field == 'EOR' and not rejected:
+                layout = tuple(names)
+                record._fields = layouts.setdefault(layout, layout)
+                if select is None or select(record):
+                    yield record
+            # Everything before EOH was header data
+            names, offsets = [], array('q')
+            record = LazyRecord(buf, names, offsets)
+            rejected = False
+            continue
+
+        length = int(length or 0)
+        if length <= 0:
+            raise AdifError(
+                f"Invalid length ({length}) for field {field}, must be positive")
+        if non_ascii < cursor:
+            non_ascii_match = _NON_ASCII_RE_BYTES.search(buf, cursor)
+            non_ascii = non_ascii_match.start() if non_ascii_match else size
+        value_end = cursor + length
+        if value_end > non_ascii:
+            value_end = _value_end(buf, cursor, length)
+        if value_end > size:
+            raise AdifError(
+                f"Impossible to fetch {length} bytes from log, found {size - cursor}")
+        start, cursor = cursor, value_end
+        if rejected or (projection is not None and field not in projection):
+            continue
+        if field in names:
+            raise AdifError(f"Duplicate field {field} ({record[field]})")
+        names.append(field)
+        offsets.append(start)
+        offsets.append(value_end)
+        if select is not None and field in select.fields and select.decide(record) is False:
+            rejected = True
+
+    if names:
+        raise AdifError("End of list found before EOR")
+
+
+def _normalize_mode(_qso: QSO):
+    """Mode used for duplicate detection, submodes and sidebands are folded"""
+    mode = _qso._d.get('MODE', '').upper()
+    submode = _qso._d.get('SUBMODE', '').upper()
+    if mode in ['MFSK', 'PSK'] and submode:
+        return submode
+    if mode in ['USB', 'LSB']:
+        return 'SSB'
+    return mode
+
+
+def _qso_minutes(_qso: QSO):
+    """Minutes since the epoch of the QSO start, None if not available"""
+    if _qso.datetime_on is None:
+        return None
+    return int(_qso.datetime_on.timestamp()) // 60
+
+
+# Rank of QSL status values, higher is more confirmed
+_QSL_STATUS_RANK = {'I': 0, 'N': 1, 'Q': 2, 'R': 3, 'V': 4, 'Y': 5}
+
+
+def _merge_confirmed(old: str, new: str):
+    """Merge rule keeping the most advanced QSL status"""
+    if _QSL_STATUS_RANK.get(new.upper(), -1) > _QSL_STATUS_RANK.get(old.upper(), -1):
+        return new
+    return old
+
+
+# Field-level merge rules
+# Each rule is a function (old_value, new_value) -> merged_value, called only
+# when both records carry the field. Missing fields are always filled in.
+MERGE_RULES = {
+    'first': lambda old, new: old,
+    'last': lambda old, new: new,
+    'longest': lambda old, new: new if len(new) > len(old) else old,
+    'confirmed': _merge_confirmed,
+}
+
+# Default rule for each field, fields not listed use 'first'
+DEFAULT_MERGE_RULES = {
+    'QSL_SENT': 'confirmed',
+    'QSL_RCVD': 'confirmed',
+    'LOTW_QSL_SENT': 'confirmed',
+    'LOTW_QSL_RCVD': 'confirmed',
+    'EQSL_QSL_SENT': 'confirmed',
+    'EQSL_QSL_RCVD': 'confirmed',
+    'NAME': 'longest',
+    'QTH': 'longest',
+    'COMMENT': 'longest',
+}
+
+
+class QsoMerger:
+    """Merges QSOs coming from several logs, removing duplicates
+
+    Two QSOs are the same contact when CALL, BAND (derived from FREQ if
+    missing) and MODE match and their start times are at most window minutes
+    apart. Records are indexed by time bucket, so each QSO is checked only
+    against the few candidates of its own and adjacent buckets.
+
+    rules maps field names to a MERGE_RULES name or to a function
+    (old_value, new_value) -> merged_value and extends DEFAULT_MERGE_RULES."""
+
+    def __init__(self, window: int = 5, rules: dict = None):
+        assert window >= 0
+        self.window = window
+        self._rules = {}
+        for field, rule in {**DEFAULT_MERGE_RULES, **(rules or {})}.items():
+            self._rules[field.upper()] = MERGE_RULES[rule] if isinstance(
+                rule, str) else rule
+        # Merged records in order of first appearance
+        self._records: list[dict] = []
+        # Index: key -> list of (minutes, record index)
+        self._index: dict = {}
+        # Number of duplicates merged so far
+        self.duplicates = 0
+
+    def _key(self, _qso: QSO):
+        """Normalized key of a QSO, without time"""
+        band = _qso._d.get('BAND', '').lower()
+        if not band and _qso._d.get('FREQ'):
+            band = freq_to_band(_qso._d['FREQ']) or ''
+        return (_qso._d.get('CALL', '').upper(), band, _normalize_mode(_qso))
+
+    def add(self, _qso: QSO):
+        """Add a QSO, returns False if it was merged into an existing one"""
+        assert isinstance(_qso, QSO)
+        key = self._key(_qso)
+        minutes = _qso_minutes(_qso)
+        # Bucket width is window+1 so a match is always in an adjacent bucket
+        bucket = None if minutes is None else minutes // (self.window + 1)
+
+        if bucket is None:
+            candidates = self._index.get(key + (None,), [])
+        else:
+            candidates = [c for b in (bucket - 1, bucket, bucket + 1)
+                          for c in self._index.get(key + (b,), [])]
+        for c_minutes, c_index in candidates:
+            if minutes is None or abs(c_minutes - minutes) <= self.window:
+                self._merge_into(self._records[c_index], _qso._d)
+                self.duplicates += 1
+                return False
+
+        self._index.setdefault(key + (bucket,), []).append(
+            (minutes, len(self._records)))
+        self._records.append(dict(_qso._d))
+        return True
+
+    def update(self, qsos):
+        """Add all the QSOs of an iterable"""
+        for _qso in qsos:
+            self.add(_qso)
+
+    def _merge_into(self, record: dict, data: dict):
+        """Field-level merge of data into record"""
+        for field, value in data.items():
+            if field not in record:
+                record[field] = value
+            else:
+                rule = self._rules.get(field, MERGE_RULES['first'])
+                record[field] = rule(record[field], value)
+
+    def qso_list(self):
+        """Returns the merged QSO list"""
+        return [QSO(record) for record in self._records]
+
+
+def merge_qso_lists(*sources, window: int = 5, rules: dict = None):
+    """Merge several QSO iterables into a single list without duplicates
+
+    See QsoMerger for the meaning of window and rules"""
+    merger = QsoMerger(window=window, rules=rules)
+    for source in sources:
+        merger.update(source)
+    logging.info(f"Merged {merger.duplicates} duplicate QSO(s)")
+    return merger.qso_list()
+
+
+def merge_log_files(filenames: list, window: int = 5, rules: dict = None):
+    """Merge several ADIF files into a single QSO list without duplicates
+
+    Files are streamed, only the merged records are kept in memory"""
+    return merge_qso_lists(*[iter_qso_file(f) for f in filenames], window=window, rules=rules)
+
+
 # Testing code
 if __name__ == '__main__':
     logging.basicConfig(
@@ -276,5 +1007,6 @@ if __name__ == '__main__':
         logging.debug(f"is_valid(): {q.is_valid()}")
 
     # Dumping the QSO list for the QSL generator module
+    import pickle
     with open(os.path.splitext(LOGFILE)[0]+'.dump', 'wb') as f:
         pickle.dump(qso_list, f)
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Asset pipeline for the QSL templates
+
+"""
+Template Assets Module
+
+Templates may reference images, CSS files and fonts relative to the templates
+folder (src="...", href="..." and CSS url(...)). Cards are rendered from a
+temporary copy of the template, so these references are resolved when the
+template is loaded, once per job instead of once per card:
+    - small assets are inlined as data: URIs
+    - larger ones are written to a content addressed cache folder, private
+      to the user, and referenced by absolute file:// URL
+    - CSS files have their own url(...) references resolved the same way
+    - raster images larger than the card at the target DPI can be downscaled
+      (requires Pillow, optional), so large backgrounds aren't decoded at full
+      resolution for every card
+References to remote URLs, data: URIs, missing files and references built by
+Jinja expressions are left untouched.
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import math
+import os
+import pathlib
+import re
+from jinja2 import FileSystemLoader
+from urllib.parse import unquote
+
+# MIME type of the supported assets, by extension
+ASSET_TYPES = {
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.gif': 'image/gif',
+    '.bmp': 'image/bmp', '.webp': 'image/webp', '.svg': 'image/svg+xml',
+    '.css': 'text/css',
+    '.ttf': 'font/ttf', '.otf': 'font/otf', '.woff': 'font/woff', '.woff2': 'font/woff2',
+}
+
+# Images that can be downscaled (animated GIFs are left alone)
+RASTER_IMAGES = ['.png', '.jpg', '.jpeg', '.bmp', '.webp']
+
+# Assets up to this size (bytes) are inlined as data: URIs
+INLINE_LIMIT = 32 * 1024
+
+# Cache of the processed assets, shared by the jobs and processes of the user.
+# The renderers may read it (see qsl_generator.allow_options()), so it must
+# not be writable by other users
+ASSET_CACHE_FOLDER = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                  'qsl_generator', 'assets')
+
+# References in HTML attributes and in CSS
+_ATTRIBUTE_RE = re.compile(
+    r"""(?P<prefix>\b(?:src|href|poster)\s*=\s*)(?P<quote>["'])(?P<url>[^"']+)(?P=quote)""", re.IGNORECASE)
+_CSS_URL_RE = re.compile(
+    r"""(?P<prefix>url\(\s*)(?P<quote>["']?)(?P<url>[^"')]+)(?P=quote)(?P<suffix>\s*\))""", re.IGNORECASE)
+# URL scheme (http:, data:, file:, ...)
+_SCHEME_RE = re.compile(r"^[a-z][a-z0-9+.-]*:", re.IGNORECASE)
+
+
+def private_folder(path: str):
+    """Creates the folder at path if needed, readable by the current user only
+
+    Raises PermissionError if the folder belongs to another user"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        stat = os.stat(path)
+        if stat.st_uid != os.getuid():
+            raise PermissionError(f"{path} belongs to another user")
+        if stat.st_mode & 0o077:
+            os.chmod(path, 0o700)
+
+
+def _same_content(path: str, data: bytes):
+    """True if the file at path holds data"""
+    try:
+        if os.path.islink(path) or os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+class AssetPipeline:
+    """Resolves the assets referenced by the templates of a folder"""
+
+    def __init__(self, folder: str, max_size: tuple = None, inline_limit: int = INLINE_LIMIT,
+                 cache_folder: str = ASSET_CACHE_FOLDER):
+        """max_size is the (width, height) in pixels of the card at the target
+        DPI, larger images are downscaled to it. Assets up to inline_limit
+        bytes are inlined, the others written in cache_folder"""
+        self.folder = folder
+        self.max_size = max_size
+        self.inline_limit = inline_limit
+        self.cache_folder = cache_folder
+        # Asset path -> (mtime_ns, size, URL, cache file or None)
+        self._assets = {}
+
+    def _local_path(self, url: str, base: str):
+        """Path of the asset referenced by url from base, None if not a local asset"""
+        if '{{' in url or '{%' in url or url.startswith(('#', '//')) or _SCHEME_RE.match(url):
+            return None
+        path = os.path.normpath(os.path.join(
+            base, unquote(re.split(r'[?#]', url)[0])))
+        if os.path.splitext(path)[1].lower() not in ASSET_TYPES or not os.path.isfile(path):
+            return None
+        return path
+
+    def _replace(self, match, base: str):
+        """Replacement of a reference found by one of the regular expressions"""
+        path = self._local_path(match.group('url'), base)
+        if path is None:
+            return match.group(0)
+        return (match.group('prefix') + match.group('quote') + self.asset_url(path) +
+                match.group('quote') + match.groupdict().get('suffix', ''))
+
+    def rewrite_css(self, css: str, base: str):
+        """Resolves the url(...) references of CSS relative to the folder base"""
+        return _CSS_URL_RE.sub(lambda m: self._replace(m, base), css)
+
+    def rewrite_html(self, html: str, base: str = None):
+        """Resolves the asset references of an HTML template relative to the folder base"""
+        base = self.folder if base is None else base
+        html = _ATTRIBUTE_RE.sub(lambda m: self._replace(m, base), html)
+        return self.rewrite_css(html, base)
+
+    def _downscale(self, data: bytes, path: str):
+        """Image data fitting max_size, the original data if already small enough"""
+        try:
+            from PIL import Image
+        except ImportError:
+            logging.warning(f"Pillow not installed, {path} not downscaled")
+            return data
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            # Smallest size still covering the whole card
+            scale = max(self.max_size[0] / width, self.max_size[1] / height)
+            if scale >= 1:
+                return data
+            size = (math.ceil(width * scale), math.ceil(height * scale))
+            out = io.BytesIO()
+            image.resize(size, Image.LANCZOS).save(
+                out, format=image.format, quality=90)
+        logging.info(f"Asset {path} downscaled from {width}x{height} to {size[0]}x{size[1]}")
+        return out.getvalue()
+
+    def asset_url(self, path: str):
+        """URL of the processed asset at path, processed only if it changed"""
+        stat = os.stat(path)
+        cached = self._assets.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        ext = os.path.splitext(path)[1].lower()
+        with open(path, 'rb') as f:
+            data = f.read()
+        if ext == '.css':
+            data = self.rewrite_css(data.decode('utf-8'),
+                                    os.path.dirname(path)).encode('utf-8')
+        elif ext in RASTER_IMAGES and self.max_size is not None:
+            data = self._downscale(data, path)
+
+        cache_file = None
+        if len(data) <= self.inline_limit:
+            url = f"data:{ASSET_TYPES[ext]};base64,{base64.b64encode(data).decode('ascii')}"
+        else:
+            cache_file = os.path.join(self.cache_folder,
+                                      hashlib.sha256(data).hexdigest()[:32] + ext)
+            private_folder(self.cache_folder)
+            # Files found in the cache are checked before being reused
+            if not _same_content(cache_file, data):
+                temp = f"{cache_file}.{os.getpid()}.tmp"
+                with open(temp, 'wb') as f:
+                    f.write(data)
+                os.replace(temp, cache_file)
+            url = pathlib.Path(os.path.abspath(cache_file)).as_uri()
+        self._assets[path] = (stat.st_mtime_ns, stat.st_size, url, cache_file)
+        return url
+
+    def uptodate(self):
+        """False if an asset changed or a cached file disappeared since it was processed"""
+        for path, (mtime_ns, size, _, cache_file) in list(self._assets.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size) or \
+                    (cache_file is not None and not os.path.isfile(cache_file)):
+                return False
+        return True
+
+
+class AssetLoader(FileSystemLoader):
+    """Jinja loader resolving the assets of the templates with an AssetPipeline
+
+    Templates are loaded again when one of their assets changes"""
+
+    def __init__(self, searchpath: str, pipeline: AssetPipeline):
+        super().__init__(searchpath)
+        self.pipeline = pipeline
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        source = self.pipeline.rewrite_html(source, os.path.dirname(filename))
+        return source, filename, lambda: uptodate() and self.pipeline.uptodate()
@@ -8,6 +8,7 @@ import qsl_generator
 
 import logging
 import os.path
+import threading
 import tkinter as tk
 import tkinter.filedialog as tkfile
 import tkinter.scrolledtext as tkscroll
@@ -51,6 +52,8 @@ class App():
     def __init__(self, master: tk.Tk):
         """Create and initialize widgets"""
 
+        self.master = master
+
         # --- UI Layout ---
         # Main frame
         frame = tk.Frame(master)
@@ -107,15 +110,26 @@ class App():
         self.start_button['command'] = self.generate_qsl
         self.start_button.grid(row=1, column=1, padx=5, pady=5)
 
+        # Preview button, toggles the preview
+        self.preview_button = tk.Button(self.buttons_frame, text="Preview")
+        self.preview_button['command'] = self.toggle_preview
+        self.preview_button.grid(row=1, column=2, padx=5, pady=5)
+        # Preview thread and its stop event
+        self.preview_thread = None
+        self.preview_stop = threading.Event()
+        # Preview window and its images (Tk needs a reference to them)
+        self.preview_window = None
+        self.preview_images = []
+
         # Quit button
         self.quit_button = tk.Button(self.buttons_frame, text="Quit")
         self.quit_button['command'] = master.destroy
-        self.quit_button.grid(row=1, column=2, padx=5, pady=5)
+        self.quit_button.grid(row=1, column=3, padx=5, pady=5)
 
         # Logging text box
         self.logbox = tkscroll.ScrolledText(
             master, state=tk.DISABLED, width=50, height=10)
-        self.logbox.grid(row=2, column=0, columnspan=3)
+        self.logbox.grid(row=2, column=0, columnspan=4)
 
         # Logger configuration
         self.logger = logging.getLogger('app')
@@ -168,25 +182,26 @@ class App():
 
     def validate_logfile(self):
         """
-        Runs the ADIF parser on the selected file to check for errors.
+        Runs the ADIF validator on the selected file to check for errors.
 
         Action:
-            - Calls adif.parse_adif_file().
+            - Calls adif.validate_adif_file(), which never builds QSO objects.
             - Logs 'Validation passed' if successful.
-            - Logs specific error messages if the parser fails.
+            - Logs every problem found with record number and byte offset.
         """
         if hasattr(self, 'logfile') and os.path.isfile(self.logfile):
             try:
-                _result = True  # Validation result
-                adif.parse_adif_file(self.logfile)
+                issues = adif.validate_adif_file(self.logfile)
             except Exception as e:
-                _result = False
+                issues = None
                 self.logger.error(e)
-            finally:
-                if _result == True:
-                    self.logger.info("Validation passed!")
-                else:
-                    self.logger.error("Validation failed!")
+            if issues == []:
+                self.logger.info("Validation passed!")
+            else:
+                for issue in (issues or []):
+                    self.logger.error(
+                        f"Record {issue.record} (byte {issue.offset}): {issue.message}")
+                self.logger.error("Validation failed!")
         else:
             self.logger.error("No logfile chosen!")
 
@@ -218,6 +233,72 @@ class App():
         else:
             self.logger.error("No logfile chosen!")
 
+    def toggle_preview(self):
+        """
+        Starts or stops the preview triggered by the 'Preview' button.
+
+        Action:
+            - Parses the log and renders low resolution images of a few
+              representative QSOs in a background thread.
+            - Shows them in a preview window, rendered again whenever the
+              templates change, until the button is pressed again or the
+              window is closed.
+        """
+        if self.preview_thread is not None and not self.preview_stop.is_set():
+            self.stop_preview()
+            return
+        if not (hasattr(self, 'logfile') and os.path.isfile(self.logfile)):
+            self.logger.error("No logfile chosen!")
+            return
+        template = self.template_file or qsl_generator.TEMPLATE_DEFAULT_FILE
+        self.preview_stop = threading.Event()
+        self.preview_thread = threading.Thread(target=self.preview_worker,
+                                               args=(self.logfile, template, self.preview_stop), daemon=True)
+        self.preview_thread.start()
+        self.preview_button.config(text="Stop preview")
+        self.logger.info("Preview started, updated when the template changes")
+
+    def stop_preview(self):
+        """Stops the preview and closes its window"""
+        self.preview_stop.set()
+        self.preview_button.config(text="Preview")
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            self.preview_window.destroy()
+        self.preview_window = None
+        self.preview_images = []
+        self.logger.info("Preview stopped")
+
+    def preview_worker(self, logfile: str, template: str, stop: threading.Event):
+        """Preview thread: parses the log, then renders until stop is set
+
+        Widgets are only updated from the Tk main loop, through after()"""
+        try:
+            qso_list = adif.qso_list_from_file(logfile)
+        except Exception as e:
+            self.logger.error(e)
+            self.master.after(0, self.stop_preview)
+            return
+        qsl_generator.watch_preview(
+            qso_list, stop, template,
+            on_render=lambda images: self.master.after(0, self.show_preview, images, stop))
+
+    def show_preview(self, images: list, stop: threading.Event):
+        """Shows the preview images in the preview window"""
+        if stop.is_set():
+            # Rendered before the preview was stopped
+            return
+        if self.preview_window is None or not self.preview_window.winfo_exists():
+            self.preview_window = tk.Toplevel(self.master)
+            self.preview_window.wm_title("QSL preview")
+            self.preview_window.protocol('WM_DELETE_WINDOW', self.stop_preview)
+        for widget in self.preview_window.winfo_children():
+            widget.destroy()
+        self.preview_images = [tk.PhotoImage(file=f) for f in images]
+        for i, image in enumerate(self.preview_images):
+            tk.Label(self.preview_window, image=image).grid(
+                row=i // 2, column=i % 2, padx=2, pady=2)
+        self.logger.info(f"{len(images)} preview(s) updated")
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Ledger of the QSL cards already printed
+
+"""
+QSL Ledger Module
+
+Keeps track of the QSOs already rendered in a local SQLite database, so that
+following runs can print only the new contacts. Each QSO is identified by
+QSO.identity (station callsign, call, date, time, band and mode) and every
+rendering is stored with the hash of the template used and the output file.
+"""
+
+import hashlib
+import logging
+import os
+from datetime import datetime, timezone
+from qso import QSO
+
+# Default ledger file
+LEDGER_DEFAULT_FILE = './qsl_ledger.sqlite'
+
+# Number of identities per query when looking up QSOs
+_LOOKUP_BATCH = 500
+
+
+def file_sha256(path: str):
+    """SHA-256 hex digest of a file content"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class QslLedger:
+    """Ledger of the printed QSL cards, stored in a SQLite file"""
+
+    def __init__(self, path: str = LEDGER_DEFAULT_FILE):
+        # Imported here, the module is used by the QSL generator at startup
+        import sqlite3
+        self.path = path
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS printed (
+                identity TEXT NOT NULL,
+                template_hash TEXT NOT NULL,
+                output TEXT,
+                printed_at TEXT NOT NULL,
+                PRIMARY KEY (identity, template_hash))""")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the database"""
+        self._db.close()
+
+    def printed_identities(self, qso_list: list[QSO], template_hash: str = None, exclude_folder: str = None):
+        """Returns the set of identities of the QSOs already printed
+
+        If template_hash is given only the cards printed with that template
+        count, if exclude_folder is given the cards printed into files of that
+        folder don't"""
+        identities = list(set(q.identity for q in qso_list))
+        printed = set()
+        for i in range(0, len(identities), _LOOKUP_BATCH):
+            batch = identities[i:i + _LOOKUP_BATCH]
+            query = f"SELECT identity FROM printed WHERE identity IN ({','.join('?' * len(batch))})"
+            params = batch
+            if template_hash is not None:
+                query += " AND template_hash = ?"
+                params = params + [template_hash]
+            if exclude_folder is not None:
+                prefix = os.path.join(exclude_folder, '')
+                query += " AND (output IS NULL OR substr(output, 1, ?) != ?)"
+                params = params + [len(prefix), prefix]
+            printed.update(row[0] for row in self._db.execute(query, params))
+        return printed
+
+    def is_printed(self, _qso: QSO, template_hash: str = None):
+        """True if the QSO has already been printed"""
+        return len(self.printed_identities([_qso], template_hash)) > 0
+
+    def filter_new(self, qso_list: list[QSO], template_hash: str = None, exclude_folder: str = None):
+        """Returns the QSOs of the list not printed yet, see printed_identities()"""
+        printed = self.printed_identities(
+            qso_list, template_hash, exclude_folder)
+        new_list = [q for q in qso_list if q.identity not in printed]
+        logging.info(
+            f"{len(new_list)} new QSO(s), {len(qso_list) - len(new_list)} already printed")
+        return new_list
+
+    def record(self, qso_list: list[QSO], template_hash: str, output: str):
+        """Records the QSOs as printed with the given template on output"""
+        now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO printed VALUES (?, ?, ?, ?)",
+                                 [(q.identity, template_hash, output, now) for q in qso_list])
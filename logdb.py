@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Export of ADIF logs into a SQLite database
+
+"""
+Log Database Module
+
+Exports QSOs into a SQLite table so that logs can be queried with SQL instead
+of being parsed again. There is one TEXT column per ADIF field, created as
+the fields are found in the log, plus the QSO_ID primary key holding
+QSO.identity. Exporting the same QSO again updates its row (upsert), so a
+log can be re-exported incrementally.
+"""
+
+import adif
+import argparse
+import logging
+import re
+import sqlite3
+from contextlib import contextmanager
+from qso import QSO
+
+# Default table name
+QSO_TABLE = 'qso'
+
+# Primary key column
+ID_COLUMN = 'QSO_ID'
+
+# Columns always present and indexed
+INDEXED_FIELDS = ['CALL', 'QSO_DATE', 'BAND', 'MODE', 'DXCC']
+
+# Default number of rows per executemany() call
+BATCH_SIZE = 1000
+
+_NAME_RE = re.compile(r"^\w+$")
+
+
+def _quote(name: str):
+    """Quotes a table or column name"""
+    if not _NAME_RE.match(name):
+        raise ValueError(f"Invalid name {name}")
+    return f'"{name}"'
+
+
+class QsoDatabase:
+    """SQLite database of QSOs"""
+
+    def __init__(self, path: str, table: str = QSO_TABLE):
+        self.path = path
+        self.table = table
+        # Transactions are explicit, so that schema changes are part of them
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        with self._transaction():
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ("
+                             f"{_quote(ID_COLUMN)} TEXT PRIMARY KEY, " +
+                             ', '.join(f"{_quote(f)} TEXT" for f in INDEXED_FIELDS) + ")")
+            for field in INDEXED_FIELDS:
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS {_quote(f'{table}_{field}')} "
+                                 f"ON {_quote(table)} ({_quote(field)})")
+        self._columns = set(row['name'] for row in self._db.execute(
+            f"PRAGMA table_info({_quote(table)})"))
+
+    @contextmanager
+    def _transaction(self):
+        """Runs the enclosed statements in a single transaction"""
+        self._db.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the database"""
+        self._db.close()
+
+    def _add_columns(self, fields: set):
+        """Adds the columns of the fields not in the table yet"""
+        for field in sorted(fields - self._columns):
+            self._db.execute(
+                f"ALTER TABLE {_quote(self.table)} ADD COLUMN {_quote(field)} TEXT")
+            self._columns.add(field)
+
+    def _upsert_batch(self, batch: list[QSO]):
+        """Inserts or updates a batch of QSOs"""
+        fields = sorted(set(f for q in batch for f in q._d))
+        self._add_columns(set(fields))
+        columns = [ID_COLUMN] + fields
+        # Fields missing in the new record keep their old value
+        updates = ', '.join(f"{_quote(f)} = COALESCE(excluded.{_quote(f)}, {_quote(f)})"
+                            for f in fields)
+        query = (f"INSERT INTO {_quote(self.table)} ({', '.join(_quote(c) for c in columns)}) "
+                 f"VALUES ({', '.join('?' * len(columns))}) "
+                 f"ON CONFLICT({_quote(ID_COLUMN)}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING"))
+        self._db.executemany(query, [[q.identity] + [q._d.get(f) for f in fields]
+                                     for q in batch])
+
+    def upsert(self, qsos, batch_size: int = BATCH_SIZE):
+        """Inserts or updates the QSOs of an iterable in a single transaction
+
+        Returns the number of QSOs processed"""
+        count = 0
+        batch = []
+        with self._transaction():
+            for _qso in qsos:
+                batch.append(_qso)
+                if len(batch) >= batch_size:
+                    self._upsert_batch(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self._upsert_batch(batch)
+                count += len(batch)
+        logging.info(f"{count} QSO(s) exported to {self.path}")
+        return count
+
+    def query(self, sql: str = None, params=()):
+        """Returns the QSOs selected by a SQL query (all of them by default)
+
+        The query must select rows of the QSO table, NULL columns and QSO_ID
+        are not copied into the QSO objects."""
+        if sql is None:
+            sql = f"SELECT * FROM {_quote(self.table)}"
+        qso_list: list[QSO] = []
+        for row in self._db.execute(sql, params):
+            qso_list.append(QSO({key: row[key] for key in row.keys()
+                                 if key != ID_COLUMN and row[key] is not None}))
+        return qso_list
+
+
+def export_adif_to_sqlite(filename: str, db_path: str, table: str = QSO_TABLE, select=None):
+    """Streams an ADIF file into a SQLite database, returns the number of QSOs exported"""
+    with QsoDatabase(db_path, table) as db:
+        return db.upsert(adif.iter_qso_file(filename, select=select))
+
+
+def qso_list_from_sqlite(db_path: str, sql: str = None, params=(), table: str = QSO_TABLE):
+    """Convenience function to get a QSO list from a SQL query, see QsoDatabase.query()"""
+    with QsoDatabase(db_path, table) as db:
+        return db.query(sql, params)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Export an ADIF log into a SQLite database")
+    parser.add_argument('filename', metavar='input_file',
+                        type=str, help='Log file to export (ADIF format)')
+    parser.add_argument('db_path', metavar='database',
+                        type=str, help='SQLite database file')
+    parser.add_argument('--table', metavar='table', type=str,
+                        default=QSO_TABLE, help=f'Table name (default {QSO_TABLE})')
+    parser.add_argument('--select', metavar='expression', type=str, default=None,
+                        help='Only export the QSOs matching the expression')
+    args = parser.parse_args()
+
+    export_adif_to_sqlite(args.filename, args.db_path,
+                          table=args.table, select=args.select)
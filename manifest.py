@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Job manifest for resumable QSL generation
+
+"""
+Job Manifest Module
+
+A render job writes a manifest next to its output: a JSON lines journal whose
+first line describes the job (kind, input and template hashes, number of
+cards) and whose following lines record the status changes of single cards,
+the output chunks written and their concatenation. Lines are only appended, so the manifest costs
+one small write per card and survives interruptions: an incomplete last line
+is ignored when loading it back.
+
+Card status values:
+    rendered : page rendered, not yet part of a final output file
+    done     : card completed (image written, or page merged in an output PDF)
+    failed   : renderer failed, the card is rendered again on resume
+"""
+
+import hashlib
+import json
+import logging
+import os
+from qso import QSO
+
+RENDERED = 'rendered'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def qso_list_hash(qso_list: list[QSO]):
+    """SHA-256 hex digest of the content of a QSO list"""
+    h = hashlib.sha256()
+    for _qso in qso_list:
+        h.update(json.dumps(dict(_qso._d), sort_keys=True).encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def _read(path: str):
+    """Job dict and entries of the journal at path, None if missing or unreadable"""
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rt', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    try:
+        job = json.loads(lines[0]).get('job')
+    except (ValueError, AttributeError):
+        return None
+    entries = []
+    for line in lines[1:]:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # Incomplete line written during an interruption
+            continue
+    return job, entries
+
+
+def job_complete(path: str):
+    """True if the manifest at path records every card of its job as done"""
+    journal = _read(path)
+    if journal is None:
+        return False
+    job, entries = journal
+    cards = {}
+    for entry in entries:
+        if 'card' in entry:
+            cards[entry['card']] = entry.get('status')
+    return list(cards.values()).count(DONE) == job.get('cards')
+
+
+class JobManifest:
+    """Journal of a render job"""
+
+    def __init__(self, path: str, job: dict, resume: bool = False):
+        """Opens the manifest at path for the job described by the job dict
+
+        With resume the previous state is loaded if the manifest describes the
+        same job, otherwise the manifest is started over. Raises ValueError
+        if resume is requested and the manifest belongs to another job with
+        output already written: starting over would reuse its file names."""
+        self.path = path
+        self.job = job
+        # Card index -> dict with status, output, returncode
+        self.cards = {}
+        # Output chunks written so far
+        self.chunks = []
+        # Chunks joined by the last concatenation, None if not concatenated
+        self.concatenated = None
+        # True if the state of a previous run was loaded
+        self.resumed = resume and self._load()
+        if self.resumed:
+            logging.info(
+                f"Resuming job: {len(self.cards_with(DONE))} card(s) done, {len(self.cards_with(FAILED))} failed")
+            self._file = open(path, 'at', encoding='utf-8')
+        else:
+            if resume:
+                journal = _read(path)
+                if journal is not None and any('chunk' in e or e.get('status') == DONE for e in journal[1]):
+                    raise ValueError(f"{path} belongs to another job with output written, "
+                                     "run without resume or use another output folder")
+                logging.warning(
+                    f"No matching manifest found in {path}, starting over")
+            self._file = open(path, 'wt', encoding='utf-8')
+            self._write({'job': job})
+
+    def _load(self):
+        """Loads the journal, returns False if missing or for another job"""
+        journal = _read(self.path)
+        if journal is None or journal[0] != self.job:
+            return False
+        for entry in journal[1]:
+            if 'card' in entry:
+                self.cards[entry.pop('card')] = entry
+            elif 'chunk' in entry:
+                self.chunks.append(entry['chunk'])
+            elif 'concatenated' in entry:
+                self.concatenated = entry['concatenated']
+        return True
+
+    def _write(self, entry: dict):
+        """Appends an entry to the journal, making sure it reaches the disk"""
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close the journal"""
+        self._file.close()
+
+    def status(self, index: int):
+        """Status of a card, None if not processed yet"""
+        return self.cards.get(index, {}).get('status')
+
+    def output(self, index: int):
+        """Output file of a card, None if not processed yet"""
+        return self.cards.get(index, {}).get('output')
+
+    def cards_with(self, status: str):
+        """Sorted indexes of the cards with the given status"""
+        return sorted(i for i, c in self.cards.items() if c.get('status') == status)
+
+    def update(self, index: int, status: str, output: str = None, returncode: int = None):
+        """Records the new status of a card"""
+        self.cards[index] = {'status': status,
+                             'output': output, 'returncode': returncode}
+        self._write({'card': index, **self.cards[index]})
+
+    def add_chunk(self, name: str, indexes: list):
+        """Records an output chunk and marks its cards as done"""
+        self.chunks.append(name)
+        self._write({'chunk': name})
+        for index in indexes:
+            self.update(index, DONE, name)
+
+    def add_concatenation(self, chunks: list):
+        """Records the concatenation of the given chunks into the output"""
+        self.concatenated = list(chunks)
+        self._write({'concatenated': self.concatenated})
@@ -5,16 +5,18 @@
 # Generates a printable QSL starting from an HTML template with Jinja2
 # wkhtmltox reference https://wkhtmltopdf.org/downloads.html
 
-from jinja2 import Environment, FileSystemLoader
-from qso import QSO
-from wkhtml import wkhtmltoimage, wkhtmltopdf
+from ledger import LEDGER_DEFAULT_FILE, QslLedger, file_sha256
+from manifest import DONE, FAILED, RENDERED, JobManifest, qso_list_hash
+from qso import ADIF_CHECKS, IDENTITY_FIELDS, QSO, QsoValidator
+from selection import compile_selection
 import adif
-import argparse
 import logging
 import os
-import pickle
-import pypdf
-import shutil
+import sys
+
+# Templating (jinja2), PDF (pypdf), rendering (wkhtml) and database (logdb)
+# modules are imported by the functions using them, so that importing this
+# module and parsing logs stays fast
 
 # ==========================================
 # EXTERNAL DEPENDENCY WARNING
@@ -50,6 +52,22 @@ OUT_FOLDER = './out/'
 IMG_OUT_BASE_NAME = './qsl_%04d.jpg'
 # Final PDF_filename
 PDF_OUTPUT = './out.pdf'
+# Job manifests, written in the output folder
+MANIFEST_PDF = './out.manifest.jsonl'
+MANIFEST_IMAGE = './qsl.manifest.jsonl'
+
+# PDF chunk base name
+# Usage: filename = PDF_CHUNK_BASE_NAME % chunk_number
+PDF_CHUNK_BASE_NAME = './out_%04d.pdf'
+
+# Batch folder name, from the batch time
+BATCH_FOLDER_FORMAT = '%Y%m%d-%H%M%S'
+
+# Preview folder, resolution, number of cards and image base name
+PREVIEW_FOLDER = './preview/'
+PREVIEW_DPI = 40
+PREVIEW_COUNT = 6
+PREVIEW_BASE_NAME = './preview_%02d.png'
 
 
 def cm_to_px(cm, dpi):
@@ -66,6 +84,79 @@ cmd_options_image = {
     "--width": str(cm_to_px(QSL_WIDTH, 75)), "--height": str(cm_to_px(QSL_HEIGHT, 75))}
 
 
+def allow_options():
+    """Renderer options giving local file access to the template assets only
+
+    QSO values are not escaped by the templates, so a log could otherwise
+    embed any local file in the cards (see assets.py for the asset folders)"""
+    from assets import ASSET_CACHE_FOLDER
+    return ['--allow', os.path.abspath(TEMPLATE_FOLDER),
+            '--allow', os.path.abspath(ASSET_CACHE_FOLDER)]
+
+
+# Jinja environments by template folder and asset DPI, kept to reuse
+# compiled templates
+_environments = {}
+
+
+def template_environment(_template_folder: str = TEMPLATE_FOLDER, asset_dpi: int = None):
+    """Returns the Jinja environment of a template folder
+
+    Environments are cached, so each template is compiled only once and
+    compiled again only when its file or one of its assets changes. Assets
+    referenced by the templates are resolved when they are loaded (see
+    assets.py), images are downscaled to the card size at asset_dpi if given."""
+    env = _environments.get((_template_folder, asset_dpi))
+    if env is None:
+        from assets import AssetLoader, AssetPipeline
+        from jinja2 import Environment
+        max_size = None
+        if asset_dpi is not None:
+            max_size = (cm_to_px(QSL_WIDTH, asset_dpi),
+                        cm_to_px(QSL_HEIGHT, asset_dpi))
+        pipeline = AssetPipeline(_template_folder, max_size)
+        env = Environment(loader=AssetLoader(_template_folder, pipeline),
+                          auto_reload=True)
+        _environments[(_template_folder, asset_dpi)] = env
+    return env
+
+
+def _temp_names(_temp_folder: str):
+    """Compiled template filename and PDF page base name in a temporary folder"""
+    return (os.path.join(_temp_folder, os.path.basename(TEMPLATE_TEMP_FILENAME)),
+            os.path.join(_temp_folder, os.path.basename(PDF_TEMP_BASE_NAME)))
+
+
+def new_batch_folder(out_folder: str):
+    """Path of a new dated batch folder of out_folder, not created yet"""
+    from datetime import datetime
+    name = datetime.now().strftime(BATCH_FOLDER_FORMAT)
+    batch = os.path.join(out_folder, name)
+    suffix = 1
+    while os.path.exists(batch):
+        suffix += 1
+        batch = os.path.join(out_folder, f'{name}-{suffix}')
+    return batch
+
+
+def resumable_batch(out_folder: str, manifests: list):
+    """Latest batch folder of out_folder if one of its jobs is incomplete
+
+    manifests are the manifest file names of the jobs. Returns None if the
+    latest batch with a manifest is complete or there is none."""
+    from manifest import job_complete
+    if not os.path.isdir(out_folder):
+        return None
+    # Dated names, a -n suffix sorts after the name without it
+    for name in sorted(os.listdir(out_folder), reverse=True):
+        batch = os.path.join(out_folder, name)
+        paths = [p for p in (os.path.join(batch, m) for m in manifests)
+                 if os.path.isfile(p)]
+        if paths:
+            return batch if not all(job_complete(p) for p in paths) else None
+    return None
+
+
 def unlink_if_exists(path):
     """Utility function to delete a file without throwing an exception if it doesn't exist"""
     try:
@@ -84,9 +175,144 @@ def dict_to_cmd_list(_cmd_options: dict):
     return cmd_list
 
 
-def generate_qsl_pdf(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FILE, _out_folder: str = OUT_FOLDER):
-    """Generates a PDF file qith the QSLs contained in the given QSO list"""
+# Dict methods which make the fields used by a template unpredictable
+_DICT_METHODS = ['get', 'items', 'keys', 'values']
+
+
+def _template_fields(env, name: str, visited: set):
+    """Recursive helper of template_fields()"""
+    from jinja2 import meta, nodes
+    visited.add(name)
+    ast = env.parse(env.loader.get_source(env, name)[0])
+    fields = set()
+    accesses = 0
+    for node in ast.find_all((nodes.Getattr, nodes.Getitem)):
+        if not (isinstance(node.node, nodes.Name) and node.node.name == 'qso'):
+            continue
+        accesses += 1
+        if isinstance(node, nodes.Getattr):
+            key = node.attr
+        elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+            key = node.arg.value
+        else:
+            # Dynamic key, e.g. qso[name]
+            return None
+        if key in _DICT_METHODS:
+            return None
+        fields.add(key.upper())
+
+    # qso used without attribute access, e.g. {% for k in qso %}
+    if accesses < len([n for n in ast.find_all(nodes.Name) if n.name == 'qso']):
+        return None
+
+    # Included, imported and extended templates
+    for ref in meta.find_referenced_templates(ast):
+        if ref is None:
+            return None
+        if ref not in visited:
+            ref_fields = _template_fields(env, ref, visited)
+            if ref_fields is None:
+                return None
+            fields |= ref_fields
+    return fields
+
+
+def template_fields(_template: str = TEMPLATE_DEFAULT_FILE, _template_folder: str = TEMPLATE_FOLDER):
+    """Returns the set of QSO fields (uppercase) used by a template
+
+    Fields are collected from qso.field and qso['field'] accesses in the
+    template and in the templates it references. Returns None if qso is used
+    in a way that doesn't allow to know them (loops, dynamic keys, ...)."""
+    env = template_environment(_template_folder)
+    return _template_fields(env, _template, set())
+
+
+def _projection(_template: str, fields):
+    """Fields to pass to a template, None for all of them"""
+    if fields is None:
+        fields = template_fields(_template)
+    if fields is None:
+        return None
+    # CALL is always needed for logging
+    return set(f.upper() for f in fields) | {'CALL'}
+
+
+def qso_context(_qso: QSO, fields=None):
+    """Template context of a QSO, only the given fields are included if not None"""
+    # ---------------------------------------------------------------------
+    # DATA FLOW: Python -> Jinja -> HTML
+    # 1. We extract the raw dictionary from the QSO object (_qso._d).
+    # 2. We convert all keys to lowercase (e.g., 'CALL' -> 'call').
+    #    This is done because Jinja templates usually prefer lowercase variables.
+    # 3. We pass this dictionary to the template context as 'qso'.
+    #    This allows the HTML template to access variables like {{ qso.call }}
+    #    or {{ qso.band }}.
+    # ---------------------------------------------------------------------
+    if fields is None:
+        return {key.casefold(): value for key, value in _qso._d.items()}
+    return {key.casefold(): _qso._d[key] for key in fields if key in _qso._d}
+
+
+class ProgressReport:
+    """Progress callback of the render jobs, logging at most every interval seconds
+
+    records is the record count of the log the cards come from (see
+    adif.inspect_adif_file()), None if unknown"""
+
+    def __init__(self, records: int = None, interval: float = 5.0):
+        self.records = records
+        self.interval = interval
+        self._last = None
+
+    def __call__(self, done: int, cards: int):
+        import time
+        now = time.monotonic()
+        if done < cards and self._last is not None and now - self._last < self.interval:
+            return
+        self._last = now
+        source = f" selected from {self.records} log record(s)" if self.records is not None else ''
+        logging.info(
+            f"Progress: {done}/{cards} QSL(s){source}, {100 * done // max(cards, 1)}%")
+
+
+def generate_qsl_pdf(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FILE, _out_folder: str = OUT_FOLDER, fields=None, ledger: QslLedger = None,
+                     chunk_size: int = None, chunk_mb: float = None, concatenate: bool = False, resume: bool = False,
+                     shard=None, asset_dpi: int = None, progress=None, _temp_folder: str = TEMP_FOLDER):
+    """Generates a PDF file qith the QSLs contained in the given QSO list
+
+    fields are the QSO fields passed to the template, derived from the
+    template itself if None (see template_fields())
+
+    If a ledger is given the rendered QSOs are recorded in it
+
+    If chunk_size (cards) or chunk_mb (MB of pages) is given the output is
+    split into out_0001.pdf, out_0002.pdf, ... each written as soon as it is
+    full, so memory usage is bounded. With concatenate the chunks are finally
+    joined into a single PDF: this last step holds every page in memory (see
+    concatenate_pages()), so the bound only applies without it. Returns the
+    list of the output files.
+
+    The progress is journaled in a manifest next to the output (see
+    manifest.JobManifest). With resume the cards completed by a previous
+    interrupted run of the same job are skipped and the failed ones rendered
+    again. Cards whose rendering fails are left out of the output.
+
+    If qso_list is a shard of a larger job, shard is its shards.Shard: the
+    cards of each output file are listed in a shard index next to the output,
+    see shards.merge_shards().
+
+    Images referenced by the template are downscaled to asset_dpi, if given
+    (see template_environment()).
+
+    progress, if given, is called with (cards processed, cards) as the job
+    advances, see ProgressReport.
+
+    Temporary files are written in _temp_folder, deleted at the end."""
+    import pypdf
+    import shutil
+    import wkhtml
     assert isinstance(qso_list, list)
+    template_temp_filename, page_base_name = _temp_names(_temp_folder)
 
     # Template file full path
     template_path = os.path.join(TEMPLATE_FOLDER, _template)
@@ -94,15 +320,12 @@ def generate_qsl_pdf(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FILE
         raise FileNotFoundError(f"Template file {template_path} not found")
 
     # Create temporary folder if not present
-    if not os.path.exists(TEMP_FOLDER):
-        os.makedirs(TEMP_FOLDER)
+    if not os.path.exists(_temp_folder):
+        os.makedirs(_temp_folder)
     else:
-        if not os.path.isdir(TEMP_FOLDER):
-            os.unlink(TEMP_FOLDER)
-            os.makedirs(TEMP_FOLDER)
-
-    # Delete previous output file(s)
-    unlink_if_exists(PDF_OUTPUT)
+        if not os.path.isdir(_temp_folder):
+            os.unlink(_temp_folder)
+            os.makedirs(_temp_folder)
 
     # Create output folder
     if not os.path.exists(_out_folder):
@@ -113,56 +336,199 @@ def generate_qsl_pdf(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FILE
             os.makedirs(_out_folder)
 
     # Loading Jinja environment
-    env = Environment(loader=FileSystemLoader(TEMPLATE_FOLDER))
+    env = template_environment(asset_dpi=asset_dpi)
 
     # Loading HTML template
     template = env.get_template(_template)
+    fields = _projection(_template, fields)
+    template_hash = file_sha256(template_path)
+
+    chunked = chunk_size is not None or chunk_mb is not None
+    manifest = JobManifest(os.path.join(_out_folder, MANIFEST_PDF),
+                           {'kind': 'pdf', 'input_hash': qso_list_hash(qso_list), 'template_hash': template_hash,
+                            'cards': len(qso_list), 'chunk_size': chunk_size, 'chunk_mb': chunk_mb}, resume)
+
+    # Delete the output of a previous job, a resumed job keeps its own
+    out_name = os.path.join(_out_folder, PDF_OUTPUT)
+    if not manifest.resumed:
+        unlink_if_exists(out_name)
+
+    # Chunked output: pages are merged as soon as they are rendered and the
+    # writer is flushed every chunk
+    writer = pypdf.PdfWriter()
+    # Indexes of the cards and page bytes in the writer
+    pending = []
+    pending_bytes = 0
+
+    def flush_chunk():
+        """Writes the pages in the writer to a new chunk and starts a new one"""
+        nonlocal writer, pending, pending_bytes
+        name = os.path.join(_out_folder, PDF_CHUNK_BASE_NAME %
+                            (len(manifest.chunks) + 1))
+        writer.write(name)
+        writer.close()
+        manifest.add_chunk(name, pending)
+        if ledger is not None:
+            ledger.record([qso_list[i] for i in pending], template_hash,
+                          out_name if concatenate else name)
+        writer = pypdf.PdfWriter()
+        pending = []
+        pending_bytes = 0
 
     for i, _qso in enumerate(qso_list):
         assert isinstance(_qso, QSO)
+        if progress is not None:
+            progress(i, len(qso_list))
+        page_name = page_base_name % i
 
-        # ---------------------------------------------------------------------
-        # DATA FLOW: Python -> Jinja -> HTML
-        # 1. We extract the raw dictionary from the QSO object (_qso._d).
-        # 2. We convert all keys to lowercase (e.g., 'CALL' -> 'call').
-        #    This is done because Jinja templates usually prefer lowercase variables.
-        # 3. We pass this dictionary to the template context as 'qso'.
-        #    This allows the HTML template to access variables like {{ qso.call }}
-        #    or {{ qso.band }}.
-        # ---------------------------------------------------------------------
-        qso_data_lowercase = {}
-        for key, value in _qso._d.items():
-            # Converting all keys into lowercase
-            qso_data_lowercase[key.casefold()] = value
+        if manifest.status(i) == DONE or \
+                (manifest.status(i) == RENDERED and os.path.isfile(page_name)):
+            # Completed by a previous run
+            continue
+
+        # Template context with the fields used by the template only
+        qso_data_lowercase = qso_context(_qso, fields)
         output = template.render(qso=qso_data_lowercase)
 
-        logging.info(f"\tCompiling QSL {i+1} to {qso_data_lowercase['call']} ")
+        logging.info(
+            f"\tCompiling QSL {i+1}/{len(qso_list)} to {qso_data_lowercase.get('call')} ")
 
         # Write compiled template to file
-        with open(TEMPLATE_TEMP_FILENAME, 'wt', encoding='utf-8') as f:
+        with open(template_temp_filename, 'wt', encoding='utf-8') as f:
             f.write(output)
 
         # Convert template page to PDF
-        ret = wkhtmltopdf(dict_to_cmd_list(cmd_options_pdf) +
-                          [TEMPLATE_TEMP_FILENAME, (PDF_TEMP_BASE_NAME % i)])
+        ret = wkhtml.wkhtmltopdf(dict_to_cmd_list(cmd_options_pdf) + allow_options() +
+                                 [template_temp_filename, page_name])
         logging.info(f"wkhtmltopdf returned {ret.returncode}")
 
-    # Concatenate all files to create a single PDF to print
-    out_name = os.path.join(_out_folder, PDF_OUTPUT)
+        if ret.returncode != 0 or not os.path.isfile(page_name):
+            logging.error(
+                f"Rendering of QSL {i+1} failed ({ret.returncode}): {ret.stderr}")
+            unlink_if_exists(page_name)
+            manifest.update(i, FAILED, returncode=ret.returncode)
+            continue
+        manifest.update(i, RENDERED, page_name, ret.returncode)
+
+        if chunked:
+            # Merge the page and delete its temporary file
+            pending_bytes += os.path.getsize(page_name)
+            writer.append(page_name)
+            os.unlink(page_name)
+            pending.append(i)
+            if (chunk_size is not None and len(pending) >= chunk_size) or \
+                    (chunk_mb is not None and pending_bytes >= chunk_mb * 2**20):
+                flush_chunk()
+
+    if progress is not None:
+        progress(len(qso_list), len(qso_list))
+    failed = manifest.cards_with(FAILED)
+    if chunked:
+        if pending:
+            flush_chunk()
+        done = manifest.cards_with(DONE)
+        output_cards = [(chunk, [i for i in done if manifest.output(i) == chunk])
+                        for chunk in manifest.chunks]
+        if concatenate:
+            if manifest.concatenated != manifest.chunks or not os.path.isfile(out_name):
+                # Pages in card order, cards rendered again on resume are in
+                # the last chunks
+                pages = sorted((i, chunk, page) for chunk, cards in output_cards
+                               for page, i in enumerate(cards))
+                concatenate_pages([(chunk, page)
+                                  for _, chunk, page in pages], out_name)
+                manifest.add_concatenation(manifest.chunks)
+                # Chunks are kept if they are needed to resume the job
+                if not failed:
+                    for chunk in manifest.chunks:
+                        unlink_if_exists(chunk)
+            else:
+                logging.info(f"{out_name} already complete")
+            output_cards = [(out_name, done)]
+    else:
+        # Single PDF to print, from all the pages rendered so far
+        rendered = manifest.cards_with(RENDERED)
+        if rendered:
+            for i in rendered:
+                writer.append(page_base_name % i)
+            writer.write(out_name)
+            writer.close()
+            if ledger is not None:
+                ledger.record([qso_list[i] for i in rendered],
+                              template_hash, out_name)
+            if not failed:
+                for i in rendered:
+                    manifest.update(i, DONE, out_name)
+            output_cards = [(out_name, rendered)]
+        elif manifest.cards_with(DONE):
+            # Completed by a previous run, its output is left alone
+            logging.info(f"{out_name} already complete")
+            output_cards = [(out_name, manifest.cards_with(DONE))]
+        else:
+            output_cards = []
+    manifest.close()
+
+    if shard is not None:
+        import shards
+        shards.write_shard_index(os.path.join(_out_folder, shards.SHARD_INDEX),
+                                 shard, output_cards)
+
+    if failed:
+        # Pages are kept to resume the job
+        logging.error(
+            f"{len(failed)} QSL(s) failed, run again with resume to complete the job")
+    elif os.path.exists(_temp_folder):
+        # Delete temporary folder and its content
+        shutil.rmtree(_temp_folder)
+
+    return [name for name, _ in output_cards]
+
+
+def concatenate_pages(pages: list, out_name: str):
+    """Writes the given (PDF file, page number) pages into out_name, in order
+
+    pypdf writes a document in one go, so every page is held in memory until
+    the end: memory usage grows with the size of out_name"""
+    import pypdf
+    readers = {}
     writer = pypdf.PdfWriter()
-    for pdf in [(PDF_TEMP_BASE_NAME % i) for i in range(len(qso_list))]:
-        writer.append(pdf)
+    for pdf, page in pages:
+        if pdf not in readers:
+            readers[pdf] = pypdf.PdfReader(pdf)
+        writer.add_page(readers[pdf].pages[page])
     writer.write(out_name)
     writer.close()
 
-    # Delete temporary folder and its content
-    if os.path.exists(TEMP_FOLDER):
-        shutil.rmtree(TEMP_FOLDER)
 
+def generate_qsl_image(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FILE, _out_folder: str = OUT_FOLDER, fields=None, ledger: QslLedger = None,
+                       resume: bool = False, shard=None, asset_dpi: int = None, progress=None,
+                       _temp_folder: str = TEMP_FOLDER):
+    """Generates one QSL image per QSO in the given list
+
+    fields are the QSO fields passed to the template, derived from the
+    template itself if None (see template_fields())
+
+    If a ledger is given the rendered QSOs are recorded in it
+
+    The progress is journaled in a manifest next to the output (see
+    manifest.JobManifest). With resume the images completed by a previous
+    interrupted run of the same job are skipped and the failed ones rendered
+    again. Returns the list of the images written.
 
-def generate_qsl_image(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FILE, _out_folder: str = OUT_FOLDER):
-    """Generates one QSL image per QSO in the given list"""
+    If qso_list is a shard of a larger job, shard is its shards.Shard and the
+    images are named after the index of the QSOs in the full list.
+
+    Images referenced by the template are downscaled to asset_dpi, if given
+    (see template_environment()).
+
+    progress, if given, is called with (cards processed, cards) as the job
+    advances, see ProgressReport.
+
+    Temporary files are written in _temp_folder."""
+    import shutil
+    import wkhtml
     assert isinstance(qso_list, list)
+    template_temp_filename, _ = _temp_names(_temp_folder)
 
     # Template file full path
     template_path = os.path.join(TEMPLATE_FOLDER, _template)
@@ -170,16 +536,16 @@ def generate_qsl_image(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FI
         raise FileNotFoundError(f"Template file {template_path} not found")
 
     # Delete previous output file(s)
-    if os.path.exists(TEMP_FOLDER):
-        shutil.rmtree(TEMP_FOLDER)
+    if os.path.exists(_temp_folder) and not resume:
+        shutil.rmtree(_temp_folder)
 
     # Create temporary folder if not present
-    if not os.path.exists(TEMP_FOLDER):
-        os.makedirs(TEMP_FOLDER)
+    if not os.path.exists(_temp_folder):
+        os.makedirs(_temp_folder)
     else:
-        if not os.path.isdir(TEMP_FOLDER):
-            os.unlink(TEMP_FOLDER)
-            os.makedirs(TEMP_FOLDER)
+        if not os.path.isdir(_temp_folder):
+            os.unlink(_temp_folder)
+            os.makedirs(_temp_folder)
 
     # Create output folder
     if not os.path.exists(_out_folder):
@@ -190,39 +556,181 @@ def generate_qsl_image(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FI
             os.makedirs(_out_folder)
 
     # Loading Jinja environment
-    env = Environment(loader=FileSystemLoader(TEMPLATE_FOLDER))
+    env = template_environment(asset_dpi=asset_dpi)
 
     # Loading HTML template
     template = env.get_template(_template)
+    fields = _projection(_template, fields)
+    template_hash = file_sha256(template_path)
+
+    manifest = JobManifest(os.path.join(_out_folder, MANIFEST_IMAGE),
+                           {'kind': 'image', 'input_hash': qso_list_hash(qso_list), 'template_hash': template_hash,
+                            'cards': len(qso_list)}, resume)
 
     for i, _qso in enumerate(qso_list):
         assert isinstance(_qso, QSO)
+        if progress is not None:
+            progress(i, len(qso_list))
+        out_name = os.path.join(_out_folder, (IMG_OUT_BASE_NAME %
+                                              (shard.indexes[i] if shard else i)))
+
+        if manifest.status(i) == DONE and os.path.isfile(out_name):
+            # Completed by a previous run
+            continue
 
         # Rendering the template and storing the resulting text in variable output
-        qso_data_lowercase = {}
-        for key, value in _qso._d.items():
-            # Converting all keys into lowercase
-            qso_data_lowercase[key.casefold()] = value
+        qso_data_lowercase = qso_context(_qso, fields)
         output = template.render(qso=qso_data_lowercase)
 
-        logging.info(f"\tCompiling QSL {i+1} to {qso_data_lowercase['call']} ")
+        logging.info(
+            f"\tCompiling QSL {i+1}/{len(qso_list)} to {qso_data_lowercase.get('call')} ")
 
         # Write compiled template to file
-        with open(TEMPLATE_TEMP_FILENAME, 'wt', encoding='utf-8') as f:
+        with open(template_temp_filename, 'wt', encoding='utf-8') as f:
             f.write(output)
 
         # Convert template page to PDF
-        out_name = os.path.join(_out_folder, (IMG_OUT_BASE_NAME % i))
-        ret = wkhtmltoimage(dict_to_cmd_list(cmd_options_image) +
-                            [TEMPLATE_TEMP_FILENAME, out_name])
+        ret = wkhtml.wkhtmltoimage(dict_to_cmd_list(cmd_options_image) + allow_options() +
+                                   [template_temp_filename, out_name])
         logging.info(f"wkhtmltoimage returned {ret.returncode}")
 
-
-if __name__ == '__main__':
+        if ret.returncode != 0 or not os.path.isfile(out_name):
+            logging.error(
+                f"Rendering of QSL {i+1} failed ({ret.returncode}): {ret.stderr}")
+            manifest.update(i, FAILED, returncode=ret.returncode)
+            continue
+        manifest.update(i, DONE, out_name, ret.returncode)
+
+        if ledger is not None:
+            ledger.record([_qso], template_hash, out_name)
+
+    if progress is not None:
+        progress(len(qso_list), len(qso_list))
+    failed = manifest.cards_with(FAILED)
+    if failed:
+        logging.error(
+            f"{len(failed)} QSL(s) failed, run again with resume to complete the job")
+    output_files = [manifest.output(i) for i in manifest.cards_with(DONE)]
+    manifest.close()
+    return output_files
+
+
+def preview_sample(qso_list: list[QSO], count: int = PREVIEW_COUNT, fields=None):
+    """Up to count QSOs of the list exercising the layout of a template
+
+    Picked in order: QSOs missing BAND or FREQ, QSOs with non-ASCII values,
+    then the shortest and longest value of each field (fields used by the
+    template, all of them if None); filled up with the first QSOs."""
+    sample = []
+
+    def pick(_qso):
+        if _qso is not None and len(sample) < count and all(q is not _qso for q in sample):
+            sample.append(_qso)
+
+    pick(next((q for q in qso_list if not q._d.get('BAND')), None))
+    pick(next((q for q in qso_list if not q._d.get('FREQ')), None))
+    pick(next((q for q in qso_list if not all(v.isascii()
+                                              for v in q._d.values())), None))
+    if fields is None:
+        fields = sorted(set(f for q in qso_list for f in q._d))
+    for field in sorted(fields):
+        having = [q for q in qso_list if field in q._d]
+        if having:
+            pick(max(having, key=lambda q: len(q._d[field])))
+            pick(min(having, key=lambda q: len(q._d[field])))
+    for _qso in qso_list:
+        pick(_qso)
+    return sample
+
+
+def generate_preview(qso_list: list[QSO], _template: str = TEMPLATE_DEFAULT_FILE, _out_folder: str = PREVIEW_FOLDER,
+                     count: int = PREVIEW_COUNT, dpi: int = PREVIEW_DPI, workers: int = 4,
+                     _temp_folder: str = os.path.join(TEMP_FOLDER, 'preview')):
+    """Renders low resolution PNG images of a sample of the QSOs (see preview_sample())
+
+    Cards are rendered at dpi by up to workers renderers in parallel, no
+    manifest or ledger is written and the compiled template is reused until
+    the template or one of its assets changes.
+    Returns the list of the images written."""
+    import wkhtml
+    from concurrent.futures import ThreadPoolExecutor
+    template_path = os.path.join(TEMPLATE_FOLDER, _template)
+    if not os.path.isfile(template_path):
+        raise FileNotFoundError(f"Template file {template_path} not found")
+    # Images downscaled to the preview size
+    template = template_environment(asset_dpi=dpi).get_template(_template)
+    fields = _projection(_template, None)
+    sample = preview_sample(qso_list, count, fields)
+    os.makedirs(_temp_folder, exist_ok=True)
+    os.makedirs(_out_folder, exist_ok=True)
+    # Card layout at 75 DPI (as generate_qsl_image), zoomed to the preview size
+    options = dict_to_cmd_list({**cmd_options_image,
+                                "--width": str(cm_to_px(QSL_WIDTH, dpi)),
+                                "--height": str(cm_to_px(QSL_HEIGHT, dpi)),
+                                "--zoom": f"{dpi / 75:.3f}", "--format": "png"}) + allow_options()
+
+    def render(i: int, html: str):
+        html_name = os.path.join(_temp_folder, f'preview_{i:02d}.html')
+        out_name = os.path.join(_out_folder, PREVIEW_BASE_NAME % i)
+        with open(html_name, 'wt', encoding='utf-8') as f:
+            f.write(html)
+        ret = wkhtml.wkhtmltoimage(options + [html_name, out_name])
+        if ret.returncode != 0 or not os.path.isfile(out_name):
+            logging.error(f"Preview {i+1} failed ({ret.returncode}): {ret.stderr}")
+            return None
+        return out_name
+
+    pages = [template.render(qso=qso_context(q, fields)) for q in sample]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        images = list(executor.map(render, range(len(pages)), pages))
+    logging.info(f"{len(sample)} preview(s) rendered in {_out_folder}")
+    return [i for i in images if i is not None]
+
+
+def _folder_signature(folder: str):
+    """Size and modification time of the files of a folder"""
+    signature = {}
+    for root, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature[path] = (stat.st_size, stat.st_mtime_ns)
+    return signature
+
+
+def watch_preview(qso_list: list[QSO], stop, _template: str = TEMPLATE_DEFAULT_FILE, interval: float = 0.2,
+                  on_render=None, **kwargs):
+    """Renders the preview, then again whenever a file of the templates folder
+    changes, until the stop threading.Event is set
+
+    on_render is called with the list of images after each render, kwargs are
+    passed to generate_preview()"""
+    signature = None
+    while not stop.is_set():
+        current = _folder_signature(TEMPLATE_FOLDER)
+        if current != signature:
+            signature = current
+            try:
+                images = generate_preview(qso_list, _template, **kwargs)
+            except Exception as e:
+                # Templates are often broken while being edited
+                logging.error(f"Preview of {_template} failed: {e}")
+            else:
+                if on_render is not None:
+                    on_render(images)
+        stop.wait(interval)
+
+
+def generate_command(argv: list):
+    """Command line: generates the QSLs of a log"""
+    import argparse
     parser = argparse.ArgumentParser(
-        description="Generate a .pdf file from a QSO list in .adi or .dump format")
+        description="Generate a .pdf file from a QSO list in .adi, .sqlite or .dump format")
     parser.add_argument('filename', metavar='input_file',
-                        type=str, help='Log file to process (ADIF format)')
+                        type=str, help='Log file to process (ADIF format or SQLite database)')
     parser.add_argument('outname', metavar='output_file',
                         nargs='?', default='out.pdf', type=str, help='Output file name')
     parser.add_argument('--pdf', action='store_true',
@@ -233,8 +741,36 @@ if __name__ == '__main__':
                         default=TEMPLATE_DEFAULT_FILE, help=f'Template to use from {TEMPLATE_FOLDER} folder (default {TEMPLATE_DEFAULT_FILE})')
     parser.add_argument('--output-dir', metavar='output_folder', type=str,
                         default=OUT_FOLDER, help=f'Output folder (default {OUT_FOLDER})')
-
-    args = parser.parse_args()
+    parser.add_argument('--fields', metavar='field_list', type=str, default=None,
+                        help='Comma separated QSO fields used by the template (default: derived from the template)')
+    parser.add_argument('--chunk-size', metavar='cards', type=int, default=None,
+                        help='Split the PDF output every N cards (out_0001.pdf, out_0002.pdf, ...)')
+    parser.add_argument('--chunk-mb', metavar='MB', type=float, default=None,
+                        help='Split the PDF output every N MB of pages')
+    parser.add_argument('--concatenate', action='store_true',
+                        help='Join the PDF chunks into a single file at the end (holds every page in memory)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume an interrupted job, skipping the cards already completed')
+    parser.add_argument('--only-new', action='store_true',
+                        help='Only print the QSOs not yet recorded in the ledger')
+    parser.add_argument('--ledger', metavar='ledger_file', type=str, default=LEDGER_DEFAULT_FILE,
+                        help=f'Ledger of the printed QSOs (default {LEDGER_DEFAULT_FILE})')
+    parser.add_argument('--no-ledger', action='store_true',
+                        help='Do not record the printed QSOs in the ledger')
+    parser.add_argument('--sql', metavar='query', type=str, default=None,
+                        help='SQL query selecting the QSOs when the input is a SQLite database (default: all)')
+    parser.add_argument('--select', metavar='expression', type=str, default=None,
+                        help='Only print the QSOs matching the expression, e.g. "band in (20m,40m) and qsl_sent == N"')
+    parser.add_argument('--skip-invalid', action='store_true',
+                        help='Skip the QSOs missing essential fields or with values not valid for their ADIF type')
+    parser.add_argument('--asset-dpi', metavar='DPI', type=int, default=None,
+                        help='Downscale the images of the template to the card size at this DPI (requires Pillow)')
+    parser.add_argument('--shard', metavar='i/n', type=str, default=None,
+                        help='Only render shard i of n of the selected QSOs, PDF shards are joined by the merge command')
+    parser.add_argument('--shard-by', choices=['hash', 'range'], default='hash',
+                        help='Split shards by hash of the QSO identity or in contiguous ranges (default hash)')
+
+    args = parser.parse_args(argv)
 
     # Filename to be processed
     filename = os.path.relpath(args.filename)
@@ -256,24 +792,215 @@ if __name__ == '__main__':
     # File extension
     ext = filename.split('.')[-1]
 
+    # Compile the selection once, it is applied while parsing
+    select = compile_selection(args.select)
+
+    # Fields needed by the template, the others are not even parsed
+    fields = _projection(args.template, args.fields.split(',')
+                         if args.fields else None)
+
+    # Ledger of the printed QSOs, identity fields must be parsed to use it
+    ledger = None
+    if args.only_new or not args.no_ledger:
+        ledger = QslLedger(args.ledger)
+        if fields is not None:
+            fields |= set(IDENTITY_FIELDS)
+
+    # Validation rules, the fields they check must be parsed too
+    validator = None
+    if args.skip_invalid:
+        validator = QsoValidator(checks=ADIF_CHECKS)
+        if fields is not None:
+            fields |= validator.fields
+
+    # Record count of the log, for progress reporting
+    records = None
     if ext.casefold() in ['adi', 'adif']:
-        logging.info(f"Proceeding to parse ADIF file {args.filename}")
-        qso_list = adif.qso_list_from_file(filename)
+        # Record count from a raw scan, for progress reporting
+        summary = adif.inspect_adif_file(filename)
+        records = summary.records
+        if summary.declared_records not in [None, summary.records]:
+            logging.warning(
+                f"{args.filename} declares {summary.declared_records} records, {summary.records} found")
+        logging.info(
+            f"Proceeding to parse ADIF file {args.filename} ({summary.records} records)")
+        qso_list = adif.qso_list_from_file(
+            filename, select=select, fields=fields)
+        logging.info(
+            f"{len(qso_list)} of {summary.records} QSO(s) selected")
 
     elif ext.casefold() in ['dump',]:
         logging.warning("TEST ONLY dump file, not for production!")
         # Unpickle data
+        import pickle
         with open(args.filename, 'rb') as f:
             qso_list = pickle.load(f)
+        if select is not None:
+            qso_list = [q for q in qso_list if select(q)]
+    elif ext.casefold() in ['db', 'sqlite', 'sqlite3']:
+        logging.info(f"Proceeding to query database {args.filename}")
+        import logdb
+        qso_list = logdb.qso_list_from_sqlite(filename, args.sql)
+        if select is not None:
+            qso_list = [q for q in qso_list if select(q)]
     else:
         raise Exception("Unrecognized file extension")
 
+    if validator is not None:
+        report = validator.validate(qso_list)
+        report.log()
+        qso_list = report.select(qso_list)
+        logging.info(f"{report.invalid} invalid QSO(s) skipped")
+
+    out_folder = args.output_dir
+    if args.only_new:
+        batch = None
+        if args.resume:
+            manifests = ([MANIFEST_PDF] if args.pdf else []) + \
+                ([MANIFEST_IMAGE] if args.image else [])
+            batch = resumable_batch(args.output_dir, manifests)
+        # The cards already printed by the resumed job are still part of it,
+        # so that it gets the same QSO list
+        qso_list = ledger.filter_new(qso_list, exclude_folder=batch)
+        if not qso_list:
+            # The output of the previous run is left alone
+            logging.info("No new QSO, nothing to print")
+            return
+        # Each run in its own folder, so that the outputs recorded in the
+        # ledger are never overwritten
+        out_folder = batch or new_batch_folder(args.output_dir)
+        logging.info(
+            f"{'Resuming' if batch else 'Output'} folder {out_folder}")
+    if args.no_ledger:
+        ledger = None
+
+    shard = None
+    temp_folder = TEMP_FOLDER
+    if args.shard:
+        import shards
+        index, count = shards.parse_shard(args.shard)
+        qso_list, shard = shards.split(qso_list, index, count, args.shard_by)
+        # Shards may run side by side on the same machine
+        temp_folder = os.path.join(TEMP_FOLDER, f'shard_{index}_of_{count}')
+
     if args.pdf:
         # Output as PDF
         generate_qsl_pdf(qso_list, _template=args.template,
-                         _out_folder=args.output_dir)
+                         _out_folder=out_folder, fields=fields, ledger=ledger,
+                         chunk_size=args.chunk_size, chunk_mb=args.chunk_mb, concatenate=args.concatenate,
+                         resume=args.resume, shard=shard, asset_dpi=args.asset_dpi,
+                         progress=ProgressReport(records), _temp_folder=temp_folder)
 
     if args.image:
         # Output as images
         generate_qsl_image(qso_list, _template=args.template,
-                           _out_folder=args.output_dir)
+                           _out_folder=out_folder, fields=fields, ledger=ledger,
+                           resume=args.resume, shard=shard, asset_dpi=args.asset_dpi,
+                           progress=ProgressReport(records), _temp_folder=temp_folder)
+
+
+def inspect_command(argv: list):
+    """Command line: prints the summary of logs without parsing them"""
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(prog='qsl_generator.py inspect',
+                                     description="Print record count, header fields and date range of ADIF logs")
+    parser.add_argument('filenames', metavar='input_file', type=str, nargs='+',
+                        help='Log files (ADIF format)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the summaries as JSON')
+    args = parser.parse_args(argv)
+
+    summaries = [adif.inspect_adif_file(f) for f in args.filenames]
+    if args.json:
+        print(json.dumps([s._asdict() for s in summaries], indent=2))
+        return
+    for summary in summaries:
+        print(f"{summary.filename}:")
+        for key, value in summary._asdict().items():
+            if key != 'filename':
+                print(f"  {key}: {'-' if value is None else value}")
+
+
+def preview_command(argv: list):
+    """Command line: renders previews of a template, again at every change"""
+    import argparse
+    import threading
+    parser = argparse.ArgumentParser(prog='qsl_generator.py preview',
+                                     description="Render low resolution previews of a template with a sample of a log")
+    parser.add_argument('filename', metavar='input_file', type=str,
+                        help='Log file (ADIF format)')
+    parser.add_argument('--template', metavar='template_file', type=str, default=TEMPLATE_DEFAULT_FILE,
+                        help=f'Template to use from {TEMPLATE_FOLDER} folder (default {TEMPLATE_DEFAULT_FILE})')
+    parser.add_argument('--output-dir', metavar='output_folder', type=str, default=PREVIEW_FOLDER,
+                        help=f'Output folder (default {PREVIEW_FOLDER})')
+    parser.add_argument('--count', type=int, default=PREVIEW_COUNT,
+                        help=f'Number of cards (default {PREVIEW_COUNT})')
+    parser.add_argument('--dpi', type=int, default=PREVIEW_DPI,
+                        help=f'Resolution (default {PREVIEW_DPI})')
+    parser.add_argument('--watch', action='store_true',
+                        help='Render again whenever the templates change, until interrupted')
+    args = parser.parse_args(argv)
+
+    qso_list = adif.qso_list_from_file(args.filename)
+    options = {'_out_folder': args.output_dir,
+               'count': args.count, 'dpi': args.dpi}
+    if not args.watch:
+        generate_preview(qso_list, args.template, **options)
+        return
+    stop = threading.Event()
+    try:
+        watch_preview(qso_list, stop, args.template, **options)
+    except KeyboardInterrupt:
+        stop.set()
+
+
+def merge_command(argv: list):
+    """Command line: merges the PDFs of sharded jobs"""
+    import shards
+    shards.main(argv)
+
+
+def serve_command(argv: list):
+    """Command line: runs the HTTP render service"""
+    import qsl_server
+    qsl_server.main(argv)
+
+
+def watch_command(argv: list):
+    """Command line: renders the QSOs appended to a log while it is written"""
+    import watcher
+    watcher.main(argv)
+
+
+def stats_command(argv: list):
+    """Command line: prints the statistics of logs as JSON"""
+    import stats
+    stats.main(argv)
+
+
+# Command line commands, the default one is generate_command
+COMMANDS = {
+    'inspect': inspect_command,
+    'merge': merge_command,
+    'preview': preview_command,
+    'serve': serve_command,
+    'stats': stats_command,
+    'watch': watch_command,
+}
+
+
+def main(argv: list = None):
+    """Command line entry point
+
+    If the first argument is one of COMMANDS that command is run, otherwise
+    the QSLs of the given log are generated"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+    else:
+        generate_command(argv)
+
+
+if __name__ == '__main__':
+    main()
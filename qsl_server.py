@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# HTTP render service for the QSL generator
+
+"""
+QSL Render Service
+
+Long running HTTP service generating QSLs on demand, started with
+
+    python qsl_generator.py serve [--host HOST] [--port PORT] [--workers N]
+
+Endpoints:
+    POST /render   ADIF log in the request body, or path=<log> to read a log
+                   from the service log folder. Query parameters:
+                     template : template from the templates folder
+                     format   : pdf (default) or image (ZIP of JPEG files)
+                     select   : selection expression (see selection.py)
+                   Returns the PDF or the ZIP file, with the number of
+                   cards whose rendering failed in the X-Failed-Cards
+                   header (500 if all of them failed).
+    GET /health    JSON status of the service
+
+Jinja templates stay compiled between requests, parsed logs are cached by
+content and renders run on a fixed pool of workers. Requests exceeding the
+queue limit are rejected with 503, uploads larger than the upload limit with
+413.
+"""
+
+import adif
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import qsl_generator
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from selection import SelectionError, compile_selection
+from urllib.parse import parse_qs, urlparse
+
+# Default service address
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8073
+
+# Largest log accepted in the request body (bytes)
+MAX_UPLOAD = 64 * 2**20
+
+
+class ServiceBusy(Exception):
+    """The request queue is full"""
+    pass
+
+
+class NothingToRender(Exception):
+    """No QSO in the log or matching the selection"""
+    pass
+
+
+class RenderError(Exception):
+    """No card of a request could be rendered"""
+    pass
+
+
+class RenderService:
+    """Renders QSLs with warm caches and a bounded worker pool"""
+
+    def __init__(self, workers: int = 2, max_queue: int = 8, cache_size: int = 16, log_folder: str = '.',
+                 max_upload: int = MAX_UPLOAD):
+        """workers renders run at the same time, at most max_queue requests
+        wait for them; cache_size parsed logs are kept; logs given by path
+        must be in log_folder; uploaded logs are at most max_upload bytes"""
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_upload = max_upload
+        self.log_folder = os.path.realpath(log_folder)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='qsl-render')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.renders = 0
+
+    def close(self):
+        """Stops the workers, waiting for the running renders"""
+        self._executor.shutdown(wait=True)
+
+    def _cached(self, key, load):
+        """Returns the cached value of key, calling load() on misses"""
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._cache[key]
+        value = load()
+        with self._cache_lock:
+            self._cache[key] = value
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def log_path(self, path: str):
+        """Full path of a log in the log folder, None if outside of it"""
+        full_path = os.path.realpath(os.path.join(self.log_folder, path))
+        if os.path.commonpath([full_path, self.log_folder]) != self.log_folder or \
+                not os.path.isfile(full_path):
+            return None
+        return full_path
+
+    def parse(self, data: bytes = None, path: str = None, select: str = None, fields=None):
+        """QSO list of an uploaded log (data) or of a log file (path), cached"""
+        select = compile_selection(select)
+        options = (select.expression if select else None,
+                   tuple(sorted(fields)) if fields is not None else None)
+        if data is not None:
+            key = (hashlib.sha256(data).hexdigest(),) + options
+            return self._cached(key, lambda: list(adif.iter_qso_string(
+                data.decode('utf-8'), select=select, fields=fields)))
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size) + options
+        return self._cached(key, lambda: adif.qso_list_from_file(path, select=select, fields=fields))
+
+    def render(self, qso_list: list, template: str, _format: str = 'pdf'):
+        """Renders a QSO list, returns (content type, content, failed cards)
+
+        Raises RenderError if no card could be rendered"""
+        job_folder = tempfile.mkdtemp(prefix='qsl_job_')
+        try:
+            out_folder = os.path.join(job_folder, 'out')
+            temp_folder = os.path.join(job_folder, 'tmp')
+            if _format == 'image':
+                files = qsl_generator.generate_qsl_image(qso_list, _template=template, _out_folder=out_folder,
+                                                         _temp_folder=temp_folder)
+                buffer = io.BytesIO()
+                with zipfile.ZipFile(buffer, 'w') as z:
+                    for f in files:
+                        z.write(f, os.path.basename(f))
+                content = ('application/zip', buffer.getvalue())
+                cards = len(files)
+            else:
+                import pypdf
+                files = qsl_generator.generate_qsl_pdf(qso_list, _template=template, _out_folder=out_folder,
+                                                       _temp_folder=temp_folder)
+                # No output if every card failed
+                content, cards = ('application/pdf', b''), 0
+                if files:
+                    with open(files[0], 'rb') as f:
+                        content = ('application/pdf', f.read())
+                    cards = len(pypdf.PdfReader(io.BytesIO(content[1])).pages)
+            if not cards:
+                raise RenderError(f"Rendering of all the {len(qso_list)} QSL(s) failed")
+            self.renders += 1
+            return content + (len(qso_list) - cards,)
+        finally:
+            shutil.rmtree(job_folder, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Holds a place in the queue for a request
+
+        Raises ServiceBusy if the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            raise ServiceBusy()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def submit(self, data: bytes = None, path: str = None, template: str = qsl_generator.TEMPLATE_DEFAULT_FILE,
+               _format: str = 'pdf', select: str = None):
+        """Parses and renders a log on the worker pool, to be called holding a
+        slot(). Returns (content type, content, failed cards)"""
+        fields = qsl_generator._projection(template, None)
+        qso_list = self.parse(data, path, select, fields)
+        if not qso_list:
+            raise NothingToRender()
+        return self._executor.submit(self.render, qso_list, template, _format).result()
+
+    def status(self):
+        """Service status"""
+        return {'workers': self.workers, 'max_queue': self.max_queue, 'cached_logs': len(self._cache),
+                'cache_hits': self.cache_hits, 'renders': self.renders}
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of RenderService, the service is server.service"""
+
+    def _reply(self, code: int, content_type: str, content: bytes, headers: dict = None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _error(self, code: int, message: str):
+        self._reply(code, 'application/json',
+                    json.dumps({'error': message}).encode('utf-8'))
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._reply(200, 'application/json', json.dumps(
+                self.server.service.status()).encode('utf-8'))
+        else:
+            self._error(404, 'Not found')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/render':
+            self._error(404, 'Not found')
+            return
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        service: RenderService = self.server.service
+
+        template = os.path.basename(query.get(
+            'template', qsl_generator.TEMPLATE_DEFAULT_FILE))
+        if not os.path.isfile(os.path.join(qsl_generator.TEMPLATE_FOLDER, template)):
+            self._error(404, f"Template {template} not found")
+            return
+        _format = query.get('format', 'pdf')
+        if _format not in ['pdf', 'image']:
+            self._error(400, f"Invalid format {_format}")
+            return
+
+        data, path = None, None
+        if 'path' in query:
+            path = service.log_path(query['path'])
+            if path is None:
+                self._error(404, f"Log {query['path']} not found")
+                return
+        else:
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._error(400, 'Invalid Content-Length')
+                return
+            if length > service.max_upload:
+                # The body is not read, don't reuse the connection
+                self.close_connection = True
+                self._error(413, f"Log larger than {service.max_upload} bytes")
+                return
+
+        try:
+            # The body is only read once the request has a place in the queue
+            with service.slot():
+                if path is None:
+                    data = self.rfile.read(length)
+                content_type, content, failed = service.submit(data, path, template, _format,
+                                                               query.get('select'))
+        except ServiceBusy:
+            self.close_connection = True
+            self._error(503, 'Too many requests, try again later')
+        except NothingToRender:
+            self._error(404, 'No QSO to render')
+        except (adif.AdifError, SelectionError, UnicodeDecodeError) as e:
+            self._error(400, str(e))
+        except RenderError as e:
+            self._error(500, str(e))
+        except Exception as e:
+            logging.exception("Render failed")
+            self._error(500, str(e))
+        else:
+            if failed:
+                logging.error(f"{failed} QSL(s) failed")
+            self._reply(200, content_type, content,
+                        {'X-Failed-Cards': str(failed)})
+
+
+def make_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, service: RenderService = None):
+    """Creates the HTTP server (port 0 picks a free port), not started yet"""
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    server.service = service or RenderService()
+    return server
+
+
+def main(argv: list = None):
+    """Command line entry point of the service"""
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(prog='qsl_generator.py serve',
+                                     description="Run the QSL render service")
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST,
+                        help=f'Address to listen on (default {DEFAULT_HOST})')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'Port to listen on (default {DEFAULT_PORT})')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Renders running at the same time (default 2)')
+    parser.add_argument('--max-queue', type=int, default=8,
+                        help='Requests waiting for a worker before rejecting new ones (default 8)')
+    parser.add_argument('--log-folder', type=str, default='.',
+                        help='Folder of the logs that can be requested by path (default .)')
+    parser.add_argument('--max-upload-mb', type=float, default=MAX_UPLOAD / 2**20,
+                        help=f'Largest log accepted in a request, in MB (default {MAX_UPLOAD // 2**20})')
+    args = parser.parse_args(argv)
+
+    service = RenderService(workers=args.workers, max_queue=args.max_queue,
+                            log_folder=args.log_folder, max_upload=int(args.max_upload_mb * 2**20))
+    server = make_server(args.host, args.port, service)
+    logging.info(
+        f"QSL render service listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,10 @@
 # This software under the MIT License
 
 import logging
+import re
+from collections import Counter
+from datetime import datetime, timezone
+from functools import cached_property
 
 # List of essential QSO keys
 _ESSENTIAL_KEYS = [
@@ -13,6 +17,75 @@ _ESSENTIAL_KEYS = [
     "MODE",
 ]
 
+# Fields making up the identity of a QSO, see QSO.identity
+IDENTITY_FIELDS = ["STATION_CALLSIGN", "CALL",
+                   "QSO_DATE", "TIME_ON", "BAND", "FREQ", "MODE"]
+
+# ADIF band plan: (band, lower edge, upper edge) in MHz
+_BANDS = [
+    ("2190m", 0.1357, 0.1378),
+    ("630m", 0.472, 0.479),
+    ("560m", 0.501, 0.504),
+    ("160m", 1.8, 2.0),
+    ("80m", 3.5, 4.0),
+    ("60m", 5.06, 5.45),
+    ("40m", 7.0, 7.3),
+    ("30m", 10.1, 10.15),
+    ("20m", 14.0, 14.35),
+    ("17m", 18.068, 18.168),
+    ("15m", 21.0, 21.45),
+    ("12m", 24.890, 24.99),
+    ("10m", 28.0, 29.7),
+    ("8m", 40, 45),
+    ("6m", 50, 54),
+    ("5m", 54.000001, 69.9),
+    ("4m", 70, 71),
+    ("2m", 144, 148),
+    ("1.25m", 222, 225),
+    ("70cm", 420, 450),
+    ("33cm", 902, 928),
+    ("23cm", 1240, 1300),
+    ("13cm", 2300, 2450),
+    ("9cm", 3300, 3500),
+    ("6cm", 5650, 5925),
+    ("3cm", 10000, 10500),
+    ("1.25cm", 24000, 24250),
+    ("6mm", 47000, 47200),
+    ("4mm", 75500, 81000),
+    ("2.5mm", 119980, 123000),
+    ("2mm", 134000, 149000),
+    ("1mm", 241000, 250000),
+    ("submm", 300000, 7500000),
+]
+
+
+def _parse_datetime(date: str, time: str):
+    """Converts ADIF date (YYYYMMDD) and time (HHMM or HHMMSS) into an UTC datetime"""
+    if len(date) != 8 or len(time) not in [4, 6] or not (date + time).isdigit():
+        raise ValueError(f"Invalid date/time {date} {time}")
+    return datetime.strptime(date + time.ljust(6, '0'), '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+
+def location_to_degrees(location: str):
+    """Converts an ADIF location (XDDD MM.MMM) into signed decimal degrees"""
+    direction = location[0].upper()
+    if direction not in 'NSEW' or len(location) != 11 or location[4] != ' ':
+        raise ValueError(f"Invalid location {location}")
+    degrees = int(location[1:4]) + float(location[5:]) / 60
+    return -degrees if direction in 'SW' else degrees
+
+
+def freq_to_band(freq):
+    """Returns the ADIF band (lowercase) of a frequency in MHz, None if not in any band"""
+    try:
+        freq = float(freq)
+    except (TypeError, ValueError):
+        return None
+    for band, low, high in _BANDS:
+        if low <= freq <= high:
+            return band
+    return None
+
 
 class QSO:
     """Class representing a single QSO record"""
@@ -33,6 +106,16 @@ class QSO:
                 # All keys are put uppercase and values are converted to string
                 self._d[key.upper()] = str(value)
 
+    @classmethod
+    def from_record(cls, record):
+        """QSO using a record mapping as is, without copying it
+
+        The record must have uppercase keys and non empty string values, as
+        the records of adif.AdifReader and adif.LazyRecord"""
+        _qso = cls.__new__(cls)
+        _qso._d = record
+        return _qso
+
     def __str__(self):
         """String representation of the object"""
         _str = ''
@@ -40,19 +123,223 @@ class QSO:
             _str += f"{key} = {self._d[key]}\n"
         return _str
 
+    # --- Typed accessors ---
+    # Values are converted on first access and cached in the instance,
+    # None is returned if the field is missing or malformed
+
+    def _typed(self, key: str, convert):
+        """Converts the value of key, None if missing or invalid"""
+        value = self._d.get(key)
+        if value is None:
+            return None
+        try:
+            return convert(value)
+        except (ValueError, ArithmeticError):
+            logging.warning(f"Invalid value for {key} ({value})")
+            return None
+
+    @cached_property
+    def datetime_on(self):
+        """QSO start as UTC datetime, from QSO_DATE and TIME_ON (HHMM or HHMMSS)"""
+        date, time = self._d.get('QSO_DATE'), self._d.get('TIME_ON')
+        if date is None or time is None:
+            return None
+        return self._typed('TIME_ON', lambda t: _parse_datetime(date, t))
+
+    @cached_property
+    def freq(self):
+        """FREQ in MHz as float"""
+        return self._typed('FREQ', float)
+
+    @cached_property
+    def freq_decimal(self):
+        """FREQ in MHz as Decimal, for exact comparisons"""
+        from decimal import Decimal
+        return self._typed('FREQ', Decimal)
+
+    @cached_property
+    def distance(self):
+        """DISTANCE in km as int"""
+        return self._typed('DISTANCE', lambda v: int(float(v)))
+
+    @cached_property
+    def cqz(self):
+        """CQZ as int"""
+        return self._typed('CQZ', int)
+
+    @cached_property
+    def dxcc(self):
+        """DXCC entity code as int"""
+        return self._typed('DXCC', int)
+
+    @cached_property
+    def lat(self):
+        """LAT in signed decimal degrees"""
+        return self._typed('LAT', location_to_degrees)
+
+    @cached_property
+    def lon(self):
+        """LON in signed decimal degrees"""
+        return self._typed('LON', location_to_degrees)
+
+    @cached_property
+    def identity(self):
+        """Stable identity of the contact
+
+        Built from station callsign, call, date, time (HHMM), band (derived
+        from FREQ if missing) and mode, so it doesn't change when other fields
+        are added or edited."""
+        band = self._d.get('BAND', '').lower() or freq_to_band(
+            self._d.get('FREQ')) or ''
+        return '|'.join([self._d.get('STATION_CALLSIGN', '').upper(),
+                         self._d.get('CALL', '').upper(),
+                         self._d.get('QSO_DATE', ''),
+                         self._d.get('TIME_ON', '')[:4],
+                         band,
+                         self._d.get('MODE', '').upper()])
+
     def is_valid(self):
-        """Checks if the QSO is valid"""
+        """Checks if the QSO is valid
+
+        Use QsoValidator to check many QSOs at once"""
         # All essential fields must be present
         for key in _ESSENTIAL_KEYS:
             # If the key itself is a list the check at least one of the elements is present
             if isinstance(key, list):
-                if len([self._d.get(tuple_key) for tuple_key in key if self._d.get(tuple_key)]) == 0:
+                if not any(self._d.get(tuple_key) for tuple_key in key):
                     logging.warning(
-                        f"No fields among {key} ({len([self._d.get(tuple_key) for tuple_key in key if self._d.get(tuple_key)])}) found, invalid QSO")
+                        f"No fields among {key} found, invalid QSO")
                     return False
             else:
-                if key not in self._d.keys() or not self._d.get(key):
+                if not self._d.get(key):
                     logging.warning(
                         f"Essential field {key} not found, invalid QSO")
                     return False
         return True
+
+
+# --- Bulk validation ---
+
+_DATE_RE = re.compile(
+    r"(19[3-9]\d|[2-9]\d{3})(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])")
+_TIME_RE = re.compile(r"([01]\d|2[0-3])[0-5]\d([0-5]\d)?")
+_NUMBER_RE = re.compile(r"-?(\d+\.?\d*|\.\d+)")
+_INTEGER_RE = re.compile(r"\d+")
+_BAND_NAMES = frozenset(band for band, _, _ in _BANDS)
+_QSL_SENT_VALUES = frozenset('YNRQI')
+_QSL_RCVD_VALUES = frozenset('YNRIV')
+
+
+def _enumeration(values: frozenset, fold=str.upper):
+    """Check of an enumeration field, case insensitive"""
+    return lambda value: fold(value) in values
+
+
+# ADIF type and enumeration checks for QsoValidator: field -> (type, check)
+# The check gets the string value and returns a true value if valid
+ADIF_CHECKS = {
+    'QSO_DATE': ('Date', _DATE_RE.fullmatch),
+    'QSO_DATE_OFF': ('Date', _DATE_RE.fullmatch),
+    'TIME_ON': ('Time', _TIME_RE.fullmatch),
+    'TIME_OFF': ('Time', _TIME_RE.fullmatch),
+    'FREQ': ('Number', _NUMBER_RE.fullmatch),
+    'FREQ_RX': ('Number', _NUMBER_RE.fullmatch),
+    'BAND': ('Band', _enumeration(_BAND_NAMES, str.lower)),
+    'BAND_RX': ('Band', _enumeration(_BAND_NAMES, str.lower)),
+    'DXCC': ('Integer', _INTEGER_RE.fullmatch),
+    'CQZ': ('Integer', _INTEGER_RE.fullmatch),
+    'ITUZ': ('Integer', _INTEGER_RE.fullmatch),
+    'QSL_SENT': ('QSL Sent', _enumeration(_QSL_SENT_VALUES)),
+    'QSL_RCVD': ('QSL Rcvd', _enumeration(_QSL_RCVD_VALUES)),
+    'LOTW_QSL_SENT': ('QSL Sent', _enumeration(_QSL_SENT_VALUES)),
+    'LOTW_QSL_RCVD': ('QSL Rcvd', _enumeration(_QSL_RCVD_VALUES)),
+    'EQSL_QSL_SENT': ('QSL Sent', _enumeration(_QSL_SENT_VALUES)),
+    'EQSL_QSL_RCVD': ('QSL Rcvd', _enumeration(_QSL_RCVD_VALUES)),
+}
+
+
+class ValidationReport:
+    """Result of a bulk validation
+
+    mask has one byte per QSO, 1 if valid and 0 if not; reasons counts the
+    QSOs failing each rule (a QSO may fail more than one)"""
+
+    def __init__(self, mask: bytearray, reasons: Counter):
+        self.mask = mask
+        self.reasons = reasons
+
+    @property
+    def invalid(self):
+        """Number of invalid QSOs"""
+        return self.mask.count(0)
+
+    def select(self, items: list):
+        """Items of the validated batch whose QSO is valid"""
+        return [item for item, ok in zip(items, self.mask) if ok]
+
+    def log(self):
+        """Logs one warning per failed rule"""
+        for reason, count in self.reasons.most_common():
+            logging.warning(f"{count} invalid QSO(s): {reason}")
+
+
+class QsoValidator:
+    """Validation rules compiled once and applied to whole batches of QSOs
+
+    essential is a list of fields that must be present, an item may be a list
+    of alternatives of which at least one must be present. checks maps fields
+    to (type name, check function), e.g. ADIF_CHECKS; fields missing from a
+    QSO are not checked."""
+
+    def __init__(self, essential: list = _ESSENTIAL_KEYS, checks: dict = None):
+        self._essential = []
+        for key in essential:
+            alternatives = tuple(key) if isinstance(key, list) else (key,)
+            reason = f"Essential field {key} not found" if len(alternatives) == 1 \
+                else f"No fields among {list(alternatives)} found"
+            self._essential.append((alternatives, reason))
+        self._checks = [(field, f"Invalid {type_name} value for {field}", check)
+                        for field, (type_name, check) in (checks or {}).items()]
+        # Fields read by the rules
+        self.fields = frozenset(f for alternatives, _ in self._essential for f in alternatives) | \
+            frozenset(field for field, _, _ in self._checks)
+
+    def validate_columns(self, columns: dict, length: int):
+        """Validates a columnar table: field -> list of length values (None if missing)
+
+        Returns a ValidationReport"""
+        mask = bytearray(b'\x01') * length
+        reasons = Counter()
+        missing = [None] * length
+
+        def fail(indexes: list, reason: str):
+            if indexes:
+                reasons[reason] += len(indexes)
+                for i in indexes:
+                    mask[i] = 0
+
+        for alternatives, reason in self._essential:
+            if len(alternatives) == 1:
+                present = columns.get(alternatives[0]) or missing
+            else:
+                present = list(map(any, zip(*(columns.get(f) or missing
+                                              for f in alternatives))))
+            if not all(present):
+                fail([i for i, value in enumerate(present) if not value], reason)
+        for field, reason, check in self._checks:
+            column = columns.get(field)
+            if column is None:
+                continue
+            # Values repeat a lot (dates, bands, flags), each one is checked once
+            wrong = set(value for value in set(column)
+                        if value and not check(value))
+            if wrong:
+                fail([i for i, value in enumerate(column) if value in wrong], reason)
+        return ValidationReport(mask, reasons)
+
+    def validate(self, items: list):
+        """Validates a batch of QSO objects (or field dicts), returns a ValidationReport"""
+        records = [item._d if isinstance(item, QSO) else item for item in items]
+        columns = {field: [r.get(field) for r in records]
+                   for field in self.fields}
+        return self.validate_columns(columns, len(records))
@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# QSO selection expressions
+
+"""
+Selection Module
+
+Compiles selection expressions such as
+
+    band in (20m, 40m) and qsl_sent == N and qso_date >= 20240101
+
+into predicates on QSO records. Supported syntax:
+- comparisons: field == value, !=, <, <=, >, >= (= is an alias of ==)
+- membership: field in (v1, v2, ...), field not in (...)
+- boolean operators: and, or, not, parentheses
+- values: bare words or quoted strings ('...' or "...")
+
+Field names are case-insensitive. Values are compared as numbers when both
+sides are numeric, otherwise as case-insensitive strings. A missing field
+compares as an empty string.
+
+Predicates support partial evaluation on incomplete records, so the parser
+can discard a record as soon as the fields deciding it have been read.
+"""
+
+import re
+from collections.abc import Mapping
+
+
+class SelectionError(Exception):
+    """Invalid selection expression"""
+    pass
+
+
+# Tokens: parentheses, commas, operators, quoted strings, bare words
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<punct>[(),])|(?P<op>==|!=|<=|>=|<|>|=)|'(?P<sq>[^']*)'|\"(?P<dq>[^\"]*)\"|(?P<word>[^\s(),=!<>'\"]+))")
+
+_KEYWORDS = ['and', 'or', 'not', 'in']
+
+
+def _tokenize(expression: str):
+    """Splits an expression into (kind, text) tokens"""
+    tokens = []
+    cursor = 0
+    expression = expression.rstrip()
+    while cursor < len(expression):
+        match = _TOKEN_RE.match(expression, cursor)
+        if match is None:
+            raise SelectionError(
+                f"Unexpected character at position {cursor}: {expression[cursor:]}")
+        cursor = match.end()
+        if match.group('punct'):
+            tokens.append((match.group('punct'), match.group('punct')))
+        elif match.group('op'):
+            op = match.group('op')
+            tokens.append(('op', '==' if op == '=' else op))
+        elif match.group('word') is not None and match.group('word').casefold() in _KEYWORDS:
+            tokens.append((match.group('word').casefold(), match.group('word')))
+        else:
+            value = match.group('word')
+            if value is None:
+                value = match.group('sq') if match.group(
+                    'sq') is not None else match.group('dq')
+            tokens.append(('value', value))
+    return tokens
+
+
+def _number(value: str):
+    """Float value of a string, None if not numeric"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _compare(op: str, value: str, constant: str, constant_number):
+    """Compares a field value with a constant"""
+    number = _number(value) if constant_number is not None else None
+    if number is not None:
+        a, b = number, constant_number
+    else:
+        a, b = value.casefold(), constant.casefold()
+    if op == '==':
+        return a == b
+    if op == '!=':
+        return a != b
+    if op == '<':
+        return a < b
+    if op == '<=':
+        return a <= b
+    if op == '>':
+        return a > b
+    return a >= b
+
+
+# Compiled nodes are functions (record, final) -> True, False or None
+# (None meaning undecided). If final is False missing fields may still come.
+
+def _comparison_node(field: str, op: str, constant: str):
+    constant_number = _number(constant)
+
+    def node(record, final):
+        value = record.get(field)
+        if value is None:
+            if not final:
+                return None
+            value = ''
+        return _compare(op, value, constant, constant_number)
+    return node
+
+
+def _membership_node(field: str, constants: list, negate: bool):
+    constants = [(c, _number(c)) for c in constants]
+
+    def node(record, final):
+        value = record.get(field)
+        if value is None:
+            if not final:
+                return None
+            value = ''
+        found = any(_compare('==', value, c, n) for c, n in constants)
+        return found != negate
+    return node
+
+
+def _not_node(operand):
+    def node(record, final):
+        result = operand(record, final)
+        return None if result is None else not result
+    return node
+
+
+def _and_node(operands: list):
+    def node(record, final):
+        result = True
+        for operand in operands:
+            r = operand(record, final)
+            if r is False:
+                return False
+            if r is None:
+                result = None
+        return result
+    return node
+
+
+def _or_node(operands: list):
+    def node(record, final):
+        result = False
+        for operand in operands:
+            r = operand(record, final)
+            if r is True:
+                return True
+            if r is None:
+                result = None
+        return result
+    return node
+
+
+class _Parser:
+    """Recursive descent parser of selection expressions"""
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.pos = 0
+        # Fields referenced by the expression
+        self.fields = set()
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def take(self, kind: str):
+        if self.peek() != kind:
+            found = self.tokens[self.pos][1] if self.pos < len(
+                self.tokens) else 'end of expression'
+            raise SelectionError(f"Expected {kind}, found {found}")
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise SelectionError(
+                f"Unexpected {self.tokens[self.pos][1]} in expression")
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == 'or':
+            self.take('or')
+            operands.append(self.parse_and())
+        return operands[0] if len(operands) == 1 else _or_node(operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() == 'and':
+            self.take('and')
+            operands.append(self.parse_not())
+        return operands[0] if len(operands) == 1 else _and_node(operands)
+
+    def parse_not(self):
+        if self.peek() == 'not':
+            self.take('not')
+            return _not_node(self.parse_not())
+        if self.peek() == '(':
+            self.take('(')
+            node = self.parse_or()
+            self.take(')')
+            return node
+        return self.parse_condition()
+
+    def parse_condition(self):
+        field = self.take('value').upper()
+        self.fields.add(field)
+        if self.peek() == 'op':
+            op = self.take('op')
+            return _comparison_node(field, op, self.take('value'))
+        negate = False
+        if self.peek() == 'not':
+            self.take('not')
+            negate = True
+        self.take('in')
+        self.take('(')
+        constants = [self.take('value')]
+        while self.peek() == ',':
+            self.take(',')
+            constants.append(self.take('value'))
+        self.take(')')
+        return _membership_node(field, constants, negate)
+
+
+class Selection:
+    """Compiled selection expression
+
+    Instances are callable on QSO objects or on field dicts with uppercase keys."""
+
+    def __init__(self, expression: str):
+        assert isinstance(expression, str)
+        self.expression = expression
+        parser = _Parser(_tokenize(expression))
+        self._node = parser.parse()
+        # Uppercase names of the fields the expression depends on
+        self.fields = frozenset(parser.fields)
+
+    def __call__(self, record):
+        """True if the (complete) record is selected"""
+        if not isinstance(record, Mapping):
+            record = record._d
+        return self._node(record, True)
+
+    def decide(self, record: dict):
+        """Partial evaluation on an incomplete record
+
+        Returns True or False if the outcome doesn't depend on the fields still
+        missing, None otherwise."""
+        return self._node(record, False)
+
+    def __repr__(self):
+        return f"Selection({self.expression!r})"
+
+
+def compile_selection(select):
+    """Returns a Selection from an expression string, Selection objects pass through"""
+    if select is None or isinstance(select, Selection):
+        return select
+    return Selection(select)
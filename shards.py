@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Sharded rendering of large logs
+
+"""
+Shards Module
+
+Splits the QSOs of a render job into n shards, so that each machine renders
+its own shard independently:
+
+    python qsl_generator.py my_log.adi --shard 1/3 --output-dir shard1
+    python qsl_generator.py my_log.adi --shard 2/3 --output-dir shard2
+    ...
+    python qsl_generator.py merge shard1 shard2 shard3 --output qsl.pdf
+
+Shards are built either by a stable hash of QSO.identity or as contiguous
+ranges of the QSO list, and only depend on the input and the options, so every
+node computes the same partition. Cards keep their index in the full list
+of the job, i.e. among the QSOs selected by every node before splitting:
+images are named after it and each PDF job writes a shard index (out.shard.json)
+listing the cards of every output file, used by merge_shards() to stitch the
+pages back in the original order.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import namedtuple
+from manifest import qso_list_hash
+from qso import QSO
+
+# Partitioning methods
+SHARD_METHODS = ['hash', 'range']
+
+# Shard index file name, written in the output folder
+SHARD_INDEX = './out.shard.json'
+
+# Shard of a render job
+#   index      : shard number, from 1 to count
+#   count      : number of shards
+#   method     : partitioning method, one of SHARD_METHODS
+#   cards      : number of QSOs of the full job
+#   input_hash : hash of the full QSO list, see manifest.qso_list_hash()
+#   indexes    : index in the full list of each QSO of the shard
+Shard = namedtuple(
+    'Shard', ['index', 'count', 'method', 'cards', 'input_hash', 'indexes'])
+
+
+def parse_shard(value: str):
+    """Parses a shard specification i/n into (i, n)"""
+    try:
+        index, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value}, expected i/n") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {value}, i must be between 1 and n")
+    return index, count
+
+
+def _stable_hash(_qso: QSO):
+    """Hash of the QSO identity, the same on every machine"""
+    return int.from_bytes(hashlib.sha256(_qso.identity.encode('utf-8')).digest()[:8], 'big')
+
+
+def split(qso_list: list[QSO], index: int, count: int, method: str = 'hash'):
+    """Shard index/count of a QSO list, returns (QSO list of the shard, Shard)"""
+    if method == 'hash':
+        indexes = [i for i, q in enumerate(qso_list)
+                   if _stable_hash(q) % count == index - 1]
+    elif method == 'range':
+        indexes = list(range(len(qso_list) * (index - 1) // count,
+                             len(qso_list) * index // count))
+    else:
+        raise ValueError(f"Unknown shard method {method}")
+    shard = Shard(index, count, method, len(qso_list),
+                  qso_list_hash(qso_list), indexes)
+    logging.info(
+        f"Shard {index}/{count}: {len(indexes)} of {len(qso_list)} QSO(s)")
+    return [qso_list[i] for i in indexes], shard
+
+
+def write_shard_index(path: str, shard: Shard, files: list):
+    """Writes the shard index of a PDF job
+
+    files is a list of (PDF file, indexes in the shard of its pages)"""
+    with open(path, 'wt', encoding='utf-8') as f:
+        json.dump({'shard': shard.index, 'shards': shard.count, 'method': shard.method,
+                   'cards': shard.cards, 'input_hash': shard.input_hash,
+                   'files': [{'file': os.path.relpath(name, os.path.dirname(path)),
+                              'indexes': [shard.indexes[i] for i in cards]}
+                             for name, cards in files]}, f)
+
+
+def merge_shards(paths: list, out_name: str):
+    """Stitches the PDFs of the shards into out_name, in the original order
+
+    paths are shard index files or the output folders containing them.
+    Returns the number of pages written."""
+    import pypdf
+    job = None
+    shards = set()
+    # Index in the full list -> (PDF file, page)
+    pages = {}
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, SHARD_INDEX)
+        with open(path, 'rt', encoding='utf-8') as f:
+            index = json.load(f)
+        shard_job = (index['shards'], index['method'],
+                     index['cards'], index['input_hash'])
+        if job is None:
+            job = shard_job
+        elif shard_job != job:
+            raise ValueError(f"{path} belongs to another job")
+        if index['shard'] in shards:
+            raise ValueError(f"Shard {index['shard']} given twice")
+        shards.add(index['shard'])
+        for entry in index['files']:
+            pdf = os.path.join(os.path.dirname(path), entry['file'])
+            for page, i in enumerate(entry['indexes']):
+                pages[i] = (pdf, page)
+    if job is None:
+        raise ValueError("No shard to merge")
+
+    missing_shards = sorted(set(range(1, job[0] + 1)) - shards)
+    if missing_shards:
+        logging.warning(f"Missing shard(s) {missing_shards}")
+    missing_cards = job[2] - len(pages)
+    if missing_cards:
+        logging.warning(f"{missing_cards} card(s) missing from the shards")
+
+    readers = {}
+    writer = pypdf.PdfWriter()
+    for i in sorted(pages):
+        pdf, page = pages[i]
+        if pdf not in readers:
+            readers[pdf] = pypdf.PdfReader(pdf)
+        writer.add_page(readers[pdf].pages[page])
+    writer.write(out_name)
+    writer.close()
+    logging.info(f"{len(pages)} page(s) of {len(shards)} shard(s) merged into {out_name}")
+    return len(pages)
+
+
+def main(argv: list = None):
+    """Command line entry point of the shard merge"""
+    import argparse
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(prog='qsl_generator.py merge',
+                                     description="Merge the PDFs of sharded render jobs in the original order")
+    parser.add_argument('paths', metavar='shard', type=str, nargs='+',
+                        help=f'Output folder of a shard (or its {os.path.basename(SHARD_INDEX)} file)')
+    parser.add_argument('--output', metavar='output_file', type=str, default='out.pdf',
+                        help='Merged PDF (default out.pdf)')
+    args = parser.parse_args(argv)
+
+    merge_shards(args.paths, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Log statistics and award progress
+
+"""
+Log Statistics Module
+
+Computes the statistics of ADIF logs in a single streaming pass:
+    - QSOs per band, per mode and per band and mode
+    - unique calls, exact or approximate (HyperLogLog) for huge logs
+    - DXCC entities worked and confirmed (QSL card or LoTW)
+    - QSL_SENT and QSL_RCVD values
+Apart from the exact unique calls, memory usage doesn't depend on the log
+size. The state of the statistics, including the position reached in each
+log, can be saved and updated later with the records appended since. Run as
+
+    python qsl_generator.py stats <log files> [--state FILE] [--approximate]
+"""
+
+import adif
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+from collections import Counter
+from qso import QSO, freq_to_band
+
+# Fields read from the logs
+STATS_FIELDS = ['CALL', 'BAND', 'FREQ', 'MODE', 'DXCC',
+                'QSL_SENT', 'QSL_RCVD', 'LOTW_QSL_RCVD']
+
+# Fields confirming a QSO for the DXCC award, when set to Y (or V, verified)
+CONFIRMED_FIELDS = ['QSL_RCVD', 'LOTW_QSL_RCVD']
+CONFIRMED_VALUES = ['Y', 'V']
+
+# Key used for QSOs without band, mode or QSL status
+UNKNOWN = 'unknown'
+
+# Version of the saved state format
+STATE_VERSION = 1
+
+
+class HyperLogLog:
+    """Approximate distinct counter using a fixed amount of memory
+
+    2^precision one byte registers are used, the standard error is about
+    1.04 / sqrt(2^precision) (0.8% with the default precision)"""
+
+    def __init__(self, precision: int = 14, registers: bytes = None):
+        assert 4 <= precision <= 18
+        self.precision = precision
+        self._m = 1 << precision
+        self._registers = bytearray(registers or self._m)
+        assert len(self._registers) == self._m
+
+    def add(self, value: str):
+        """Adds a value to the set"""
+        h = int.from_bytes(hashlib.blake2b(
+            value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        # Position of the first 1 bit of the remaining bits
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def __len__(self):
+        """Estimated number of distinct values"""
+        m = self._m
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / \
+            sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def state(self):
+        """Serializable state"""
+        return {'precision': self.precision, 'registers': self._registers.hex()}
+
+    @classmethod
+    def from_state(cls, state: dict):
+        return cls(state['precision'], bytes.fromhex(state['registers']))
+
+
+class LogStats:
+    """Statistics of a set of QSOs, updated one QSO at a time"""
+
+    def __init__(self, approximate: bool = False, select: str = None):
+        """With approximate the unique calls are estimated in fixed memory.
+        select is the selection expression applied to the logs read with
+        update_file()"""
+        self.approximate = approximate
+        self.select = select
+        self.qsos = 0
+        self.bands = Counter()
+        self.modes = Counter()
+        # (band, mode) -> QSOs
+        self.band_modes = Counter()
+        self.calls = HyperLogLog() if approximate else set()
+        self.dxcc_worked = set()
+        self.dxcc_confirmed = set()
+        self.qsl_sent = Counter()
+        self.qsl_rcvd = Counter()
+        # Log file -> byte offset after the last record counted
+        self.offsets = {}
+
+    def add(self, _qso: QSO):
+        """Counts a QSO"""
+        d = _qso._d
+        self.qsos += 1
+        band = d.get('BAND', '').lower() or freq_to_band(
+            d.get('FREQ')) or UNKNOWN
+        mode = d.get('MODE', '').upper() or UNKNOWN
+        self.bands[band] += 1
+        self.modes[mode] += 1
+        self.band_modes[(band, mode)] += 1
+        call = d.get('CALL', '').upper()
+        if call:
+            self.calls.add(call)
+        dxcc = _qso.dxcc
+        if dxcc is not None:
+            self.dxcc_worked.add(dxcc)
+            if any(d.get(f, '').upper() in CONFIRMED_VALUES for f in CONFIRMED_FIELDS):
+                self.dxcc_confirmed.add(dxcc)
+        self.qsl_sent[d.get('QSL_SENT', '').upper() or UNKNOWN] += 1
+        self.qsl_rcvd[d.get('QSL_RCVD', '').upper() or UNKNOWN] += 1
+
+    def update(self, qsos):
+        """Counts the QSOs of an iterable, returns their number"""
+        count = 0
+        for _qso in qsos:
+            self.add(_qso)
+            count += 1
+        return count
+
+    def update_file(self, filename: str):
+        """Counts the records of an ADIF file not counted yet
+
+        Only the records appended since the previous call are read. Raises
+        ValueError if the file is shorter than before, the statistics must
+        then be computed again. Returns the number of QSOs counted."""
+        key = os.path.abspath(filename)
+        offset = self.offsets.get(key, 0)
+        if os.path.getsize(filename) < offset:
+            raise ValueError(f"{filename} is shorter than before")
+        count = 0
+        for batch, offset in adif.iter_appended_batches(filename, offset, select=self.select,
+                                                        fields=STATS_FIELDS):
+            count += self.update(batch)
+            self.offsets[key] = offset
+        logging.info(f"{count} new QSO(s) in {filename}")
+        return count
+
+    def to_dict(self):
+        """Statistics summary, ready for JSON"""
+        band_modes = {}
+        for (band, mode), count in sorted(self.band_modes.items()):
+            band_modes.setdefault(band, {})[mode] = count
+        return {
+            'qsos': self.qsos,
+            'unique_calls': len(self.calls),
+            'unique_calls_approximate': self.approximate,
+            'bands': dict(self.bands.most_common()),
+            'modes': dict(self.modes.most_common()),
+            'band_modes': band_modes,
+            'dxcc': {
+                'worked': len(self.dxcc_worked),
+                'confirmed': len(self.dxcc_confirmed),
+                'unconfirmed': sorted(self.dxcc_worked - self.dxcc_confirmed),
+            },
+            'qsl_sent': dict(sorted(self.qsl_sent.items())),
+            'qsl_rcvd': dict(sorted(self.qsl_rcvd.items())),
+        }
+
+    def state(self):
+        """Complete state, ready for JSON, see from_state()"""
+        return {
+            'version': STATE_VERSION,
+            'approximate': self.approximate,
+            'select': self.select,
+            'offsets': self.offsets,
+            'qsos': self.qsos,
+            'bands': self.bands,
+            'modes': self.modes,
+            'band_modes': [[b, m, n] for (b, m), n in self.band_modes.items()],
+            'calls': self.calls.state() if self.approximate else sorted(self.calls),
+            'dxcc_worked': sorted(self.dxcc_worked),
+            'dxcc_confirmed': sorted(self.dxcc_confirmed),
+            'qsl_sent': self.qsl_sent,
+            'qsl_rcvd': self.qsl_rcvd,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        """Statistics from a state saved with state()"""
+        if state.get('version') != STATE_VERSION:
+            raise ValueError(
+                f"Unsupported statistics state version {state.get('version')}")
+        stats = cls(state['approximate'], state['select'])
+        stats.offsets = dict(state['offsets'])
+        stats.qsos = state['qsos']
+        stats.bands = Counter(state['bands'])
+        stats.modes = Counter(state['modes'])
+        stats.band_modes = Counter(
+            {(b, m): n for b, m, n in state['band_modes']})
+        stats.calls = HyperLogLog.from_state(state['calls']) if stats.approximate \
+            else set(state['calls'])
+        stats.dxcc_worked = set(state['dxcc_worked'])
+        stats.dxcc_confirmed = set(state['dxcc_confirmed'])
+        stats.qsl_sent = Counter(state['qsl_sent'])
+        stats.qsl_rcvd = Counter(state['qsl_rcvd'])
+        return stats
+
+
+def stats_from_files(filenames: list, approximate: bool = False, select: str = None):
+    """Convenience function computing the statistics of ADIF files"""
+    stats = LogStats(approximate, select)
+    for filename in filenames:
+        stats.update_file(filename)
+    return stats
+
+
+def load_state(path: str, approximate: bool = False, select: str = None):
+    """Loads the statistics saved in path
+
+    Returns empty statistics if the file is missing or was computed with other
+    options"""
+    if not os.path.isfile(path):
+        return LogStats(approximate, select)
+    with open(path, 'rt', encoding='utf-8') as f:
+        try:
+            stats = LogStats.from_state(json.load(f))
+        except (ValueError, KeyError) as e:
+            logging.warning(f"Invalid statistics state {path} ({e}), starting over")
+            return LogStats(approximate, select)
+    if stats.approximate != approximate or stats.select != select:
+        logging.warning(
+            f"Statistics in {path} computed with other options, starting over")
+        return LogStats(approximate, select)
+    return stats
+
+
+def save_state(stats: LogStats, path: str):
+    """Saves the statistics state into path"""
+    temp = path + '.tmp'
+    with open(temp, 'wt', encoding='utf-8') as f:
+        json.dump(stats.state(), f)
+    os.replace(temp, path)
+
+
+def main(argv: list = None):
+    """Command line entry point of the statistics"""
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(prog='qsl_generator.py stats',
+                                     description="Print the statistics of ADIF logs as JSON")
+    parser.add_argument('filenames', metavar='input_file', type=str, nargs='+',
+                        help='Log files (ADIF format)')
+    parser.add_argument('--select', metavar='expression', type=str, default=None,
+                        help='Only count the QSOs matching the expression')
+    parser.add_argument('--approximate', action='store_true',
+                        help='Estimate the unique calls in fixed memory')
+    parser.add_argument('--state', metavar='state_file', type=str, default=None,
+                        help='Statistics state file, only the records appended since the last run are read')
+    parser.add_argument('--output', metavar='output_file', type=str, default=None,
+                        help='Write the JSON into a file instead of the standard output')
+    args = parser.parse_args(argv)
+
+    if args.state:
+        stats = load_state(args.state, args.approximate, args.select)
+    else:
+        stats = LogStats(args.approximate, args.select)
+    try:
+        for filename in args.filenames:
+            stats.update_file(filename)
+    except ValueError as e:
+        logging.warning(f"{e}, computing the statistics again")
+        stats = stats_from_files(args.filenames, args.approximate, args.select)
+    if args.state:
+        save_state(stats, args.state)
+
+    output = json.dumps(stats.to_dict(), indent=2)
+    if args.output:
+        with open(args.output, 'wt', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
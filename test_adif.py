@@ -5,6 +5,8 @@
 
 import unittest
 import adif
+import os
+import pickle
 
 
 class TestAdifParser(unittest.TestCase):
@@ -53,6 +55,176 @@ class TestAdifParser(unittest.TestCase):
         self.assertEqual(qso_list[0]._d['CALL'], 'K1A')
         self.assertEqual(qso_list[1]._d['CALL'], 'K2B')
 
+    def test_reader_chunks(self):
+        # Feeding the log one character at a time must give the same records
+        with open('iu4pra_sample_log.adi', 'rt') as f:
+            data = f.read()
+        reader = adif.AdifReader()
+        records = []
+        for c in data[:5000]:
+            records += reader.feed(c)
+        expected = [q._d for q in adif.iter_qso_string(data)]
+        self.assertGreater(len(records), 0)
+        self.assertEqual(records, expected[:len(records)])
+
+    def test_qso_list_from_file(self):
+        # The streaming reader must agree with the field list parser
+        for filename in ['sample_log.adi', 'iu4pra_sample_log.adi']:
+            expected = adif.adif_to_qso_list(adif.parse_adif_file(filename))
+            qso_list = adif.qso_list_from_file(filename)
+            self.assertEqual([q._d for q in qso_list],
+                             [q._d for q in expected])
+
+    def test_reader_incomplete_record(self):
+        with self.assertRaises(adif.AdifError):
+            list(adif.iter_qso_string("<CALL:3>K1A <EOR> <CALL:3>K2B"))
+        with self.assertRaises(adif.AdifError):
+            list(adif.iter_qso_string("<CALL:3>K1A <CALL:3>K2B <EOR>"))
+
+    def test_lazy_records(self):
+        # Lazy records agree with the streaming reader
+        for filename in ['sample_log.adi', 'iu4pra_sample_log.adi', 'test_log.adi']:
+            expected = [q._d for q in adif.qso_list_from_file(filename)]
+            qso_list = adif.qso_list_from_file(filename, lazy=True)
+            self.assertEqual([dict(q._d) for q in qso_list], expected)
+        # Values are decoded on access only, multibyte characters included
+        data = "Log <EOH> <NAME:5>Jo\u00ebl! <CALL:4>W1AW <BAND:3>20m <EOR>".encode('utf-8')
+        record = next(adif.iter_lazy_records(data))
+        self.assertIsNone(record._values)
+        self.assertEqual(record['CALL'], 'W1AW')
+        self.assertEqual(list(record._values), ['CALL'])
+        self.assertEqual(record['NAME'], 'Jo\u00ebl!')
+        self.assertNotIn('MODE', record)
+        self.assertIsNone(record.get('MODE'))
+        self.assertEqual(pickle.loads(pickle.dumps(record)),
+                         {'NAME': 'Jo\u00ebl!', 'CALL': 'W1AW', 'BAND': '20m'})
+
+    def test_lazy_records_select(self):
+        expression = 'band in (20m, 40m) and qsl_rcvd == N'
+        expected = [q._d for q in adif.qso_list_from_file('iu4pra_sample_log.adi', select=expression,
+                                                        fields=['CALL'])]
+        qso_list = adif.qso_list_from_file('iu4pra_sample_log.adi', select=expression, fields=['CALL'],
+                                           lazy=True)
+        self.assertGreater(len(qso_list), 0)
+        self.assertEqual([dict(q._d) for q in qso_list], expected)
+        for data in [b"<CALL:3>K1A <EOR> <CALL:3>K2B", b"<CALL:3>K1A <CALL:3>K2B <EOR>", b"<CALL:5>K1A <EOR>"]:
+            with self.assertRaises(adif.AdifError):
+                list(adif.iter_lazy_records(data))
+
+    def test_inspect(self):
+        summary = adif.inspect_adif_file('iu4pra_sample_log.adi')
+        self.assertEqual(summary.records, 200)
+        self.assertEqual(summary.declared_records, 200)
+        self.assertEqual((summary.adif_ver, summary.programid), ('3.1.1', 'QRZLogbook'))
+        dates = sorted(q._d['QSO_DATE'] for q in adif.qso_list_from_file('iu4pra_sample_log.adi'))
+        self.assertEqual((summary.first_date, summary.last_date), (dates[0], dates[-1]))
+        self.assertEqual(summary.size, os.path.getsize('iu4pra_sample_log.adi'))
+
+    def test_inspect_blocks(self):
+        # Records split across scan blocks are counted once
+        data = ("Header\nRecords: 3\n<PROGRAMID:4>Test <EOH>\n"
+                "<QSO_DATE:8>20240301 <CALL:4>W1AW <EOR>\n"
+                "<qso_date:8:d>20240101 <call:4>K1AB <eor>\n"
+                "<QSO_DATE:8>20240201 <CALL:4>K2AB <EOR>\n").encode('utf-8')
+        for block in [7, 16, 1 << 20]:
+            with self.subTest(block=block):
+                adif._INSPECT_BLOCK = block
+                try:
+                    summary = adif.inspect_adif_bytes(data)
+                finally:
+                    adif._INSPECT_BLOCK = 1 << 26
+                self.assertEqual(summary, adif.LogSummary(None, len(data), 3, 3, None, 'Test',
+                                                          '20240101', '20240301'))
+
+    def test_last_record_end(self):
+        import tempfile
+        data = b"<CALL:4>W1AW <eOr>\n<CALL:4>K1AB <EOR>\n<CALL:4>K2"
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'log.adi')
+            for content, expected in [(data, data.rindex(b'<EOR>') + 5), (data[:12], 0), (b'', 0)]:
+                with open(filename, 'wb') as f:
+                    f.write(content)
+                # Tags across blocks included
+                for block in [5, 7, 16, 1 << 20]:
+                    with self.subTest(content=content, block=block):
+                        self.assertEqual(adif.last_record_end(filename, block), expected)
+
+    def test_validate_sample_logs(self):
+        # The sample logs are valid, non-ASCII values included
+        for filename in ['sample_log.adi', 'iu4pra_sample_log.adi', 'test_log.adi']:
+            self.assertEqual(adif.validate_adif_file(filename), [])
+
+    def test_validate_report(self):
+        data = ("Header <EOH>"
+                "<CALL:4>W1AW <QSO_DATE:8>20230501 <TIME_ON:4>1200 <BAND:3>20m <MODE:2>CW <EOR>"
+                "<NAME:5>Jo\u00ebl! <CALL:4>W1AW <CALL:4>W1AW <QSO_DATE:8>20230501 <TIME_ON:0> <MODE:2>CW <EOR>"
+                "<CALL:5>K1")
+        issues = adif.validate_adif_bytes(data.encode('utf-8'))
+        messages = [(i.record, i.message) for i in issues]
+        self.assertEqual(messages, [
+            (2, 'Duplicate field CALL'),
+            (2, 'Invalid length (0) for field TIME_ON, must be positive'),
+            (2, 'Essential field TIME_ON not found'),
+            (2, 'Essential field FREQ/BAND not found'),
+            (3, 'Field CALL value too short, expected 5 characters'),
+            (3, 'End of file found before EOR'),
+        ])
+        # Offsets are in bytes
+        self.assertEqual(issues[0].offset, data.encode(
+            'utf-8').index(b'<CALL:4>W1AW <QSO_DATE', 20))
+
+    def test_validate_header(self):
+        record = "<CALL:4>W1AW <QSO_DATE:8>20230501 <TIME_ON:4>1200 <BAND:3>20m <MODE:2>CW "
+        # Problems in the header are record 0, an EOH tag in a value is no header
+        data = f"<PROGRAMID:0> <EOH>{record}<EOR>{record}<COMMENT:5><eoh><EOR><MODE:0>"
+        self.assertEqual([(i.record, i.message) for i in adif.validate_adif_bytes(data.encode())], [
+            (0, 'Invalid length (0) for field PROGRAMID, must be positive'),
+            (3, 'Invalid length (0) for field MODE, must be positive'),
+        ])
+        data = f"{record}<COMMENT:5><eoh><EOR><MODE:0>"
+        self.assertEqual([i.record for i in adif.validate_adif_bytes(data.encode())], [2])
+
+
+class TestMerge(unittest.TestCase):
+
+    LOG_A = ("<CALL:4>W1AW <QSO_DATE:8>20230501 <TIME_ON:6>120000 <BAND:3>20m "
+             "<MODE:3>SSB <QSL_RCVD:1>N <EOR>"
+             "<CALL:5>N1ABC <QSO_DATE:8>20230502 <TIME_ON:4>2358 <BAND:3>40m "
+             "<MODE:2>CW <EOR>")
+    LOG_B = ("<CALL:4>w1aw <QSO_DATE:8>20230501 <TIME_ON:4>1203 <FREQ:6>14.200 "
+             "<MODE:3>USB <QSL_RCVD:1>Y <NAME:5>Hiram <EOR>"
+             "<CALL:5>N1ABC <QSO_DATE:8>20230503 <TIME_ON:4>0001 <BAND:3>40m "
+             "<MODE:2>CW <EOR>"
+             "<CALL:5>N1ABC <QSO_DATE:8>20230503 <TIME_ON:4>0001 <BAND:3>80m "
+             "<MODE:2>CW <EOR>")
+
+    def test_merge_duplicates(self):
+        qso_list = adif.merge_qso_lists(adif.iter_qso_string(self.LOG_A),
+                                        adif.iter_qso_string(self.LOG_B))
+        self.assertEqual(len(qso_list), 3)
+        # Fields are merged according to the rules
+        self.assertEqual(qso_list[0]._d['CALL'], 'W1AW')
+        self.assertEqual(qso_list[0]._d['QSL_RCVD'], 'Y')
+        self.assertEqual(qso_list[0]._d['NAME'], 'Hiram')
+        self.assertEqual(qso_list[0]._d['FREQ'], '14.200')
+        # Duplicates across midnight are found
+        self.assertEqual(qso_list[1]._d['TIME_ON'], '2358')
+        self.assertEqual(qso_list[2]._d['BAND'], '80m')
+
+    def test_merge_window(self):
+        qso_list = adif.merge_qso_lists(adif.iter_qso_string(self.LOG_A),
+                                        adif.iter_qso_string(self.LOG_B), window=2)
+        self.assertEqual(len(qso_list), 5)
+
+    def test_merge_custom_rule(self):
+        merger = adif.QsoMerger(rules={'QSL_RCVD': 'first', 'TIME_ON': 'last'})
+        merger.update(adif.iter_qso_string(self.LOG_A))
+        merger.update(adif.iter_qso_string(self.LOG_B))
+        self.assertEqual(merger.duplicates, 2)
+        qso_list = merger.qso_list()
+        self.assertEqual(qso_list[0]._d['QSL_RCVD'], 'N')
+        self.assertEqual(qso_list[0]._d['TIME_ON'], '1203')
+
 
 if __name__ == '__main__':
     unittest.main()
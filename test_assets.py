@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Unit test for the template asset pipeline
+
+import base64
+import io
+import os
+import tempfile
+import time
+import unittest
+import qsl_generator
+from assets import AssetPipeline
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class TestAssetPipeline(unittest.TestCase):
+
+    TEMPLATE = ("<html><head><link rel=\"stylesheet\" href=\"css/style.css\"></head>"
+                "<body style=\"background: url('bg.jpg')\"><img src=\"logo.png\">"
+                "<img src=\"https://example.com/logo.png\"><img src=\"{{ qso.photo }}\">"
+                "<img src=\"missing.png\"><a href=\"page.html\">{{ qso.call }}</a></body></html>")
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp.name, 'templates')
+        self.cache = os.path.join(self.tmp.name, 'cache')
+        os.makedirs(os.path.join(self.folder, 'css'))
+        os.makedirs(os.path.join(self.folder, 'fonts'))
+        self.write('card.html', self.TEMPLATE.encode('utf-8'))
+        self.write('page.html', b'<html></html>')
+        self.write('logo.png', b'\x89PNG small logo')
+        self.write('bg.jpg', b'\xff\xd8' + b'\0' * 100000)
+        self.write('css/style.css', b"@font-face { src: url(\"../fonts/call.woff2\"); }")
+        self.write('fonts/call.woff2', b'wOF2 font')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name: str, data: bytes):
+        with open(os.path.join(self.folder, name), 'wb') as f:
+            f.write(data)
+
+    def test_private_cache(self):
+        pipeline = AssetPipeline(self.folder, inline_limit=0, cache_folder=self.cache)
+        url = pipeline.asset_url(os.path.join(self.folder, 'logo.png'))
+        cached = os.path.join(self.cache, os.listdir(self.cache)[0])
+        if hasattr(os, 'getuid'):
+            self.assertEqual(os.stat(self.cache).st_mode & 0o777, 0o700)
+        # A file planted under the expected name is replaced
+        with open(cached, 'wb') as f:
+            f.write(b'<script>planted</script>')
+        os.chmod(self.cache, 0o777)
+        self.assertEqual(AssetPipeline(self.folder, inline_limit=0, cache_folder=self.cache).asset_url(
+            os.path.join(self.folder, 'logo.png')), url)
+        with open(cached, 'rb') as f:
+            self.assertEqual(f.read(), b'\x89PNG small logo')
+        if hasattr(os, 'getuid'):
+            self.assertEqual(os.stat(self.cache).st_mode & 0o777, 0o700)
+
+    def test_rewrite(self):
+        pipeline = AssetPipeline(self.folder, cache_folder=self.cache)
+        with open(os.path.join(self.folder, 'card.html'), 'rt') as f:
+            html = pipeline.rewrite_html(f.read())
+        # Small assets are inlined
+        self.assertIn('src="data:image/png;base64,' +
+                      base64.b64encode(b'\x89PNG small logo').decode('ascii') + '"', html)
+        # The stylesheet is inlined with its font
+        css = html.split('href="data:text/css;base64,')[1].split('"')[0]
+        self.assertIn('url("data:font/woff2;base64,',
+                      base64.b64decode(css).decode('utf-8'))
+        # Large assets are referenced from the cache
+        self.assertEqual(len(os.listdir(self.cache)), 1)
+        cached = os.path.join(self.cache, os.listdir(self.cache)[0])
+        self.assertIn("url('file://" + os.path.abspath(cached) + "')", html)
+        # Other references are left untouched
+        for reference in ['https://example.com/logo.png', '{{ qso.photo }}', 'missing.png', 'page.html']:
+            self.assertIn(f'"{reference}"', html)
+
+    def test_template_reload(self):
+        env = qsl_generator.template_environment(self.folder)
+        render = env.get_template('card.html').render(qso={'call': 'W1AW'})
+        self.assertIn('W1AW', render)
+        self.assertIs(env.get_template('card.html'), env.get_template('card.html'))
+        # Changing an asset compiles the template again
+        time.sleep(0.01)
+        self.write('logo.png', b'\x89PNG new logo')
+        self.assertIn(base64.b64encode(b'\x89PNG new logo').decode('ascii'),
+                      env.get_template('card.html').render(qso={}))
+
+    @unittest.skipIf(Image is None, 'Pillow not installed')
+    def test_downscale(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 2000), 'blue').save(buffer, format='JPEG')
+        self.write('bg.jpg', buffer.getvalue())
+        max_size = (qsl_generator.cm_to_px(qsl_generator.QSL_WIDTH, 150),
+                    qsl_generator.cm_to_px(qsl_generator.QSL_HEIGHT, 150))
+        pipeline = AssetPipeline(self.folder, max_size,
+                                 inline_limit=0, cache_folder=self.cache)
+        url = pipeline.asset_url(os.path.join(self.folder, 'bg.jpg'))
+        with Image.open(url[len('file://'):]) as image:
+            # Smallest size still covering the card at 150 DPI
+            self.assertEqual(image.size, (max_size[1] * 2, max_size[1]))
+            self.assertGreaterEqual(image.size[0], max_size[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,726 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Unit test for the QSL generator
+
+import glob
+import io
+import json
+import os
+import pypdf
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+import zipfile
+import adif
+import assets
+import logdb
+import qsl_generator
+import qsl_server
+import shards
+import subprocess
+import time
+import watcher
+from ledger import QslLedger
+from qso import QSO
+
+# QSL generator script, run as a separate process by the shard tests
+_GENERATOR = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'qsl_generator.py')
+
+# Stub of wkhtmltopdf/wkhtmltoimage: the output stores the rendered HTML,
+# as a page attribute for PDFs and as file content for images.
+# Every call is logged in renders.log (output) and options.log (options),
+# rendering fails if the HTML contains a line of fail.txt
+_STUB_RENDERER = f"""#!{sys.executable}
+import json, os, sys
+with open(sys.argv[-2], 'rt', encoding='utf-8') as f:
+    html = f.read()
+with open('renders.log', 'at') as f:
+    f.write(sys.argv[-1] + '\\n')
+with open('options.log', 'at') as f:
+    f.write(json.dumps(sys.argv[1:-2]) + '\\n')
+if os.path.isfile('fail.txt'):
+    with open('fail.txt', 'rt') as f:
+        if any(line and line in html for line in f.read().split('\\n')):
+            sys.exit(1)
+if sys.argv[0].endswith('wkhtmltopdf'):
+    import pypdf
+    from pypdf.generic import NameObject, TextStringObject
+    writer = pypdf.PdfWriter()
+    page = writer.add_blank_page(width=397, height=255)
+    page[NameObject('/QslHtml')] = TextStringObject(html)
+    writer.write(sys.argv[-1])
+else:
+    with open(sys.argv[-1], 'wt', encoding='utf-8') as f:
+        f.write(html)
+"""
+
+
+class StubRendererTestCase(unittest.TestCase):
+    """Runs each test in a temporary working folder with stub renderers"""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        shutil.copytree(os.path.join(self._cwd, 'templates'),
+                        os.path.join(self.tmp.name, 'templates'))
+        for name in ['wkhtmltopdf', 'wkhtmltoimage']:
+            path = os.path.join(self.tmp.name, name)
+            with open(path, 'wt') as f:
+                f.write(_STUB_RENDERER)
+            os.chmod(path, 0o755)
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self.tmp.cleanup()
+
+    @staticmethod
+    def qso_list(count: int, prefix: str = 'K'):
+        """List of count valid QSOs"""
+        return [QSO({'CALL': f'{prefix}{i}AA', 'QSO_DATE': '20240101', 'TIME_ON': '%04d' % i,
+                     'BAND': '20m', 'MODE': 'SSB'}) for i in range(count)]
+
+    @staticmethod
+    def pdf_calls(path: str):
+        """Calls of the QSL pages contained in a PDF"""
+        reader = pypdf.PdfReader(path)
+        return [page['/QslHtml'].split('<span class="field">')[1].split('<')[0]
+                for page in reader.pages]
+
+
+class TestTemplateFields(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        templates = {
+            'base.html': "{% block body %}{% endblock %}{{ qso['my_name'] }}",
+            'card.html': "{% extends 'base.html' %}{% block body %}{{ qso.call }}{% include 'footer.html' %}{% endblock %}",
+            'footer.html': "{% if qso.band %}{{ qso.band }}{% endif %}",
+            'loop.html': "{% for k, v in qso.items() %}{{ k }}{% endfor %}",
+            'bare.html': "{{ qso }}",
+            'dynamic.html': "{% set f = 'call' %}{{ qso[f] }}",
+        }
+        for name, source in templates.items():
+            with open(os.path.join(self.tmp.name, name), 'wt') as f:
+                f.write(source)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_default_template(self):
+        self.assertEqual(qsl_generator.template_fields(), {
+                         'CALL', 'QSO_DATE', 'TIME_ON', 'BAND', 'FREQ', 'MODE', 'RST_SENT'})
+
+    def test_referenced_templates(self):
+        self.assertEqual(qsl_generator.template_fields('card.html', self.tmp.name),
+                         {'CALL', 'BAND', 'MY_NAME'})
+
+    def test_unknown_fields(self):
+        for name in ['loop.html', 'bare.html', 'dynamic.html']:
+            self.assertIsNone(
+                qsl_generator.template_fields(name, self.tmp.name))
+
+    def test_projection(self):
+        fields = qsl_generator.template_fields()
+        qso_list = adif.qso_list_from_file(
+            'iu4pra_sample_log.adi', fields=fields)
+        self.assertEqual(len(qso_list), 200)
+        for q in qso_list:
+            self.assertLessEqual(set(q._d), fields)
+        self.assertEqual(qsl_generator.qso_context(QSO({'CALL': 'W1AW', 'NAME': 'Hiram'}), {'CALL', 'BAND'}),
+                         {'call': 'W1AW'})
+
+
+class TestPdfOutput(StubRendererTestCase):
+
+    def test_single_pdf(self):
+        qso_list = self.qso_list(3)
+        self.assertEqual(qsl_generator.generate_qsl_pdf(qso_list), ['./out/./out.pdf'])
+        self.assertEqual(self.pdf_calls('out/out.pdf'), ['K0AA', 'K1AA', 'K2AA'])
+        self.assertFalse(os.path.exists(qsl_generator.TEMP_FOLDER))
+
+    def test_local_file_access(self):
+        qsl_generator.generate_qsl_pdf(self.qso_list(1))
+        qsl_generator.generate_qsl_image(self.qso_list(1))
+        with open('options.log', 'rt') as f:
+            calls = [json.loads(line) for line in f.read().splitlines()]
+        # Only the templates and the asset cache can be read
+        allowed = [os.path.abspath('templates'), os.path.abspath(assets.ASSET_CACHE_FOLDER)]
+        self.assertEqual(len(calls), 2)
+        for options in calls:
+            self.assertNotIn('--enable-local-file-access', options)
+            self.assertEqual([options[i + 1] for i, o in enumerate(options) if o == '--allow'],
+                             allowed)
+
+    def test_progress(self):
+        calls = []
+        qsl_generator.generate_qsl_pdf(self.qso_list(3), progress=lambda *a: calls.append(a))
+        self.assertEqual(calls, [(0, 3), (1, 3), (2, 3), (3, 3)])
+        # The record count of the log is reported with the progress
+        with open('log.adi', 'wt') as f:
+            f.write("<CALL:4>K0AA <QSO_DATE:8>20240101 <TIME_ON:4>1200 <BAND:3>20m <MODE:3>SSB <EOR>\n"
+                    "<CALL:4>K1AA <QSO_DATE:8>20240101 <TIME_ON:4>1200 <BAND:3>40m <MODE:3>SSB <EOR>\n")
+        with self.assertLogs(level='INFO') as cm:
+            qsl_generator.main(['log.adi', '--select', 'band == 20m', '--no-ledger'])
+        self.assertIn('Progress: 1/1 QSL(s) selected from 2 log record(s), 100%',
+                      '\n'.join(cm.output))
+
+    def test_skip_invalid(self):
+        with open('log.adi', 'wt') as f:
+            f.write("<CALL:4>K0AA <QSO_DATE:8>20240101 <TIME_ON:4>1200 <BAND:3>20m <MODE:3>SSB <EOR>\n"
+                    "<CALL:4>K1AA <QSO_DATE:8>20240101 <BAND:3>20m <MODE:3>SSB <EOR>\n"
+                    "<CALL:4>K2AA <QSO_DATE:8>20241301 <TIME_ON:4>1200 <BAND:3>20m <MODE:3>SSB <EOR>\n"
+                    "<CALL:4>K3AA <QSO_DATE:8>20240101 <TIME_ON:4>1200 <FREQ:4>14.2 <MODE:3>SSB <EOR>\n")
+        qsl_generator.main(['log.adi', '--skip-invalid', '--no-ledger'])
+        self.assertEqual(self.pdf_calls('out/out.pdf'), ['K0AA', 'K3AA'])
+
+    def test_chunks(self):
+        qso_list = self.qso_list(5)
+        files = qsl_generator.generate_qsl_pdf(qso_list, chunk_size=2)
+        self.assertEqual([os.path.basename(f) for f in files],
+                         ['out_0001.pdf', 'out_0002.pdf', 'out_0003.pdf'])
+        self.assertEqual([self.pdf_calls(f) for f in files],
+                         [['K0AA', 'K1AA'], ['K2AA', 'K3AA'], ['K4AA']])
+        # Every page is a chunk of its own
+        files = qsl_generator.generate_qsl_pdf(qso_list, chunk_mb=1e-6)
+        self.assertEqual(len(files), 5)
+
+    def test_chunks_concatenation(self):
+        files = qsl_generator.generate_qsl_pdf(
+            self.qso_list(5), chunk_size=2, concatenate=True)
+        self.assertEqual(files, ['./out/./out.pdf'])
+        self.assertEqual(self.pdf_calls(files[0]), [
+                         'K0AA', 'K1AA', 'K2AA', 'K3AA', 'K4AA'])
+        self.assertEqual(sorted(os.listdir('out')), [
+                         'out.manifest.jsonl', 'out.pdf'])
+
+    def renders(self):
+        """Number of renderer calls since the last check"""
+        if not os.path.isfile('renders.log'):
+            return 0
+        with open('renders.log', 'rt') as f:
+            count = len(f.read().split())
+        os.unlink('renders.log')
+        return count
+
+    def test_resume(self):
+        qso_list = self.qso_list(5)
+        with open('fail.txt', 'wt') as f:
+            f.write('K3AA')
+        files = qsl_generator.generate_qsl_pdf(qso_list, chunk_size=2)
+        self.assertEqual(self.renders(), 5)
+        self.assertEqual([self.pdf_calls(f) for f in files],
+                         [['K0AA', 'K1AA'], ['K2AA', 'K4AA']])
+        os.unlink('fail.txt')
+        # Only the failed card is rendered again, in a new chunk
+        files = qsl_generator.generate_qsl_pdf(
+            qso_list, chunk_size=2, resume=True)
+        self.assertEqual(self.renders(), 1)
+        self.assertEqual([self.pdf_calls(f) for f in files],
+                         [['K0AA', 'K1AA'], ['K2AA', 'K4AA'], ['K3AA']])
+        # Nothing left to do
+        qsl_generator.generate_qsl_pdf(qso_list, chunk_size=2, resume=True)
+        self.assertEqual(self.renders(), 0)
+        # A different job would overwrite the chunks of this one
+        with self.assertRaises(ValueError):
+            qsl_generator.generate_qsl_pdf(qso_list[:4], chunk_size=2, resume=True)
+        self.assertEqual(self.pdf_calls(files[0]), ['K0AA', 'K1AA'])
+        qsl_generator.generate_qsl_pdf(qso_list[:4], chunk_size=2)
+        self.assertEqual(self.renders(), 4)
+
+    def test_resume_single_pdf(self):
+        qso_list = self.qso_list(4)
+        with open('fail.txt', 'wt') as f:
+            f.write('K1AA\nK2AA')
+        qsl_generator.generate_qsl_pdf(qso_list)
+        self.assertEqual(self.pdf_calls('out/out.pdf'), ['K0AA', 'K3AA'])
+        os.unlink('fail.txt')
+        qsl_generator.generate_qsl_pdf(qso_list, resume=True)
+        self.assertEqual(self.renders(), 6)
+        self.assertEqual(self.pdf_calls('out/out.pdf'), [
+                         'K0AA', 'K1AA', 'K2AA', 'K3AA'])
+        self.assertFalse(os.path.exists(qsl_generator.TEMP_FOLDER))
+
+    def test_resume_completed(self):
+        qso_list = self.qso_list(3)
+        qsl_generator.generate_qsl_pdf(qso_list)
+        qsl_generator.generate_qsl_pdf(qso_list, resume=True)
+        self.assertEqual(self.renders(), 3)
+        self.assertEqual(self.pdf_calls('out/out.pdf'), ['K0AA', 'K1AA', 'K2AA'])
+        # Concatenated chunks are deleted, nothing is done again
+        files = qsl_generator.generate_qsl_pdf(
+            qso_list, chunk_size=2, concatenate=True)
+        files = qsl_generator.generate_qsl_pdf(
+            qso_list, chunk_size=2, concatenate=True, resume=True)
+        self.assertEqual(self.renders(), 3)
+        self.assertEqual(self.pdf_calls(files[0]), ['K0AA', 'K1AA', 'K2AA'])
+
+    def test_resume_concatenation(self):
+        qso_list = self.qso_list(4)
+        with open('fail.txt', 'wt') as f:
+            f.write('K1AA')
+        files = qsl_generator.generate_qsl_pdf(
+            qso_list, chunk_size=2, concatenate=True)
+        self.assertEqual(self.pdf_calls(files[0]), ['K0AA', 'K2AA', 'K3AA'])
+        os.unlink('fail.txt')
+        # The card rendered again goes back to its place in the log
+        files = qsl_generator.generate_qsl_pdf(
+            qso_list, chunk_size=2, concatenate=True, resume=True)
+        self.assertEqual(self.pdf_calls(files[0]), [
+                         'K0AA', 'K1AA', 'K2AA', 'K3AA'])
+        self.assertEqual(sorted(os.listdir('out')), [
+                         'out.manifest.jsonl', 'out.pdf'])
+
+    def test_resume_images(self):
+        qso_list = self.qso_list(3)
+        with open('fail.txt', 'wt') as f:
+            f.write('K1AA')
+        files = qsl_generator.generate_qsl_image(qso_list)
+        self.assertEqual([os.path.basename(f) for f in files],
+                         ['qsl_0000.jpg', 'qsl_0002.jpg'])
+        os.unlink('fail.txt')
+        self.renders()
+        files = qsl_generator.generate_qsl_image(qso_list, resume=True)
+        self.assertEqual(self.renders(), 1)
+        self.assertEqual(len(files), 3)
+
+
+class TestLedger(StubRendererTestCase):
+
+    def test_ledger(self):
+        qso_list = self.qso_list(3)
+        with QslLedger('ledger.sqlite') as ledger:
+            self.assertEqual(ledger.filter_new(qso_list), qso_list)
+            ledger.record(qso_list[:2], 'abc', 'out.pdf')
+            self.assertTrue(ledger.is_printed(qso_list[0]))
+            self.assertFalse(ledger.is_printed(qso_list[0], 'def'))
+            # Identity doesn't depend on non-key fields
+            q = QSO({**qso_list[1]._d, 'NAME': 'Hiram'})
+            self.assertEqual(ledger.filter_new([q, qso_list[2]]), [qso_list[2]])
+
+    def test_only_new(self):
+        with QslLedger('ledger.sqlite') as ledger:
+            qsl_generator.generate_qsl_image(
+                self.qso_list(2), ledger=ledger)
+            self.assertTrue(os.path.isfile('out/qsl_0001.jpg'))
+            new_list = ledger.filter_new(self.qso_list(3))
+            self.assertEqual([q._d['CALL'] for q in new_list], ['K2AA'])
+            qsl_generator.generate_qsl_pdf(new_list, ledger=ledger)
+            self.assertEqual(self.pdf_calls('out/out.pdf'), ['K2AA'])
+            self.assertEqual(ledger.filter_new(self.qso_list(3)), [])
+
+    def test_only_new_command(self):
+        with open('log.adi', 'wt') as f:
+            f.write("<CALL:4>K0AA <QSO_DATE:8>20240101 <TIME_ON:4>1200 <BAND:3>20m <MODE:3>SSB <EOR>\n")
+        qsl_generator.main(['log.adi', '--only-new', '--ledger', 'ledger.sqlite'])
+        # Nothing new, no output
+        qsl_generator.main(['log.adi', '--only-new', '--ledger', 'ledger.sqlite'])
+        with open('log.adi', 'at') as f:
+            f.write("<CALL:4>K1AA <QSO_DATE:8>20240108 <TIME_ON:4>1200 <BAND:3>20m <MODE:3>SSB <EOR>\n")
+        qsl_generator.main(['log.adi', '--only-new', '--ledger', 'ledger.sqlite'])
+        # Every run in its own folder, as recorded in the ledger
+        batches = sorted(glob.glob('out/*/out.pdf'), key=os.path.dirname)
+        self.assertEqual([self.pdf_calls(f) for f in batches], [['K0AA'], ['K1AA']])
+        with QslLedger('ledger.sqlite') as ledger:
+            outputs = [row[0] for row in ledger._db.execute(
+                "SELECT output FROM printed ORDER BY identity")]
+        self.assertEqual([os.path.dirname(os.path.normpath(o)) for o in outputs],
+                         [os.path.dirname(os.path.normpath(f)) for f in batches])
+
+    def test_only_new_resume(self):
+        with open('log.adi', 'wt') as f:
+            f.write(''.join("<CALL:4>K%dAA <QSO_DATE:8>20240101 <TIME_ON:4>1200 <BAND:3>20m <MODE:3>SSB <EOR>\n" % i
+                            for i in range(4)))
+        with open('fail.txt', 'wt') as f:
+            f.write('K3AA')
+        command = ['log.adi', '--only-new', '--ledger', 'ledger.sqlite', '--chunk-size', '2']
+        qsl_generator.main(command)
+        os.unlink('fail.txt')
+        # Same job in the same folder, the chunks written are kept
+        qsl_generator.main(command + ['--resume'])
+        batches = glob.glob('out/*/')
+        self.assertEqual(len(batches), 1)
+        self.assertEqual([self.pdf_calls(os.path.join(batches[0], f'out_000{i}.pdf')) for i in [1, 2, 3]],
+                         [['K0AA', 'K1AA'], ['K2AA'], ['K3AA']])
+        # The job is complete, nothing new to print
+        qsl_generator.main(command + ['--resume'])
+        self.assertEqual(len(glob.glob('out/*/')), 1)
+        with QslLedger('ledger.sqlite') as ledger:
+            self.assertEqual(ledger.filter_new(adif.qso_list_from_file('log.adi')), [])
+
+
+class TestLogDatabase(StubRendererTestCase):
+
+    def test_export_and_query(self):
+        log = os.path.join(self._cwd, 'iu4pra_sample_log.adi')
+        self.assertEqual(logdb.export_adif_to_sqlite(log, 'log.sqlite'), 200)
+        with logdb.QsoDatabase('log.sqlite') as db:
+            qso_list = db.query("SELECT * FROM qso WHERE band = ? AND qsl_rcvd = 'N' ORDER BY QSO_ID",
+                                ('10m',))
+            self.assertGreater(len(qso_list), 0)
+            expected = sorted([q for q in adif.qso_list_from_file(log)
+                               if q._d['BAND'] == '10m' and q._d.get('QSL_RCVD') == 'N'],
+                              key=lambda q: q.identity)
+            self.assertEqual([q._d for q in qso_list],
+                             [q._d for q in expected])
+            indexes = [row[1] for row in db._db.execute(
+                "PRAGMA index_list(qso)")]
+            self.assertIn('qso_DXCC', indexes)
+
+    def test_upsert(self):
+        with logdb.QsoDatabase('log.sqlite') as db:
+            db.upsert([QSO({'CALL': 'W1AW', 'QSO_DATE': '20240101', 'TIME_ON': '1200',
+                            'BAND': '20m', 'MODE': 'CW', 'QSL_RCVD': 'N'})], batch_size=1)
+            db.upsert([QSO({'CALL': 'W1AW', 'QSO_DATE': '20240101', 'TIME_ON': '1200',
+                            'BAND': '20m', 'MODE': 'CW', 'NAME': 'Hiram'})])
+            qso_list = db.query()
+            self.assertEqual(len(qso_list), 1)
+            self.assertEqual(qso_list[0]._d['QSL_RCVD'], 'N')
+            self.assertEqual(qso_list[0]._d['NAME'], 'Hiram')
+
+
+class TestRenderService(StubRendererTestCase):
+
+    def setUp(self):
+        super().setUp()
+        shutil.copy(os.path.join(self._cwd, 'sample_log.adi'), '.')
+        self.service = qsl_server.RenderService(workers=2, max_queue=2)
+        self.server = qsl_server.make_server(port=0, service=self.service)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+        super().tearDown()
+
+    def post(self, query: str, data: bytes = b''):
+        request = urllib.request.Request(
+            f"{self.url}/render?{query}", data=data, method='POST')
+        with urllib.request.urlopen(request) as response:
+            return response.headers['Content-Type'], response.read()
+
+    def test_render_upload(self):
+        with open('sample_log.adi', 'rb') as f:
+            data = f.read()
+        content_type, content = self.post(
+            'select=band+%3D%3D+20m', data)
+        self.assertEqual(content_type, 'application/pdf')
+        with open('result.pdf', 'wb') as f:
+            f.write(content)
+        self.assertEqual(self.pdf_calls('result.pdf'), ['IK4XYZ', 'IW5MNO'])
+        # Parsed log is cached
+        self.post('select=band+%3D%3D+20m', data)
+        with urllib.request.urlopen(f"{self.url}/health") as response:
+            status = json.loads(response.read())
+        self.assertEqual(status['cache_hits'], 1)
+        self.assertEqual(status['renders'], 2)
+
+    def test_render_path_images(self):
+        content_type, content = self.post(
+            'path=sample_log.adi&format=image&template=template.html')
+        self.assertEqual(content_type, 'application/zip')
+        with zipfile.ZipFile(io.BytesIO(content)) as z:
+            self.assertEqual(len(z.namelist()), 10)
+
+    def test_concurrent_requests(self):
+        with open('sample_log.adi', 'rb') as f:
+            data = f.read()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.post('', data)))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 4)
+        for _, content in results:
+            with open('result.pdf', 'wb') as f:
+                f.write(content)
+            self.assertEqual(len(self.pdf_calls('result.pdf')), 10)
+
+    def test_errors(self):
+        for query, data, code in [('template=missing.html', b'', 404),
+                                  ('path=../etc/passwd', b'', 404),
+                                  ('format=gif', b'', 400),
+                                  ('', b'<CALL:10>K1', 400),
+                                  ('select=band+%3D%3D', b'', 400)]:
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                self.post(query, data)
+            self.assertEqual(cm.exception.code, code)
+            cm.exception.close()
+
+    def test_failed_cards(self):
+        with open('sample_log.adi', 'rb') as f:
+            data = f.read()
+        with open('fail.txt', 'wt') as f:
+            f.write('IK4XYZ')
+        request = urllib.request.Request(f"{self.url}/render?select=band+%3D%3D+20m",
+                                         data=data, method='POST')
+        with urllib.request.urlopen(request) as response:
+            self.assertEqual(response.headers['X-Failed-Cards'], '1')
+            with open('result.pdf', 'wb') as f:
+                f.write(response.read())
+        self.assertEqual(self.pdf_calls('result.pdf'), ['IW5MNO'])
+        # Nothing rendered
+        with open('fail.txt', 'wt') as f:
+            f.write('<html')
+        for _format in ['pdf', 'image']:
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                self.post(f'format={_format}', data)
+            self.assertEqual(cm.exception.code, 500)
+            cm.exception.close()
+
+    def test_limits(self):
+        self.service.max_upload = 100
+        for query, data, code in [('', b'<CALL:4>K1AA <EOR>' * 10, 413),
+                                  ('select=band+%3D%3D+2m', b'<CALL:4>K1AA <EOR>', 404)]:
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                self.post(query, data)
+            self.assertEqual(cm.exception.code, code)
+            cm.exception.close()
+
+    def test_busy(self):
+        # All the slots taken
+        for _ in range(4):
+            self.service._slots.acquire()
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post('', b'')
+        self.assertEqual(cm.exception.code, 503)
+        cm.exception.close()
+        for _ in range(4):
+            self.service._slots.release()
+
+
+class TestWatcher(StubRendererTestCase):
+
+    RECORD = "<CALL:5>K%dABC <QSO_DATE:8>20240101 <TIME_ON:4>12%02d <BAND:3>20m <MODE:2>CW <EOR>\n"
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs('logs')
+        self.log = os.path.join('logs', 'live.adi')
+        with open(self.log, 'wt') as f:
+            f.write("Live log <EOH>\n" + self.RECORD % (0, 0))
+
+    def append(self, text: str):
+        with open(self.log, 'at') as f:
+            f.write(text)
+
+    def check_appended(self, w: watcher.LogWatcher):
+        self.assertEqual(w.new_qsos(), [])
+        record = self.RECORD % (1, 1)
+        self.append(record[:20])
+        self.assertTrue(w.wait(5, debounce=0.1))
+        # Incomplete record
+        self.assertEqual(w.new_qsos(), [])
+        self.append(record[20:] + self.RECORD % (2, 2))
+        self.assertTrue(w.wait(5, debounce=0.1))
+        self.assertEqual([q._d['CALL']
+                         for q in w.new_qsos()], ['K1ABC', 'K2ABC'])
+        self.assertFalse(w.wait(0.1))
+
+    def test_polling(self):
+        w = watcher.LogWatcher(self.log, use_inotify=False, interval=0.05)
+        self.check_appended(w)
+        w.close()
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is only available on Linux')
+    def test_inotify(self):
+        w = watcher.LogWatcher('logs', use_inotify=True)
+        self.check_appended(w)
+        w.close()
+
+    def test_from_start(self):
+        w = watcher.LogWatcher('logs', from_start=True,
+                               use_inotify=False, select='call == K0ABC')
+        self.assertEqual(len(w.new_qsos()), 1)
+        self.append(self.RECORD % (1, 1))
+        self.assertEqual(w.new_qsos(), [])
+
+    def test_invalid_record(self):
+        w = watcher.LogWatcher(self.log, use_inotify=False)
+        self.append(self.RECORD % (1, 1) + "<CALL:4>K1AA<CALL:4>K1AA<EOR>\n" + self.RECORD % (2, 2))
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual([q._d['CALL'] for q in w.new_qsos()], ['K1ABC', 'K2ABC'])
+        self.assertIn('invalid record at byte', cm.output[0])
+        # The watch goes on after the bad record
+        self.append(self.RECORD % (3, 3))
+        self.assertEqual([q._d['CALL'] for q in w.new_qsos()], ['K3ABC'])
+        w.close()
+
+    def test_watch(self):
+        w = watcher.LogWatcher(self.log, use_inotify=False, interval=0.05)
+        stop = threading.Event()
+        thread = threading.Thread(target=watcher.watch, args=(w, 'batches', stop),
+                                  kwargs={'debounce': 0.1})
+        thread.start()
+        try:
+            self.append(self.RECORD % (1, 1))
+            for _ in range(100):
+                batches = glob.glob('batches/*/out.pdf')
+                if batches:
+                    break
+                time.sleep(0.1)
+        finally:
+            stop.set()
+            thread.join()
+            w.close()
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(self.pdf_calls(batches[0]), ['K1ABC'])
+
+
+
+class TestShards(StubRendererTestCase):
+
+    RECORD = "<CALL:4>K%dAA <QSO_DATE:8>20240101 <TIME_ON:4>%04d <BAND:3>20m <MODE:3>SSB <EOR>\n"
+    CARDS = 10
+
+    def setUp(self):
+        super().setUp()
+        with open('log.adi', 'wt') as f:
+            f.write("Log <EOH>\n" + ''.join(self.RECORD % (i, i)
+                    for i in range(self.CARDS)))
+
+    def run_nodes(self, count: int, *options):
+        """Renders count shards of log.adi in parallel processes, shard i in folder shard<i>"""
+        nodes = [subprocess.Popen([sys.executable, _GENERATOR, 'log.adi', '--shard', f'{i}/{count}',
+                                   '--output-dir', f'shard{i}', '--no-ledger', *options],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for i in range(1, count + 1)]
+        self.assertEqual([node.wait() for node in nodes], [0] * count)
+        return [f'shard{i}' for i in range(1, count + 1)]
+
+    def test_split(self):
+        qso_list = self.qso_list(50)
+        for method in ['hash', 'range']:
+            parts = [shards.split(qso_list, i, 4, method)
+                     for i in range(1, 5)]
+            indexes = sorted(i for _, shard in parts for i in shard.indexes)
+            self.assertEqual(indexes, list(range(50)))
+            for part, shard in parts:
+                self.assertEqual(part, [qso_list[i] for i in shard.indexes])
+        # Contiguous ranges
+        self.assertEqual(shards.split(qso_list, 2, 4, 'range')[1].indexes,
+                         list(range(12, 25)))
+        # Stable hash: the same on every run
+        self.assertEqual(shards.split(qso_list, 1, 4)[1].indexes,
+                         shards.split(list(qso_list), 1, 4)[1].indexes)
+        for value in ['1', '0/3', '4/3', 'a/b']:
+            with self.assertRaises(ValueError):
+                shards.parse_shard(value)
+
+    def test_merge_pdf(self):
+        folders = self.run_nodes(3, '--chunk-size', '2')
+        self.assertEqual(shards.merge_shards(folders, 'merged.pdf'), self.CARDS)
+        self.assertEqual(self.pdf_calls('merged.pdf'),
+                         [f'K{i}AA' for i in range(self.CARDS)])
+        with self.assertRaises(ValueError):
+            shards.merge_shards(folders + folders[:1], 'merged.pdf')
+        # Merge command, a missing shard leaves its cards out
+        qsl_generator.main(['merge', folders[0], folders[2], '--output', 'partial.pdf'])
+        calls = self.pdf_calls('partial.pdf')
+        self.assertLess(len(calls), self.CARDS)
+        self.assertEqual(calls, sorted(calls, key=lambda c: int(c[1:-2])))
+
+    def test_resume_concatenated(self):
+        qso_list = self.qso_list(8)
+        with open('fail.txt', 'wt') as f:
+            f.write('K1AA')
+        for i in [1, 2]:
+            shard_list, shard = shards.split(qso_list, i, 2, 'range')
+            qsl_generator.generate_qsl_pdf(shard_list, _out_folder=f'shard{i}', chunk_size=2, concatenate=True,
+                                           shard=shard, _temp_folder=f'tmp{i}')
+        os.unlink('fail.txt')
+        shard_list, shard = shards.split(qso_list, 1, 2, 'range')
+        qsl_generator.generate_qsl_pdf(shard_list, _out_folder='shard1', chunk_size=2, concatenate=True,
+                                       shard=shard, resume=True, _temp_folder='tmp1')
+        # The shard index matches the pages of the resumed shard
+        with open(os.path.join('shard1', shards.SHARD_INDEX), 'rt') as f:
+            index = json.load(f)
+        self.assertEqual(index['files'][0]['indexes'], [0, 1, 2, 3])
+        self.assertEqual(self.pdf_calls(os.path.join('shard1', qsl_generator.PDF_OUTPUT)),
+                         ['K0AA', 'K1AA', 'K2AA', 'K3AA'])
+        shards.merge_shards(['shard1', 'shard2'], 'merged.pdf')
+        self.assertEqual(self.pdf_calls('merged.pdf'),
+                         [f'K{i}AA' for i in range(8)])
+
+    def test_images(self):
+        folders = self.run_nodes(3, '--image', '--shard-by', 'range')
+        images = sorted(os.path.basename(f) for folder in folders
+                        for f in glob.glob(os.path.join(folder, '*.jpg')))
+        # Names refer to the position in the full log
+        self.assertEqual(images, [qsl_generator.IMG_OUT_BASE_NAME[2:] % i
+                                  for i in range(self.CARDS)])
+        with open(os.path.join('shard3', 'qsl_0009.jpg'), 'rt') as f:
+            self.assertIn('K9AA', f.read())
+
+
+class TestPreview(StubRendererTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.qsos = self.qso_list(10)
+        self.qsos[3] = QSO({'CALL': 'F4ÉLA', 'QSO_DATE': '20240101', 'TIME_ON': '0300',
+                            'BAND': '20m', 'MODE': 'SSB'})
+        self.qsos[5]._d['FREQ'] = '14.250'
+        del self.qsos[7]._d['BAND']
+        self.qsos[7]._d['FREQ'] = '7.1'
+        self.qsos[8]._d['CALL'] = 'VP2EXTRALONG'
+
+    def test_sample(self):
+        sample = qsl_generator.preview_sample(self.qsos, 4, {'CALL', 'BAND', 'FREQ'})
+        # Missing BAND, missing FREQ, non-ASCII, longest CALL
+        self.assertEqual([q._d['CALL'] for q in sample],
+                         ['K7AA', 'K0AA', 'F4ÉLA', 'VP2EXTRALONG'])
+        self.assertEqual(len(qsl_generator.preview_sample(self.qsos, 20)), 10)
+        self.assertEqual(qsl_generator.preview_sample(self.qsos[:2], 1), self.qsos[:1])
+
+    def test_preview(self):
+        images = qsl_generator.generate_preview(self.qsos, count=3, workers=2)
+        self.assertEqual(images, [os.path.join(qsl_generator.PREVIEW_FOLDER,
+                                               qsl_generator.PREVIEW_BASE_NAME % i) for i in range(3)])
+        with open(images[2], 'rt', encoding='utf-8') as f:
+            self.assertIn('F4ÉLA', f.read())
+        # Nothing recorded for a preview
+        self.assertFalse(os.path.exists(qsl_generator.OUT_FOLDER))
+        with self.assertRaises(FileNotFoundError):
+            qsl_generator.generate_preview(self.qsos, 'missing.html')
+
+    def test_watch(self):
+        with open(os.path.join(qsl_generator.TEMPLATE_FOLDER, 'preview.html'), 'wt') as f:
+            f.write("<p>{{ qso.call }}</p>")
+        renders = []
+        stop = threading.Event()
+        thread = threading.Thread(target=qsl_generator.watch_preview,
+                                  args=(self.qsos, stop, 'preview.html'),
+                                  kwargs={'interval': 0.05, 'count': 2, 'on_render': renders.append})
+        thread.start()
+        try:
+            for _ in range(100):
+                if renders:
+                    break
+                time.sleep(0.05)
+            with open(os.path.join(qsl_generator.TEMPLATE_FOLDER, 'preview.html'), 'wt') as f:
+                f.write("<p>Edited {{ qso.call }}</p>")
+            for _ in range(100):
+                if len(renders) > 1:
+                    break
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(len(renders), 2)
+        with open(renders[1][0], 'rt', encoding='utf-8') as f:
+            self.assertEqual(f.read(), '<p>Edited K7AA</p>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,10 @@
 # Unit test for QSO class
 
 import unittest
-from qso import QSO
+from datetime import datetime, timezone
+from decimal import Decimal
+import adif
+from qso import ADIF_CHECKS, QSO, QsoValidator, freq_to_band
 
 
 class TestQSO(unittest.TestCase):
@@ -53,6 +56,81 @@ class TestQSO(unittest.TestCase):
         self.assertIn('CALL', q._d)
         self.assertEqual(q._d['CALL'], 'k1abc')
 
+    def test_freq_to_band(self):
+        self.assertEqual(freq_to_band('14.074'), '20m')
+        self.assertEqual(freq_to_band(144.3), '2m')
+        self.assertIsNone(freq_to_band('11.0'))
+        self.assertIsNone(freq_to_band('abc'))
+
+    def test_typed_accessors(self):
+        q = QSO({'QSO_DATE': '20240204', 'TIME_ON': '1425', 'FREQ': '28.38',
+                 'DISTANCE': '6359', 'CQZ': '5', 'LAT': 'N041 39.374', 'LON': 'W070 21.110'})
+        self.assertEqual(q.datetime_on, datetime(
+            2024, 2, 4, 14, 25, tzinfo=timezone.utc))
+        self.assertEqual(q.freq, 28.38)
+        self.assertEqual(q.freq_decimal, Decimal('28.38'))
+        self.assertEqual(q.distance, 6359)
+        self.assertEqual(q.cqz, 5)
+        self.assertAlmostEqual(q.lat, 41.6562333, places=6)
+        self.assertAlmostEqual(q.lon, -70.3518333, places=6)
+        # Missing or malformed values
+        self.assertIsNone(q.dxcc)
+        self.assertIsNone(QSO({'QSO_DATE': '2024', 'TIME_ON': '1425'}).datetime_on)
+        self.assertIsNone(QSO({'LAT': '41.5'}).lat)
+
+    def test_typed_accessor_cache(self):
+        q = QSO({'QSO_DATE': '20240204', 'TIME_ON': '142530'})
+        dt = q.datetime_on
+        self.assertEqual(dt.second, 30)
+        # Conversion happens only once
+        q._d['TIME_ON'] = '000000'
+        self.assertIs(q.datetime_on, dt)
+
+
+
+class TestQsoValidator(unittest.TestCase):
+
+    QSOS = [
+        {'CALL': 'W1AW', 'QSO_DATE': '20230101', 'TIME_ON': '1200', 'BAND': '20M', 'MODE': 'CW'},
+        {'CALL': 'W1AW', 'QSO_DATE': '20230101', 'TIME_ON': '1200', 'FREQ': '14.1', 'MODE': 'CW'},
+        {'CALL': 'W1AW', 'QSO_DATE': '20230101', 'MODE': 'CW'},
+        {'CALL': 'W1AW', 'QSO_DATE': '20231301', 'TIME_ON': '2400', 'BAND': '20m', 'MODE': 'CW',
+         'QSL_SENT': 'X', 'DXCC': '291'},
+        {'CALL': 'W1AW', 'QSO_DATE': '20230101', 'TIME_ON': '120000', 'BAND': '11m', 'MODE': 'CW'},
+    ]
+
+    def test_essential_fields(self):
+        qso_list = [QSO(d) for d in self.QSOS]
+        report = QsoValidator().validate(qso_list)
+        self.assertEqual(list(report.mask), [q.is_valid() for q in qso_list])
+        self.assertEqual(list(report.mask), [1, 1, 0, 1, 1])
+        self.assertEqual(dict(report.reasons), {
+            'Essential field TIME_ON not found': 1,
+            "No fields among ['FREQ', 'BAND'] found": 1})
+        self.assertEqual(report.invalid, 1)
+        self.assertEqual(report.select(qso_list), qso_list[:2] + qso_list[3:])
+
+    def test_adif_checks(self):
+        report = QsoValidator(checks=ADIF_CHECKS).validate(self.QSOS)
+        self.assertEqual(list(report.mask), [1, 1, 0, 0, 0])
+        self.assertEqual(report.reasons['Invalid Date value for QSO_DATE'], 1)
+        self.assertEqual(report.reasons['Invalid Time value for TIME_ON'], 1)
+        self.assertEqual(report.reasons['Invalid QSL Sent value for QSL_SENT'], 1)
+        self.assertEqual(report.reasons['Invalid Band value for BAND'], 1)
+        self.assertNotIn('Invalid Integer value for DXCC', report.reasons)
+
+    def test_columns(self):
+        validator = QsoValidator(checks=ADIF_CHECKS)
+        columns = {field: [d.get(field) for d in self.QSOS] for field in validator.fields}
+        self.assertEqual(validator.validate_columns(columns, len(self.QSOS)).mask,
+                         validator.validate(self.QSOS).mask)
+
+    def test_sample_log(self):
+        qso_list = adif.qso_list_from_file('iu4pra_sample_log.adi')
+        report = QsoValidator(checks=ADIF_CHECKS).validate(qso_list)
+        self.assertEqual(report.invalid, 0)
+        self.assertEqual(len(report.mask), 200)
+
 
 if __name__ == '__main__':
     unittest.main()
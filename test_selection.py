@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Unit test for selection expressions
+
+import unittest
+import adif
+from qso import QSO
+from selection import Selection, SelectionError
+
+
+class TestSelection(unittest.TestCase):
+
+    def test_comparisons(self):
+        q = QSO({'CALL': 'W1AW', 'BAND': '20m', 'QSL_SENT': 'N',
+                 'QSO_DATE': '20240315', 'FREQ': '14.074'})
+        self.assertTrue(Selection('band in (20m,40m)')(q))
+        self.assertTrue(Selection("call == 'w1aw'")(q))
+        self.assertTrue(Selection('qso_date >= 20240101 and qsl_sent = N')(q))
+        self.assertFalse(Selection('qso_date < 20240101')(q))
+        # Numeric comparison
+        self.assertTrue(Selection('freq > 7.2')(q))
+        self.assertTrue(Selection('freq == 14.0740')(q))
+        self.assertTrue(Selection('not band not in (20M) or mode == CW')(q))
+        self.assertFalse(Selection('(band == 40m or band == 80m) and call == W1AW')(q))
+
+    def test_missing_field(self):
+        q = QSO({'CALL': 'W1AW'})
+        self.assertFalse(Selection('qsl_sent == Y')(q))
+        self.assertTrue(Selection('qsl_sent != Y')(q))
+
+    def test_partial_evaluation(self):
+        s = Selection('band == 20m and (qsl_sent == N or mode == CW)')
+        self.assertEqual(s.fields, frozenset(['BAND', 'QSL_SENT', 'MODE']))
+        self.assertIsNone(s.decide({'BAND': '20m'}))
+        self.assertFalse(s.decide({'BAND': '40m'}))
+        self.assertTrue(s.decide({'BAND': '20m', 'MODE': 'CW'}))
+
+    def test_syntax_errors(self):
+        for expression in ['', 'band ==', 'band in 20m', '(band == 20m', 'band == 20m mode', 'band ! 20m']:
+            with self.assertRaises(SelectionError):
+                Selection(expression)
+
+    def test_parser_pushdown(self):
+        # Selection applied while parsing agrees with filtering afterwards
+        expression = 'band in (20m, 40m) and qsl_rcvd == N'
+        qso_list = adif.qso_list_from_file('iu4pra_sample_log.adi')
+        expected = [q._d for q in qso_list if Selection(expression)(q)]
+        reader = adif.AdifReader(select=expression)
+        with open('iu4pra_sample_log.adi', 'rt') as f:
+            records = reader.feed(f.read()) + reader.close()
+        self.assertGreater(len(expected), 0)
+        self.assertEqual(records, expected)
+        self.assertEqual(reader.record_count, 200)
+        self.assertEqual(reader.rejected_count, 200 - len(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
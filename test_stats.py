@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Unit test for the log statistics
+
+import adif
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from qso import QSO
+from stats import HyperLogLog, LogStats, load_state, save_state
+
+
+class TestLogStats(unittest.TestCase):
+
+    def test_counts(self):
+        stats = LogStats()
+        stats.update([
+            QSO({'CALL': 'W1AW', 'BAND': '20M', 'MODE': 'cw', 'DXCC': '291',
+                 'QSL_SENT': 'Y', 'QSL_RCVD': 'N'}),
+            QSO({'CALL': 'w1aw', 'FREQ': '7.074', 'MODE': 'FT8', 'DXCC': '291',
+                 'LOTW_QSL_RCVD': 'Y'}),
+            QSO({'CALL': 'IU4PRA', 'BAND': '20m', 'MODE': 'FT8', 'DXCC': '248'}),
+        ])
+        summary = stats.to_dict()
+        self.assertEqual(summary['qsos'], 3)
+        self.assertEqual(summary['unique_calls'], 2)
+        self.assertEqual(summary['bands'], {'20m': 2, '40m': 1})
+        self.assertEqual(summary['modes'], {'FT8': 2, 'CW': 1})
+        self.assertEqual(summary['band_modes'], {'20m': {'CW': 1, 'FT8': 1},
+                                                 '40m': {'FT8': 1}})
+        self.assertEqual(summary['dxcc'], {'worked': 2, 'confirmed': 1,
+                                           'unconfirmed': [248]})
+        self.assertEqual(summary['qsl_sent'], {'Y': 1, 'unknown': 2})
+        self.assertEqual(summary['qsl_rcvd'], {'N': 1, 'unknown': 2})
+
+    def test_file_matches_list(self):
+        # Streaming pass over the file agrees with counting the parsed list
+        expected = LogStats()
+        expected.update(adif.qso_list_from_file('iu4pra_sample_log.adi'))
+        stats = LogStats()
+        self.assertEqual(stats.update_file('iu4pra_sample_log.adi'), 200)
+        self.assertEqual(stats.to_dict(), expected.to_dict())
+        # Nothing new on the second call
+        self.assertEqual(stats.update_file('iu4pra_sample_log.adi'), 0)
+        self.assertEqual(stats.qsos, 200)
+
+    def test_hyperloglog(self):
+        hll = HyperLogLog()
+        for i in range(20000):
+            hll.add(f'CALL{i}')
+            hll.add(f'CALL{i}')
+        self.assertLess(abs(len(hll) - 20000), 20000 * 0.03)
+        self.assertEqual(len(HyperLogLog.from_state(hll.state())), len(hll))
+        stats = LogStats(approximate=True)
+        stats.update_file('iu4pra_sample_log.adi')
+        exact = LogStats()
+        exact.update_file('iu4pra_sample_log.adi')
+        self.assertLess(abs(stats.to_dict()['unique_calls'] - exact.to_dict()['unique_calls']), 3)
+
+
+class TestIncrementalStats(unittest.TestCase):
+
+    RECORD = "<CALL:5>K1A%02d <QSO_DATE:8>20240101 <TIME_ON:4>1200 <BAND:3>20m <MODE:2>CW <EOR>\n"
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.log = os.path.join(self.folder, 'log.adi')
+        self.state = os.path.join(self.folder, 'stats.json')
+        with open(self.log, 'wt') as f:
+            f.write("Log <EOH>\n" + ''.join(self.RECORD % i for i in range(3)))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_appended_records(self):
+        stats = load_state(self.state)
+        stats.update_file(self.log)
+        save_state(stats, self.state)
+        with open(self.log, 'at') as f:
+            # The last record is still being written
+            f.write(''.join(self.RECORD % i for i in range(3, 5)) + "<CALL:5>K1A05 <QSO_")
+        stats = load_state(self.state)
+        self.assertEqual(stats.qsos, 3)
+        self.assertEqual(stats.update_file(self.log), 2)
+        self.assertEqual(stats.to_dict()['unique_calls'], 5)
+        with open(self.log, 'at') as f:
+            f.write("DATE:8>20240101 <EOR>\n")
+        self.assertEqual(stats.update_file(self.log), 1)
+        self.assertEqual(stats.to_dict()['unique_calls'], 6)
+        # A rewritten log must be counted again
+        with open(self.log, 'wt') as f:
+            f.write(self.RECORD % 0)
+        with self.assertRaises(ValueError):
+            stats.update_file(self.log)
+
+    def test_options_mismatch(self):
+        stats = LogStats(select='band == 40m')
+        stats.update_file(self.log)
+        save_state(stats, self.state)
+        self.assertEqual(load_state(self.state, select='band == 40m').offsets, stats.offsets)
+        self.assertEqual(load_state(self.state).offsets, {})
+        with open(self.state, 'rt') as f:
+            self.assertEqual(json.load(f)['qsos'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
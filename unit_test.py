@@ -7,6 +7,8 @@
 import adif
 import logging
 from qso import QSO
+import subprocess
+import sys
 import unittest
 
 
@@ -99,6 +101,51 @@ class QSOTest(unittest.TestCase):
         self.assertTrue(_qso_list[0].is_valid())
 
 
+class ImportTimeTest(unittest.TestCase):
+    """Test cases for the startup cost of the modules"""
+
+    # Modules only needed to render, export or print
+    HEAVY_MODULES = ['jinja2', 'pypdf', 'sqlite3', 'wkhtml', 'logdb', 'pickle']
+
+    # Generous budget for the cumulative import time of a module, in seconds
+    BUDGET = 0.5
+
+    def import_time(self, module: str):
+        """Imports module in a new interpreter with -X importtime, returns
+        (cumulative import time in seconds, set of the modules loaded)"""
+        ret = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, check=True)
+        loaded = {}
+        for line in ret.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            parts = line.split('|')
+            if len(parts) == 3 and parts[1].strip().isdigit():
+                loaded[parts[2].strip()] = int(parts[1]) / 1e6
+        return loaded[module], set(loaded)
+
+    def test_parsing_modules(self):
+        """Parsing and validating logs don't load the rendering stacks"""
+        for module in ['adif', 'qso', 'selection']:
+            with self.subTest(module=module):
+                seconds, loaded = self.import_time(module)
+                self.assertFalse(loaded & set(self.HEAVY_MODULES))
+                self.assertLess(seconds, self.BUDGET)
+
+    def test_generator_module(self):
+        """The generator and the GUI import the rendering stacks on first use"""
+        modules = ['qsl_generator']
+        try:
+            import tkinter
+            modules.append('gui')
+        except ImportError:
+            pass
+        for module in modules:
+            with self.subTest(module=module):
+                seconds, loaded = self.import_time(module)
+                self.assertFalse(loaded & set(self.HEAVY_MODULES))
+                self.assertLess(seconds, self.BUDGET)
+
+
 # Automatically run tests when this module is executed
 if __name__ == '__main__':
     # Override logging configuration to show only critical errors
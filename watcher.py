@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+
+# This software under the MIT License
+# Watch mode: renders the QSOs appended to a log as it is written
+
+"""
+Log Watcher Module
+
+Monitors an ADIF log file, or all the .adi/.adif files of a folder, and
+renders new QSOs as soon as the logger writes them. Started with
+
+    python qsl_generator.py watch <log file or folder> [options]
+
+Changes are detected with inotify on Linux (no CPU used while idle) and by
+polling the file size and modification time elsewhere. Writes are debounced
+and only the records appended since the last check are parsed. Each group of
+new QSOs is rendered into a dated batch folder of the output folder.
+"""
+
+import adif
+import argparse
+import ctypes
+import ctypes.util
+import glob
+import logging
+import os
+import platform
+import qsl_generator
+import select
+import threading
+import time
+from ledger import LEDGER_DEFAULT_FILE, QslLedger
+from qso import IDENTITY_FIELDS
+
+# Log file extensions watched in folders
+LOG_EXTENSIONS = ['adi', 'adif']
+
+# Batch folder name, from the batch time
+BATCH_FOLDER_FORMAT = qsl_generator.BATCH_FOLDER_FORMAT
+
+
+class _InotifyMonitor:
+    """Change monitor based on Linux inotify"""
+
+    # inotify event masks
+    _IN_MODIFY = 0x002
+    _IN_CLOSE_WRITE = 0x008
+    _IN_MOVED_TO = 0x080
+    _IN_CREATE = 0x100
+
+    def __init__(self, folder: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c')
+                           or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self._IN_MODIFY | self._IN_CLOSE_WRITE | self._IN_MOVED_TO | self._IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(folder), mask) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout: float):
+        """Waits for a change in the folder, returns False on timeout"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        # Discard the events, only the fact that something changed matters
+        try:
+            while os.read(self._fd, 1 << 16):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PollingMonitor:
+    """Change monitor comparing size and modification time of the files"""
+
+    def __init__(self, list_files, interval: float):
+        self._list_files = list_files
+        self.interval = interval
+        self._signature = self._current()
+
+    def _current(self):
+        signature = {}
+        for path in self._list_files():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature[path] = (stat.st_size, stat.st_mtime_ns)
+        return signature
+
+    def wait(self, timeout: float):
+        """Waits for a change in the files, returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self._current()
+            if current != self._signature:
+                self._signature = current
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class LogWatcher:
+    """Watches a log file or a folder of logs for appended QSOs"""
+
+    def __init__(self, path: str, from_start: bool = False, select=None, fields=None,
+                 use_inotify: bool = None, interval: float = 2.0):
+        """path is a log file or a folder. Existing QSOs are skipped unless
+        from_start is True. select and fields are passed to the parser.
+        use_inotify None means inotify when available, polling every interval
+        seconds otherwise."""
+        self.path = path
+        self.select = select
+        self.fields = fields
+        # Byte offset of the first unread record of each file
+        self._offsets = {}
+        if not from_start:
+            for f in self.log_files():
+                self._offsets[f] = adif.last_record_end(f)
+
+        folder = path if os.path.isdir(path) else os.path.dirname(
+            os.path.abspath(path))
+        self._monitor = None
+        if use_inotify is not False and platform.system() == 'Linux':
+            try:
+                self._monitor = _InotifyMonitor(folder)
+            except (OSError, AttributeError) as e:
+                if use_inotify:
+                    raise
+                logging.info(f"inotify not available ({e}), polling")
+        if self._monitor is None:
+            self._monitor = _PollingMonitor(self.log_files, interval)
+
+    def close(self):
+        self._monitor.close()
+
+    def log_files(self):
+        """Log files currently watched"""
+        if not os.path.isdir(self.path):
+            return [self.path] if os.path.isfile(self.path) else []
+        return sorted(f for ext in LOG_EXTENSIONS
+                      for f in glob.glob(os.path.join(self.path, f'*.{ext}')))
+
+    def new_qsos(self):
+        """QSOs appended to the logs since the last call"""
+        qso_list = []
+        for f in self.log_files():
+            try:
+                # A bad record must not stall the watch, it is skipped.
+                # Records being written have no EOR yet and are left for the
+                # next change
+                new, self._offsets[f] = adif.read_appended_qsos(f, self._offsets.get(f, 0), select=self.select,
+                                                                fields=self.fields, skip_invalid=True)
+            except (adif.AdifError, OSError) as e:
+                logging.warning(f"{f}: {e}")
+                continue
+            if new:
+                logging.info(f"{len(new)} new QSO(s) in {f}")
+            qso_list += new
+        return qso_list
+
+    def wait(self, timeout: float, debounce: float = 1.0):
+        """Waits for a change, then until the logs are quiet for debounce seconds
+
+        Returns False if nothing changed within timeout"""
+        if not self._monitor.wait(timeout):
+            return False
+        while self._monitor.wait(debounce):
+            pass
+        return True
+
+
+def render_batch(qso_list: list, out_folder: str, image: bool = False, **kwargs):
+    """Renders a batch of QSOs into a new dated folder of out_folder, returns the folder"""
+    batch = qsl_generator.new_batch_folder(out_folder)
+    if image:
+        qsl_generator.generate_qsl_image(qso_list, _out_folder=batch, **kwargs)
+    else:
+        qsl_generator.generate_qsl_pdf(qso_list, _out_folder=batch, **kwargs)
+    logging.info(f"{len(qso_list)} QSL(s) rendered in {batch}")
+    return batch
+
+
+def watch(watcher: LogWatcher, out_folder: str, stop: threading.Event = None, debounce: float = 1.0,
+          image: bool = False, **kwargs):
+    """Renders the new QSOs of the watcher until stop is set
+
+    kwargs are passed to the QSL generator"""
+    stop = stop or threading.Event()
+    # Records already complete when the watch starts
+    pending = watcher.new_qsos()
+    while not stop.is_set():
+        if pending:
+            render_batch(pending, out_folder, image, **kwargs)
+        # Short timeout, so that stop is checked regularly
+        pending = watcher.new_qsos() if watcher.wait(1.0, debounce) else []
+
+
+def main(argv: list = None):
+    """Command line entry point of the watch mode"""
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s: %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(prog='qsl_generator.py watch',
+                                     description="Render the QSOs appended to a log while it is written")
+    parser.add_argument('path', type=str,
+                        help='Log file or folder of logs to watch')
+    parser.add_argument('--image', action='store_true',
+                        help='Output as images instead of PDF')
+    parser.add_argument('--template', metavar='template_file', type=str, default=qsl_generator.TEMPLATE_DEFAULT_FILE,
+                        help=f'Template to use (default {qsl_generator.TEMPLATE_DEFAULT_FILE})')
+    parser.add_argument('--output-dir', metavar='output_folder', type=str, default=qsl_generator.OUT_FOLDER,
+                        help=f'Folder of the batch folders (default {qsl_generator.OUT_FOLDER})')
+    parser.add_argument('--select', metavar='expression', type=str, default=None,
+                        help='Only render the QSOs matching the expression')
+    parser.add_argument('--from-start', action='store_true',
+                        help='Render the QSOs already in the logs too')
+    parser.add_argument('--debounce', metavar='seconds', type=float, default=1.0,
+                        help='Quiet time after a write before rendering (default 1)')
+    parser.add_argument('--interval', metavar='seconds', type=float, default=2.0,
+                        help='Polling interval when inotify is not available (default 2)')
+    parser.add_argument('--ledger', metavar='ledger_file', type=str, default=LEDGER_DEFAULT_FILE,
+                        help=f'Ledger of the printed QSOs (default {LEDGER_DEFAULT_FILE})')
+    parser.add_argument('--no-ledger', action='store_true',
+                        help='Do not record the printed QSOs in the ledger')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        raise FileNotFoundError(f"{args.path} doesn't exist")
+
+    fields = qsl_generator._projection(args.template, None)
+    ledger = None
+    if not args.no_ledger:
+        ledger = QslLedger(args.ledger)
+        if fields is not None:
+            fields |= set(IDENTITY_FIELDS)
+
+    watcher = LogWatcher(args.path, from_start=args.from_start, select=args.select,
+                         fields=fields, interval=args.interval)
+    logging.info(f"Watching {args.path}")
+    try:
+        watch(watcher, args.output_dir, debounce=args.debounce, image=args.image,
+              _template=args.template, fields=fields, ledger=ledger)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+if __name__ == '__main__':
+    main()